@@ -0,0 +1,34 @@
+#ifndef FACET_BILINEAR_H
+#define FACET_BILINEAR_H
+
+#include <math.h>
+
+//Bilinear interpolation of an RDC image at (ranpix, azpix), used to geocode
+//images with the transformation LUT.  line1 and line2 point to the image
+//lines floor(azpix) and ceil(azpix).  The caller checks that the position
+//lies inside the image (0 < ranpix < width-1, 0 < azpix < height-1).
+//Consecutive samples of the lines are stride floats apart (e.g., 2 for the
+//real or imaginary part of a complex image).
+inline float bilinear_interp(float ranpix, float azpix, const float *line1, const float *line2, int stride = 1)
+{
+	float x1, x2, y1, y2;
+	int ix1, ix2;
+
+	x1 = floor(ranpix); ix1 = (int)x1*stride;
+	x2 = ceil(ranpix); ix2 = (int)x2*stride;
+	y1 = floor(azpix);
+	y2 = ceil(azpix);
+	if (fabs(ranpix-x1) < 1.0e-5 && fabs(azpix-y1) < 1.0e-5)
+		return line1[ix1];
+	else if (fabs(ranpix-x1) < 1.0e-5)
+		return (y2-azpix)*line1[ix1] + (azpix-y1)*line2[ix1];
+	else if (fabs(azpix-y1) < 1.0e-5)
+		return (x2-ranpix)*line1[ix1] + (ranpix-x1)*line1[ix2];
+	else
+		return (x2-ranpix)*(y2-azpix)*line1[ix1]
+		       + (ranpix-x1)*(y2-azpix)*line1[ix2]
+		       + (x2-ranpix)*(azpix-y1)*line2[ix1]
+		       + (ranpix-x1)*(azpix-y1)*line2[ix2];
+}
+
+#endif
@@ -9,6 +9,10 @@
 #include <vector>
 #include "math_uavsar.h"
 
+//Covariance matrix terms calibrated together when the polarization is COV:
+//the diagonal (intensity) terms first, then the off-diagonal (complex) terms.
+const char *const COV_TERMS[6] = {"HHHH", "HVHV", "VVVV", "HHHV", "HHVV", "HVVV"};
+
 void load_ann(par_struct &par, peg_struct &peg){
 
 	//This subroutine will load auxiliary information from UAVSAR annotation file *.ann
@@ -27,6 +31,11 @@ void load_ann(par_struct &par, peg_struct &peg){
 	while (getline(infofile, line)){
 		std::istringstream stream(line, std::istringstream::in);
 		stream >> dum[0];
+		if (par.pol == "COV"){
+			for (int k = 0; k < 6; ++k)
+				if (dum[0] == std::string("mlc") + COV_TERMS[k])
+					stream >> dum[1] >> par.mlc_cov[k];
+		}
 		if (dum[0] == "mlc" + par.pol){
 			stream >> dum[1] >> par.mlc;
 			continue;
@@ -27,6 +27,7 @@ struct par_struct {
 	double delta_az, delta_R, delta_t_az, Ro, so, co, spc_lat, spc_lon, corner_lat, corner_lon, glob_inc, az, gavgalt, gavgterhgt, 
                pitch, ESA, yaw, d;
 	std::string ann, mlc, dem, cor_out, pol;
+	std::string mlc_cov[6];
 };
 
 struct XYZ {
@@ -155,66 +156,127 @@ XYZ ECEF_transform (XYZ rhoT, double lat, double lon){
 	return rho;
 }
 
-XYZ llh2sch(double lat, double lon, double h, par_struct par, peg_struct peg){
-
-	//This subroutine converts latitude/longitude/height to SCH
-	//Default values are for WGS-84 ellipsoid
-	
-	double Nh, Nh_peg, rn, ra, ceta, seta, clat, slat, clon, slon, clat_peg, slat_peg, clon_peg, slon_peg, clambda, stheta, 
-               T11, T12, T13, T21, T22, T23, T31, T32, T33;
+void init_peg(peg_struct &peg){
+
+	//This subroutine computes the ECEF position of the peg point and the
+	//radii of curvature of the ellipsoid at the peg point, including the
+	//radius of the sphere approximating it along the peg heading
+
+	XYZ temp_raU;
+
+	peg.pos = llh2ecef(peg.lat, peg.lon, 0.0f);
+	peg.re = WGS84_A/sqrt(1.0-WGS84_E2*sin(peg.lat)*sin(peg.lat));
+	peg.rn = WGS84_A*(1.0-WGS84_E2)/sqrt(POW3(1.0-WGS84_E2*sin(peg.lat)*sin(peg.lat)));
+	peg.ra = peg.re*peg.rn/(peg.re*cos(peg.heading)*cos(peg.heading) + peg.rn*sin(peg.heading)*sin(peg.heading)); //Radius of approximating sphere at peg
+	temp_raU.x = 0; temp_raU.y = 0; temp_raU.z = peg.ra;
+	peg.raU = ECEF_transform(temp_raU, peg.lat, peg.lon);
+}
+
+struct peg_transform {
+
+	//Terms of the LLH to SCH conversion which only depend on the peg point
+	double T[3][3];	//rotation matrix from ECEF to UTC
+	XYZ origin;	//center of the approximating sphere (ECEF)
+	double ra;	//radius of the approximating sphere
+
+};
+
+struct lat_terms {
+
+	//Terms of the LLH to SCH conversion which only depend on the latitude
+	double clat, slat, Nh;
+
+};
+
+peg_transform make_peg_transform(const peg_struct &peg){
+
+	//This subroutine computes the rotation matrix from ECEF to UTC and the
+	//center of the approximating sphere at the peg point, so that they can
+	//be reused for every point converted with llh2sch
+	
+	double ceta, seta, clat_peg, slat_peg, clon_peg, slon_peg;
+	peg_transform pt;
 
-	XYZ X, UTC, SCH, temp;
-
-	//Compute trigonometric operations for later use
 	ceta = cos(peg.heading);
 	seta = sin(peg.heading);
-	clat = cos(lat);
-	slat = sin(lat);
-	clon = cos(lon);
-	slon = sin(lon);
 	clat_peg = cos(peg.lat);
 	slat_peg = sin(peg.lat);
 	clon_peg = cos(peg.lon);
-	slon_peg = sin(peg.lon);
-	
-	//Ellipsoid parameters
-	Nh = WGS84_A/sqrt(1.0-WGS84_E2*slat*slat);
-	
-	//Convert current DEM point to WGS84 XYZ
-	X.x = (Nh+h)*clat*clon;
-	X.y = (Nh+h)*clat*slon;
-	X.z = (Nh+h-WGS84_E2*Nh)*slat;
+	slon_peg = sin(peg.lon);
+
+	pt.T[0][0] = clat_peg*clon_peg;
+	pt.T[0][1] = clat_peg*slon_peg;
+	pt.T[0][2] = slat_peg;
+	pt.T[1][0] = -seta*slon_peg-ceta*clon_peg*slat_peg;
+	pt.T[1][1] = clon_peg*seta-ceta*slat_peg*slon_peg;
+	pt.T[1][2] = ceta*clat_peg;
+	pt.T[2][0] = ceta*slon_peg-seta*clon_peg*slat_peg;
+	pt.T[2][1] = -clon_peg*ceta-seta*slat_peg*slon_peg;
+	pt.T[2][2] = clat_peg*seta;
+
+	pt.origin = subXYZ(peg.pos, peg.raU);
+	pt.ra = peg.ra;
+	return pt;
+}
+
+lat_terms make_lat_terms(double lat){
 
-	//std::cout << std::setw(20) << std::setprecision(15) << X.x << std::setw(20) << std::setprecision(15) << X.y << std::setw(20) << std::setprecision(15) << X.z << "\n";
+	//This subroutine computes the trigonometric terms and the ellipsoid radius
+	//of curvature for a latitude (WGS-84), shared by the points of a DEM line
+
+	lat_terms lt;
+	lt.clat = cos(lat);
+	lt.slat = sin(lat);
+	lt.Nh = WGS84_A/sqrt(1.0-WGS84_E2*lt.slat*lt.slat);
+	return lt;
+}
+
+XYZ llh2sch(const peg_transform &pt, const lat_terms &lt, double clon, double slon, double h){
+
+	//This subroutine converts latitude/longitude/height to SCH, given the
+	//precomputed peg and latitude terms and the cosine and sine of the
+	//longitude
 	
+	double clambda, stheta;
+	XYZ X, UTC, SCH, temp;
+
+	//Convert current DEM point to WGS84 XYZ
+	X.x = (lt.Nh+h)*lt.clat*clon;
+	X.y = (lt.Nh+h)*lt.clat*slon;
+	X.z = (lt.Nh+h-WGS84_E2*lt.Nh)*lt.slat;
+
 	//Temp position vector
-	temp = subXYZ(X, subXYZ(peg.pos, peg.raU));
-		
-	//Rotation matrix from ECEF to UTC
-	T11 = clat_peg*clon_peg;
-	T12 = clat_peg*slon_peg;
-	T13 = slat_peg;
-	T21 = -seta*slon_peg-ceta*clon_peg*slat_peg;
-	T22 = clon_peg*seta-ceta*slat_peg*slon_peg;
-	T23 = ceta*clat_peg;
-	T31 = ceta*slon_peg-seta*clon_peg*slat_peg;
-	T32 = -clon_peg*ceta-seta*slat_peg*slon_peg;
-	T33 = clat_peg*seta;
+	temp = subXYZ(X, pt.origin);
 
 	//Compute UTC coordinates
-	UTC.x = T11*temp.x + T12*temp.y + T13*temp.z;
-	UTC.y = T21*temp.x + T22*temp.y + T23*temp.z;
-	UTC.z = T31*temp.x + T32*temp.y + T33*temp.z;
+	UTC.x = pt.T[0][0]*temp.x + pt.T[0][1]*temp.y + pt.T[0][2]*temp.z;
+	UTC.y = pt.T[1][0]*temp.x + pt.T[1][1]*temp.y + pt.T[1][2]*temp.z;
+	UTC.z = pt.T[2][0]*temp.x + pt.T[2][1]*temp.y + pt.T[2][2]*temp.z;
 	
 	//Compute SCH coordinates
 	clambda = atan(UTC.z/sqrt(UTC.x*UTC.x + UTC.y*UTC.y));
 	stheta = atan(UTC.y/UTC.x);
-	SCH.x = peg.ra*stheta;
-	SCH.y = peg.ra*clambda;
+	SCH.x = pt.ra*stheta;
+	SCH.y = pt.ra*clambda;
 	SCH.z = h;
 
 	return SCH;
-	
+}
+
+XYZ llh2sch(double lat, double lon, double h, const par_struct &, const peg_struct &peg){
+
+	//This subroutine converts latitude/longitude/height to SCH
+	//Default values are for WGS-84 ellipsoid
+	//(for many points, compute the peg and latitude terms once instead)
+
+	return llh2sch(make_peg_transform(peg), make_lat_terms(lat), cos(lon), sin(lon), h);
+}
+
+double antenna_pattern(double r_look){
+
+	//This subroutine computes the two-way amplitude gain of the antenna for a look angle
+
+	return pow(sin((r_look-0.785398)*PI*1.5)/((r_look-0.785398)*PI*1.5),2);
 }
 
 void compute_area_fe(peg_struct peg, par_struct par, std::vector<float> &area){
@@ -0,0 +1,171 @@
+"""Parsed UAVSAR annotation (.ann) files.
+
+The annotation file of a scene is read by batchcal, genHDRfromTXT (once for
+every header it writes), runcal, complexRTC, the geometry cache, and by
+uavsar_calib itself.  Here it is parsed once into a dictionary of typed
+values, keyed by parameter name: the text before the units and the equals
+sign, with the whitespace collapsed (e.g., 'grd_pwr.set_rows', 'mlcHHHH', or
+'Peg Latitude').  Comments (after a semicolon) are removed.
+
+Parsed files are memoized by path and modification time, so a batch run
+which writes many headers for a scene only reads its annotation file once.
+
+Example:
+
+    ann = annotation.load(annfile)
+    grd_rows = ann['grd_pwr.set_rows']
+    par = ann.calib_params('HHHH')
+"""
+
+import math
+import os
+
+
+# Same constants as math_uavsar.h.
+RAD = 0.0174532925199433
+PI_HALF = 1.5707963267949
+
+# Covariance matrix terms, in the order uavsar_calib calibrates them with
+# the COV polarization (as in load_ann.h): the diagonal terms first.
+COV_TERMS = ['HHHH', 'HVHV', 'VVVV', 'HHHV', 'HHVV', 'HVVV']
+
+
+def _parseline(line):
+    """Returns the (name, value string) of an annotation file line, or
+    (None, None) if the line does not contain a parameter."""
+    line = line.split(';')[0]
+    if '=' not in line:
+        return None, None
+    name, value = line.split('=', 1)
+    name = ' '.join(name.split('(')[0].split())
+    if name == '':
+        return None, None
+    return name, value.strip()
+
+
+def _typed(value):
+    """Converts a parameter value string to an int or float, if possible."""
+    for convert in (int, float):
+        try:
+            return convert(value)
+        except ValueError:
+            pass
+    return value
+
+
+class Annotation(object):
+    """Parameters of a UAVSAR annotation file.
+
+        Values are accessed by parameter name, e.g., ann['grd_pwr.set_rows'].
+        Numbers are returned as int or float, and other values as strings.
+        If a parameter appears more than once, the last value is used (as in
+        load_ann.h).
+
+        Arguments:
+            annfile (str): Path and filename of the annotation file.
+
+    """
+    def __init__(self, annfile):
+        self.annfile = annfile
+        self.strings = {}
+        self.values = {}
+
+        with open(annfile, 'r') as ann:
+            for line in ann:
+                name, value = _parseline(line)
+                if name is not None:
+                    self.strings[name] = value
+                    self.values[name] = _typed(value)
+
+    def __getitem__(self, name):
+        if name not in self.values:
+            raise KeyError('annotation -- Parameter {} not found in {}.'.format(name, self.annfile))
+        return self.values[name]
+
+    def __contains__(self, name):
+        return name in self.values
+
+    def get(self, name, default=None):
+        """Returns the value of a parameter, or default if it is missing."""
+        return self.values.get(name, default)
+
+    def string(self, name):
+        """Returns the value of a parameter exactly as written in the file."""
+        if name not in self.strings:
+            raise KeyError('annotation -- Parameter {} not found in {}.'.format(name, self.annfile))
+        return self.strings[name]
+
+    def calib_params(self, pol=None):
+        """Returns the parameters uavsar_calib reads from the annotation file
+        (see load_ann.h), converted in the same way: angles in radians, and
+        the starting range in meters, moved to the middle of the range looks.
+
+            Arguments:
+                pol (str): Polarization (e.g., 'HHHH'), used to find the MLC
+                    filename.  If None, the MLC filename is left out, so that
+                    the parameters are the same for every polarization.
+
+            Returns:
+                par (dict): Parameters, keyed by the names of the par_struct
+                    and peg_struct fields in load_ann.h (the peg fields with a
+                    'peg_' prefix).
+
+        """
+        look = self['Look Direction']
+        if look != 'Left':
+            raise ValueError('annotation -- Look direction is not \'Left\' in {}.'.format(self.annfile))
+
+        par = {'height': self['mlc_pwr.set_rows'],
+               'width': self['mlc_pwr.set_cols'],
+               'so': self['mlc_pwr.row_addr'],
+               'co': self['mlc_pwr.col_addr'],
+               'delta_az': self['mlc_pwr.row_mult'],
+               'delta_R': self['mlc_pwr.col_mult'],
+               'dem': self['hgt'],
+               'heightDEM': self['hgt.set_rows'],
+               'widthDEM': self['hgt.set_cols'],
+               'corner_lon': self['hgt.col_addr']*RAD,
+               'corner_lat': self['hgt.row_addr']*RAD,
+               'spc_lon': math.fabs(self['hgt.col_mult'])*RAD,
+               'spc_lat': math.fabs(self['hgt.row_mult'])*RAD,
+               'peg_lat': self['Peg Latitude']*RAD,
+               'peg_lon': self['Peg Longitude']*RAD,
+               'peg_heading': self['Peg Heading']*RAD,
+               'Ro': self['Image Starting Range']*1000 + 1.0*self['slc_mag.col_mult'],
+               'yaw': self['Global Average Yaw']*RAD,
+               'pitch': self['Global Average Pitch']*RAD,
+               'ESA': self['Global Average ESA']*RAD,
+               'gavgalt': self['Global Average Altitude'],
+               'gavgterhgt': self['Global Average Terrain Height'],
+               'look': look,
+               'az': self['Peg Heading']*RAD + PI_HALF}
+
+        if pol is not None:
+            par['mlc'] = self['mlc'+pol]
+
+        return par
+
+
+_cache = {}
+
+def load(annfile):
+    """Returns the parsed annotation file, reading it again only if it has
+    changed since it was last loaded.
+
+        Arguments:
+            annfile (str): Path and filename of the annotation file.
+
+        Returns:
+            ann (Annotation): Parsed annotation file.
+
+    """
+    path = os.path.abspath(annfile)
+    st = os.stat(path)
+    stamp = (st.st_mtime_ns, st.st_size)
+
+    entry = _cache.get(path)
+    if (entry is None) or (entry[0] != stamp):
+        entry = (stamp, Annotation(path))
+        _cache[path] = entry
+
+    return entry[1]
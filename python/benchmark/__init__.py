@@ -0,0 +1,15 @@
+"""Benchmark suite for the radiometric calibration chain.
+
+Generates synthetic UAVSAR scenes of a configurable size (see synthetic.py)
+and times batchcal (area and LUT correction), createlut, uavsar_geocode,
+genHDRfromTXT, and complexRTC on them, reporting the wall-clock time, the
+throughput in pixels per second, and the peak resident set size of each
+stage (see suite.py).  Everything runs locally, without any downloads.
+
+The calibration programs need to be built first (make, in the repository
+root).  Then, from the python folder:
+
+    python -m benchmark --rows 2000 --cols 1600
+
+Run with -h for the other options.
+"""
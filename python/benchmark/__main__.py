@@ -0,0 +1,41 @@
+"""Command line interface of the benchmark suite.  See __init__.py."""
+
+import argparse
+import json
+import shutil
+import tempfile
+
+from benchmark import suite
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmark')
+    parser.add_argument('-r', '--rows', type=int, default=1000, help='Number of MLC azimuth lines of each synthetic scene.  Default: 1000.')
+    parser.add_argument('-c', '--cols', type=int, default=800, help='Number of MLC range samples of each synthetic scene.  Default: 800.')
+    parser.add_argument('-n', '--scenes', type=int, default=1, help='Number of synthetic scenes.  Default: 1.')
+    parser.add_argument('-s', '--stages', type=str, nargs='+', choices=suite.STAGES, help='Stages to time.  The stages they depend on are also run, but not reported.  Default: all stages.')
+    parser.add_argument('-b', '--bin', type=str, help='Folder containing the uavsar_calib and uavsar_geocode executables.  Default: the repository root, or the PATH.')
+    parser.add_argument('-w', '--workdir', type=str, help='Folder for the synthetic scenes and outputs, which is kept after the run.  Default: a temporary folder, which is removed after the run.')
+    parser.add_argument('-j', '--nworkers', type=int, default=1, help='Number of worker processes for createlut.  Default: 1.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for the synthetic scenes.  Default: 0.')
+    parser.add_argument('--json', type=str, help='Also save the results to this JSON file.')
+    args = parser.parse_args()
+
+    workdir = args.workdir if args.workdir is not None else tempfile.mkdtemp(prefix='radiocal_benchmark_')
+    try:
+        results = suite.run(workdir, rows=args.rows, cols=args.cols, nscenes=args.scenes,
+                            stages=args.stages, bindir=args.bin, nworkers=args.nworkers,
+                            seed=args.seed)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print('')
+    print(suite.report(results))
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""Benchmark stages for the radiometric calibration chain.
+
+Each stage runs one step of the usual workflow on the synthetic scenes
+from synthetic.py, in the same order as a production run:
+
+    batchcal_area   batchcal() with the area correction only, saving the
+                    look and slope angles (geometry cache enabled, as in
+                    production, so later stages reuse the facet model).
+    createlut       createlut() from the area corrected images and the
+                    landcover masks.
+    batchcal_lut    batchcal() with the LUT from createlut.
+    uavsar_geocode  uavsar_geocode on each area corrected HHHH .mlc file.
+    genHDRfromTXT   genHDRfromTXT() for the GRD images of every
+                    covariance matrix term of each scene.
+    complexRTC      complexRTC() from the LUT corrected and original GRD
+                    images.
+
+Every stage runs in a fresh (spawned) process, so that the peak resident
+set size measured for it only includes the stage itself and the programs
+it calls.  Output printed by the stage is written to a log file in the
+work folder rather than to the terminal.
+"""
+
+import contextlib
+import multiprocessing
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmark import synthetic
+
+
+STAGES = ['batchcal_area', 'createlut', 'batchcal_lut', 'uavsar_geocode',
+          'genHDRfromTXT', 'complexRTC']
+
+# Stages whose outputs are needed by each stage.
+DEPENDS = {'batchcal_area': [],
+           'createlut': ['batchcal_area'],
+           'batchcal_lut': ['createlut'],
+           'uavsar_geocode': ['batchcal_area'],
+           'genHDRfromTXT': [],
+           'complexRTC': ['batchcal_lut']}
+
+# Landcover classes used for the LUT (out of synthetic.makescene()'s
+# nclasses).
+LUT_CLASSES = [1, 2]
+
+
+def findprograms(bindir=None):
+    """Returns the paths of the uavsar_calib and uavsar_geocode executables:
+    from bindir if given, otherwise from the repository root (where the
+    Makefile builds them), otherwise from the PATH."""
+    if bindir is None:
+        rootdir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        if os.path.isfile(os.path.join(rootdir, 'uavsar_calib')):
+            bindir = rootdir
+
+    programs = []
+    for prog in ['uavsar_calib', 'uavsar_geocode']:
+        path = os.path.join(bindir, prog) if bindir is not None else shutil.which(prog)
+        if (path is None) or not os.path.isfile(path):
+            raise IOError('File: {} not found.'.format(prog if path is None else path))
+        programs.append(os.path.abspath(path))
+    return programs
+
+
+def _maxrss():
+    """Peak resident set size of this process and of its finished child
+    processes, in bytes."""
+    scale = 1 if sys.platform == 'darwin' else 1024 # ru_maxrss is in kB on Linux
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss*scale)
+
+
+def _timed(stage, ctx, logfile):
+    """Runs a stage in a worker process.  Returns the elapsed wall-clock
+    time, the number of pixels processed, and the peak RSS of the process
+    and of its children."""
+    with open(logfile, 'a') as log, contextlib.redirect_stdout(log):
+        print('benchmark -- Stage: '+stage)
+        start = time.perf_counter()
+        pixels = globals()['_'+stage](ctx)
+        elapsed = time.perf_counter() - start
+    return (elapsed, pixels) + _maxrss()
+
+
+def _batchcal_area(ctx):
+    import radiocal
+    radiocal.batchcal(ctx['datapath'], '', ctx['calib'], ctx['geocode'], None,
+                      calname='area_only', createlookflag=True,
+                      createslopeflag=True)
+    return sum(3*s['mlc_rows']*s['mlc_cols'] for s in ctx['scenes'])
+
+
+def _createlut(ctx):
+    import radiocal
+    radiocal.createlut(ctx['datapath']+'/', [s['name'] for s in ctx['scenes']],
+                       [s['mask'] for s in ctx['scenes']], ctx['lutpath']+'/',
+                       'benchmark', LUT_CLASSES, min_samples=1,
+                       partialflag=False, nworkers=ctx['nworkers'])
+    return sum(3*s['grd_rows']*s['grd_cols'] for s in ctx['scenes'])
+
+
+def _batchcal_lut(ctx):
+    import radiocal
+    radiocal.batchcal(ctx['datapath'], '', ctx['calib'], ctx['geocode'],
+                      os.path.join(ctx['lutpath'], 'caltbl_benchmark'),
+                      calname='lut')
+    return sum(3*s['mlc_rows']*s['mlc_cols'] for s in ctx['scenes'])
+
+
+def _uavsar_geocode(ctx):
+    for s in ctx['scenes']:
+        rootname = os.path.join(ctx['datapath'], s['name'][0:-4])
+        geocode_exec = (ctx['geocode']+' '+rootname+'HHHH_area_only.mlc '+str(s['mlc_cols'])+' '+
+                        s['trans']+' '+os.path.join(ctx['scratch'], s['name']+'_geocode.grd')+' '+
+                        str(s['grd_cols'])+' '+str(s['grd_rows']))
+        print('Executing: ' + geocode_exec)
+        print(subprocess.getoutput(geocode_exec))
+    return sum(s['grd_rows']*s['grd_cols'] for s in ctx['scenes'])
+
+
+def _genHDRfromTXT(ctx):
+    from buildUAVSARhdr import genHDRfromTXT
+    for s in ctx['scenes']:
+        for term in synthetic.DIAG_TERMS + synthetic.OFFDIAG_TERMS:
+            genHDRfromTXT(s['ann'], os.path.join(ctx['scratch'], s['name']+term+'.grd'), term)
+    return sum(6*s['grd_rows']*s['grd_cols'] for s in ctx['scenes'])
+
+
+def _complexRTC(ctx):
+    from complex_RTC import complexRTC
+    for s in ctx['scenes']:
+        complexRTC(s['name'], s['name'][0:-5], 'CX_01', 'lut', ctx['datapath'],
+                   s['origdir'], os.path.join(ctx['scratch'], 'complex_lut'))
+    return sum(3*s['grd_rows']*s['grd_cols'] for s in ctx['scenes'])
+
+
+def _geocodesetup(ctx):
+    """Links the transformation LUT of each scene from the geometry cache
+    (filled by batchcal_area) for the uavsar_geocode stage."""
+    import geometry_cache
+    cache = geometry_cache.cachedir(ctx['datapath'])
+    for s in ctx['scenes']:
+        s['trans'] = os.path.join(ctx['scratch'], s['name']+'.trans')
+        key = geometry_cache.geometrykey(s['ann'], s['hgt'])
+        if not geometry_cache.fetch(key, {'trans': s['trans']}, cache):
+            raise IOError('File: {} not found.'.format(os.path.join(cache, key, 'trans')))
+
+
+def run(workdir, rows=1000, cols=800, nscenes=1, stages=None, bindir=None,
+        nworkers=1, seed=0):
+    """Generates synthetic scenes and times the stages of the calibration
+    chain on them.
+
+        Arguments:
+            workdir (str): Folder for the scenes and the outputs.  Should be
+                empty (or not exist yet).
+            rows (int): Number of MLC azimuth lines of each scene.
+            cols (int): Number of MLC range samples of each scene.
+            nscenes (int): Number of scenes.
+            stages (list): Names of the stages to time (see STAGES).  The
+                stages they depend on are also run.  Default: all stages.
+            bindir (str): Folder containing uavsar_calib and uavsar_geocode.
+                Default: see findprograms().
+            nworkers (int): Number of worker processes for createlut.
+            seed (int): Random seed for the synthetic scenes.
+
+        Returns:
+            results (list): One dict per stage run, with the 'stage' name,
+                'seconds' of wall-clock time, 'pixels' processed, throughput
+                in 'pixels_per_s', and 'peak_rss' in bytes (the larger of the
+                stage's process and its child processes).
+
+    """
+    if stages is None:
+        stages = STAGES
+    for stage in stages:
+        if stage not in STAGES:
+            raise ValueError('benchmark -- Unknown stage {}.'.format(stage))
+
+    # Add the dependencies, keeping the usual order:
+    selected = set()
+    def select(stage):
+        selected.add(stage)
+        for dep in DEPENDS[stage]:
+            select(dep)
+    for stage in stages:
+        select(stage)
+
+    calib, geocode = findprograms(bindir)
+    datapath = os.path.abspath(workdir)
+    ctx = {'datapath': datapath, 'calib': calib, 'geocode': geocode,
+           'lutpath': os.path.join(datapath, 'lut'),
+           'scratch': os.path.join(datapath, 'scratch'),
+           'nworkers': nworkers, 'scenes': []}
+    os.makedirs(ctx['lutpath'], exist_ok=True)
+    os.makedirs(ctx['scratch'], exist_ok=True)
+    logfile = os.path.join(datapath, 'benchmark.log')
+
+    print('benchmark -- Generating {} synthetic scene(s) of {} x {} MLC pixels in {}'.format(nscenes, rows, cols, datapath))
+    for num in range(1, nscenes+1):
+        ctx['scenes'].append(synthetic.makescene(datapath, num=num, rows=rows, cols=cols, seed=seed+num))
+
+    results = []
+    spawn = multiprocessing.get_context('spawn')
+    for stage in STAGES:
+        if stage not in selected:
+            continue
+        if stage == 'uavsar_geocode':
+            _geocodesetup(ctx)
+
+        print('benchmark -- Running '+stage+' ...')
+        with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+            elapsed, pixels, rss_self, rss_children = pool.submit(_timed, stage, ctx, logfile).result()
+
+        result = {'stage': stage, 'seconds': elapsed, 'pixels': pixels,
+                  'pixels_per_s': pixels/elapsed if elapsed > 0 else float('inf'),
+                  'peak_rss': max(rss_self, rss_children)}
+        if stage in stages:
+            results.append(result)
+        print('benchmark -- {}: {:.2f} s, {:.3g} pixels/s, peak RSS {:.0f} MB'.format(
+              stage, elapsed, result['pixels_per_s'], result['peak_rss']/1e6))
+
+    return results
+
+
+def report(results):
+    """Returns a table of benchmark results, as a string."""
+    lines = ['{:<16s} {:>10s} {:>14s} {:>14s} {:>14s}'.format('stage', 'seconds', 'pixels', 'pixels/s', 'peak RSS (MB)')]
+    for r in results:
+        lines.append('{:<16s} {:>10.2f} {:>14d} {:>14.4g} {:>14.0f}'.format(
+                     r['stage'], r['seconds'], r['pixels'], r['pixels_per_s'], r['peak_rss']/1e6))
+    return '\n'.join(lines)
@@ -0,0 +1,208 @@
+"""Synthetic UAVSAR scenes for benchmarking.
+
+A synthetic scene has the same files and naming as a real UAVSAR delivery,
+so that it can be run through the whole calibration chain: an annotation
+file with every parameter read by load_ann.h, batchcal(), createlut() and
+genHDRfromTXT(), the six MLC files (float32 diagonal and complex64
+off-diagonal covariance matrix terms), a binary .hgt DEM, a landcover mask
+in GRD coordinates, and the original (uncalibrated) GRD images used by
+complexRTC().
+
+The scene is a straight flight line heading north-east over gently rolling
+terrain, with the swath on the left side of the aircraft.  The GRD grid is
+the same as the DEM grid, covering the swath with a small margin, so its
+size follows from the MLC size (roughly 4 times as many pixels).  The pixel
+values are random, and only meant for timing.
+"""
+
+import math
+import os
+
+import numpy as np
+
+from buildUAVSARhdr import genHDRfromTXT
+
+
+# WGS-84, as in math_uavsar.h.
+_A = 6378137.0
+_E2 = 0.00669437999015
+
+RAD = math.pi/180
+
+# Default acquisition parameters (similar to UAVSAR L-band MLC products).
+ALTITUDE = 12500.0      # m
+RANGE_SPACING = 4.99654 # m, MLC range pixel spacing
+AZ_SPACING = 7.2        # m, MLC azimuth pixel spacing
+SLC_SPACING = 1.66551   # m, SLC range pixel spacing
+NEAR_LOOK = 28.0        # deg, look angle of the first range pixel
+
+DIAG_TERMS = ['HHHH', 'HVHV', 'VVVV']
+OFFDIAG_TERMS = ['HHHV', 'HVVV', 'HHVV']
+
+
+def _pegradius(plat, heading):
+    """Radius of curvature of the ellipsoid along the peg heading."""
+    re = _A/math.sqrt(1 - _E2*math.sin(plat)**2)
+    rn = _A*(1 - _E2)/math.sqrt((1 - _E2*math.sin(plat)**2)**3)
+    return re*rn/(re*math.cos(heading)**2 + rn*math.sin(heading)**2)
+
+
+def scenename(num=1):
+    """UAVSAR style scene name (flight line, data take and date, plus the
+    band), for scene number num."""
+    return 'synth_{:05d}_20001_001_200101_L090'.format(num)
+
+
+def makescene(path, num=1, rows=1000, cols=800, heading=10.0, relief=50.0,
+              nclasses=4, seed=0, origgrdflag=True):
+    """Writes a synthetic UAVSAR scene.
+
+        Arguments:
+            path (str): Folder to write the scene to (created if needed).
+            num (int): Scene number, used in the scene name.
+            rows (int): Number of MLC azimuth lines.
+            cols (int): Number of MLC range samples.
+            heading (float): Peg heading, in degrees.
+            relief (float): Amplitude of the DEM relief, in meters.
+            nclasses (int): Number of landcover classes in the mask (labelled
+                1 to nclasses).
+            seed (int): Random seed for the DEM noise and the image values.
+            origgrdflag (bool): Whether to also write the original GRD images
+                (into an orig_grd subfolder), for complexRTC().
+
+        Returns:
+            scene (dict): Filenames and dimensions of the scene: 'name', 'ann',
+                'hgt', 'mask', 'mlc' (dict keyed by term), 'origdir',
+                'mlc_rows', 'mlc_cols', 'grd_rows', 'grd_cols'.
+
+    """
+    os.makedirs(path, exist_ok=True)
+    name = scenename(num)
+    rng = np.random.default_rng(seed)
+
+    plat, plon, hd = 35.0*RAD, -118.0*RAD, heading*RAD
+    ra = _pegradius(plat, hd)
+    Ro = ALTITUDE/math.cos(NEAR_LOOK*RAD)
+
+    # Ground range (along the ellipsoid) of a slant range:
+    def ground(slant):
+        r1 = ra + ALTITUDE
+        return ra*math.acos((r1**2 + ra**2 - slant**2)/(2*r1*ra))
+
+    c0 = ground(Ro)
+    c1 = ground(Ro + cols*RANGE_SPACING)
+    s0 = -rows*AZ_SPACING/2
+    s1 = rows*AZ_SPACING/2
+
+    # Corners of the swath, to the left of the flight track:
+    corners = []
+    for s in (s0, s1):
+        for c in (c0, c1):
+            north = s*math.cos(hd) + c*math.cos(hd - math.pi/2)
+            east = s*math.sin(hd) + c*math.sin(hd - math.pi/2)
+            corners.append((plat + north/ra, plon + east/(ra*math.cos(plat))))
+    corners = np.array(corners)
+
+    # DEM/GRD grid at half the finer MLC pixel spacing, with a margin:
+    spc = min(RANGE_SPACING, AZ_SPACING)/2/ra
+    margin = 30*spc
+    lat_hi = corners[:, 0].max() + margin
+    lat_lo = corners[:, 0].min() - margin
+    lon_lo = corners[:, 1].min() - margin
+    lon_hi = corners[:, 1].max() + margin
+    grd_rows = int((lat_hi - lat_lo)/spc) + 1
+    grd_cols = int((lon_hi - lon_lo)/spc) + 1
+
+    hgtfile = os.path.join(path, name+'_CX_01.hgt')
+    dem = np.memmap(hgtfile, dtype='<f4', mode='w+', shape=(grd_rows, grd_cols))
+    landcover = np.memmap(os.path.join(path, name+'_landcover.grd'), dtype='<f4',
+                          mode='w+', shape=(grd_rows, grd_cols))
+    xx = np.arange(grd_cols)
+    for row in range(0, grd_rows, 1024):
+        rows_block = slice(row, min(row+1024, grd_rows))
+        yy = np.arange(rows_block.start, rows_block.stop)[:, np.newaxis]
+        dem[rows_block] = (relief*np.sin(yy/37.)*np.cos(xx/53.) +
+                           0.015*relief*rng.standard_normal((yy.shape[0], grd_cols)))
+        landcover[rows_block] = 1 + ((yy//64 + xx//64) % nclasses)
+    del dem, landcover
+
+    mlcfiles = {}
+    for term in DIAG_TERMS:
+        mlcfiles[term] = os.path.join(path, name+term+'_CX_01.mlc')
+        _writerandom(mlcfiles[term], rows, cols, rng, complexflag=False)
+    for term in OFFDIAG_TERMS:
+        mlcfiles[term] = os.path.join(path, name+term+'_CX_01.mlc')
+        _writerandom(mlcfiles[term], rows, cols, rng, complexflag=True)
+
+    origdir = None
+    if origgrdflag:
+        origdir = os.path.join(path, 'orig_grd')
+        os.makedirs(origdir, exist_ok=True)
+        for term in DIAG_TERMS:
+            _writerandom(os.path.join(origdir, name+term+'_CX_01.grd'), grd_rows, grd_cols, rng, complexflag=False)
+        for term in OFFDIAG_TERMS:
+            _writerandom(os.path.join(origdir, name+term+'_CX_01.grd'), grd_rows, grd_cols, rng, complexflag=True)
+
+    lines = []
+    def param(key, units, value, comment='synthetic'):
+        lines.append('{:<40s} {:<12s} = {}  ; {}'.format(key, units, value, comment))
+
+    # The filenames have no units, since load_ann.h reads them as the
+    # second word after the parameter name:
+    for term in DIAG_TERMS + OFFDIAG_TERMS:
+        lines.append('{:<53s} = {}'.format('mlc'+term, os.path.basename(mlcfiles[term])))
+    lines.append('{:<53s} = {}'.format('hgt', os.path.basename(hgtfile)))
+    for prefix in ['mlc_pwr', 'mlc_mag']:
+        param(prefix+'.set_rows', '(pixels)', rows, 'MLC lines')
+        param(prefix+'.set_cols', '(pixels)', cols, 'MLC samples')
+    param('mlc_pwr.row_addr', '(m)', '{:.4f}'.format(s0))
+    param('mlc_pwr.col_addr', '(m)', '0.0')
+    param('mlc_pwr.row_mult', '(m/pixel)', AZ_SPACING)
+    param('mlc_pwr.col_mult', '(m/pixel)', RANGE_SPACING)
+    param('slc_mag.col_mult', '(m/pixel)', SLC_SPACING)
+    for prefix in ['hgt', 'grd_pwr', 'grd_mag']:
+        param(prefix+'.set_rows', '(pixels)', grd_rows)
+        param(prefix+'.set_cols', '(pixels)', grd_cols)
+        param(prefix+'.row_addr', '(deg)', '{:.10f}'.format(lat_hi/RAD))
+        param(prefix+'.col_addr', '(deg)', '{:.10f}'.format(lon_lo/RAD))
+        param(prefix+'.row_mult', '(deg/pixel)', '{:.10f}'.format(-spc/RAD))
+        param(prefix+'.col_mult', '(deg/pixel)', '{:.10f}'.format(spc/RAD))
+    param('Peg Latitude', '(deg)', '{:.8f}'.format(plat/RAD))
+    param('Peg Longitude', '(deg)', '{:.8f}'.format(plon/RAD))
+    param('Peg Heading', '(deg)', '{:.8f}'.format(heading))
+    param('Image Starting Range', '(km)', '{:.6f}'.format((Ro - SLC_SPACING)/1000))
+    param('Look Direction', '(&)', 'Left')
+    param('Global Average Yaw', '(deg)', '0.5')
+    param('Global Average Pitch', '(deg)', '1.0')
+    param('Global Average ESA', '(deg)', '0.3')
+    param('Global Average Altitude', '(m)', ALTITUDE)
+    param('Global Average Terrain Height', '(m)', '0.0')
+    for corner, (lat, lon) in zip(['Upper Left', 'Upper Right', 'Lower Left', 'Lower Right'],
+                                  [(lat_hi, lon_lo), (lat_hi, lon_hi), (lat_lo, lon_lo), (lat_lo, lon_hi)]):
+        param('Approximate '+corner+' Latitude', '(deg)', '{:.6f}'.format(lat/RAD))
+        param('Approximate '+corner+' Longitude', '(deg)', '{:.6f}'.format(lon/RAD))
+
+    annfile = os.path.join(path, name+'_CX_01.ann')
+    with open(annfile, 'w') as ann:
+        ann.write('\n'.join(lines)+'\n')
+
+    # createlut() opens the landcover mask with GDAL, which needs a header:
+    genHDRfromTXT(annfile, os.path.join(path, name+'_landcover.grd'), 'HHHH')
+
+    return {'name': name, 'ann': annfile, 'hgt': hgtfile,
+            'mask': name+'_landcover.grd', 'mlc': mlcfiles, 'origdir': origdir,
+            'mlc_rows': rows, 'mlc_cols': cols,
+            'grd_rows': grd_rows, 'grd_cols': grd_cols}
+
+
+def _writerandom(filename, rows, cols, rng, complexflag, blocksize=1024):
+    """Writes a random backscatter (gamma distributed power) or complex
+    covariance image, in blocks of rows."""
+    out = np.memmap(filename, dtype='<c8' if complexflag else '<f4', mode='w+', shape=(rows, cols))
+    for row in range(0, rows, blocksize):
+        shape = (min(blocksize, rows-row), cols)
+        if complexflag:
+            out[row:row+shape[0]] = 0.01*(rng.standard_normal(shape) + 1j*rng.standard_normal(shape))
+        else:
+            out[row:row+shape[0]] = rng.gamma(4, 0.05, shape)
+    del out
@@ -11,6 +11,8 @@ THE SOFTWARE IS PROVIDED \"AS IS\", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMP
 
 import os.path
 import argparse
+
+import annotation
     
 
 def genHDRfromTXT(annFile, dataFile, pol=None): # pol is dummy variable to be compatible with previous versions and run calls
@@ -51,37 +53,27 @@ def genHDRfromTXT(annFile, dataFile, pol=None): # pol is dummy variable to be co
     print('POLARIZATION =', pol)
     
     headerPar['fileBaseName']=fileBaseName
-    hdrFile = open(file, 'r')
-    for line in hdrFile:
-        if 'grd_mag.row_addr' in line:
-            ULlatCord = line.split()[3]
-            print('UPPER LEFT LAT = ', ULlatCord)
-            headerPar['ULlatCord'] = ULlatCord
-        elif 'grd_mag.col_addr' in line:
-            ULlongCord = line.split()[3]
-            print('UPPER LEFT LONG = ',ULlongCord)
-            headerPar['ULlongCord'] = ULlongCord
-    hdrFile.close()
+    ann = annotation.load(file) # parsed once, and reused for the other headers of the scene
+    ULlatCord = ann.string('grd_mag.row_addr')
+    print('UPPER LEFT LAT = ', ULlatCord)
+    headerPar['ULlatCord'] = ULlatCord
+    ULlongCord = ann.string('grd_mag.col_addr')
+    print('UPPER LEFT LONG = ',ULlongCord)
+    headerPar['ULlongCord'] = ULlongCord
 
     if format == 'GRD':
-        hdrFile = open(file, 'r')
-        for line in hdrFile:
-            if 'grd_pwr.set_rows' in line:
-                GRDSamples = line.split()[3]
-                print('SAMPLES =', GRDSamples)
-                headerPar['GRDSamples'] = GRDSamples
-            elif 'grd_pwr.set_cols' in line:
-                GRDLines = line.split()[3]
-                print('Lines =', GRDLines)
-                headerPar['GRDLines'] = GRDLines
-            elif 'grd_pwr.row_mult' in line:
-                GRDPixelY = abs(float(line.split()[3].split(';')[0]))  # latitude pixel spacing
-                print('PIXEL SIZE (y) = ', GRDPixelY)
-                headerPar['GRDPixelY'] = GRDPixelY
-            elif 'grd_pwr.col_mult' in line:
-                GRDPixelX = abs(float(line.split()[3].split(';')[0]))  # longitude pixel spacing
-                print('PIXEL SIZE (x) = ', GRDPixelX)
-                headerPar['GRDPixelX'] = GRDPixelX
+        GRDSamples = ann.string('grd_pwr.set_rows')
+        print('SAMPLES =', GRDSamples)
+        headerPar['GRDSamples'] = GRDSamples
+        GRDLines = ann.string('grd_pwr.set_cols')
+        print('Lines =', GRDLines)
+        headerPar['GRDLines'] = GRDLines
+        GRDPixelY = abs(float(ann['grd_pwr.row_mult']))  # latitude pixel spacing
+        print('PIXEL SIZE (y) = ', GRDPixelY)
+        headerPar['GRDPixelY'] = GRDPixelY
+        GRDPixelX = abs(float(ann['grd_pwr.col_mult']))  # longitude pixel spacing
+        print('PIXEL SIZE (x) = ', GRDPixelX)
+        headerPar['GRDPixelX'] = GRDPixelX
     
     # ASSIGN NUMER OF LINES AND SAMPLES BASED UPON FILE TYPE
     #print('Reading lines...')
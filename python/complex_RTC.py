@@ -1,88 +1,111 @@
 import numpy as np
-import osgeo.gdal as gdal
 # from matplotlib import pyplot as plt
 import os
-import shutil
-import subprocess
 from buildUAVSARhdr import genHDRfromTXT
+import annotation
 
-# TODO: finish and import from /mnt/d/Dropbox/Python/UAVSAR-Radiometric-Calibration/local/multiply-2.py; switch to subprocess modeule on ASC; copy *.hdr files...
-def complexRTC(base, lutBase, corrstr, calname, lutDir,origDir, outDir):
-    '''Takes LUT-corrected real grd files, calculates correction ratio, applies to non LUT-corrected grd files'''
+def _link(src, dst):
+    '''Hard links src to dst, or symlinks it if hard linking is not possible (e.g., across file systems), so that large GRD files are never copied.'''
+    if os.path.lexists(dst):
+        if os.path.exists(dst) and os.path.samefile(src, dst):
+            return
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        os.symlink(os.path.abspath(src), dst)
+
+def _writehdr(annFile, dataFile, pol):
+    '''Writes a new header file, without writing through an existing header which may be a link to another file.'''
+    if os.path.lexists(dataFile + '.hdr'):
+        os.remove(dataFile + '.hdr')
+    genHDRfromTXT(annFile, dataFile, pol)
+
+def complexRTC(base, lutBase, corrstr, calname, lutDir,origDir, outDir, blocksize=1024):
+    '''Takes LUT-corrected real grd files, calculates correction ratio, applies to non LUT-corrected grd files.
+
+    The ratio between the LUT-corrected and original image of each diagonal term (HHHH, VVVV, HVHV) is computed once per block of rows, and the geometric mean of the ratios is applied to the off-diagonal terms (HHHV, HVVV, HHVV) in the same pass, so memory use is bounded by blocksize and no intermediate ratio files are written.  Input files are hard linked (or symlinked) into outDir instead of copied.'''
     
     ## make sure files exist in origDir
     if os.listdir(origDir)==[]:
         origDir_ASC=os.path.join('/att/gpfsfs/atrepo01/data/ORNL/ABoVE_Archive/datapool.asf.alaska.edu/PROJECTED/UA/', base + '_' + corrstr + '_grd')
-        print(subprocess.getoutput('cp -r '+os.path.join(origDir_ASC, '*') +' ' + origDir))
+        for file in os.listdir(origDir_ASC):
+            _link(os.path.join(origDir_ASC, file), os.path.join(origDir, file))
     
     ## vars
     pol_real=['HHHH','VVVV','HVHV']
     pol_complex=['HHHV','HVVV','HHVV']
     
+        ## mkdir outDir
+    os.makedirs(outDir, exist_ok=True)
+    print('Made dir: {}'.format(outDir))
+    
+        ## link .ann from 'raw' dir bc its guaranteed to be there
+    pthANN_orig=os.path.join(lutDir, base + '_' + corrstr + '.ann')
+    pthANN_copy_1=os.path.join(outDir, base + '_' + corrstr + '.ann')
+    pthANN_copy_2=os.path.join(origDir, base + '_' + corrstr + '.ann')
+    _link(pthANN_orig, pthANN_copy_1) # padelE_36000_17093_007_170908_L090_CX_01/raw/padelE_36000_17093_007_170908_L090_CX_01.ann ---> padelE_36000_17093_007_170908_L090_CX_01/complex_lut/padelE_36000_17093_007_170908_L090_CX_01.ann
+    _link(pthANN_orig, pthANN_copy_2) # padelE_36000_17093_007_170908_L090_CX_01/raw/padelE_36000_17093_007_170908_L090_CX_01.ann ---> padelE_36000_17093_007_170908_L090_CX_01/orig_grd/padelE_36000_17093_007_170908_L090_CX_01.ann
+    print('Linked ANN \t{} \t to\n\t {}\tand\n\t {}'.format(pthANN_orig, pthANN_copy_1, pthANN_copy_2))
+    
+    ann = annotation.load(pthANN_orig)
+    rows = int(ann['grd_pwr.set_rows'])
+    cols = int(ann['grd_pwr.set_cols'])
+    
+    pthLUT = {}
+    pthOrig = {}
     for i in range(3):
-            ## mkdir outDir
-        print('Making dir: {} \n\tResult: {}'.format(outDir, os.system('mkdir -p '+ outDir)))
-        
-            ## copy LUT-corrected real GRD image files
+            ## link LUT-corrected real GRD image files
         pthGRD_lut_orig=os.path.join(lutDir, lutBase + '_' + pol_real[i] + '_' + calname + '.grd')
-        pthGRD_lut_copy=os.path.join(outDir, base + pol_real[i] + '_' + corrstr + '.grd') # HERE somehow this cp is not working
-        pthANN_orig=os.path.join(lutDir, base + '_' + corrstr + '.ann') # copy .ann from 'raw' dir bc its guaranteed to be there
-        pthANN_copy_1=os.path.join(outDir, base + '_' + corrstr + '.ann')
-        pthANN_copy_2=os.path.join(origDir, base + '_' + corrstr + '.ann')
+        pthGRD_lut_copy=os.path.join(outDir, base + pol_real[i] + '_' + corrstr + '.grd')
+        _link(pthGRD_lut_orig, pthGRD_lut_copy)
+        _link(pthGRD_lut_orig + '.hdr', pthGRD_lut_copy + '.hdr')
+        print('Linked \t{} \t to\n\t {}'.format(pthGRD_lut_orig, pthGRD_lut_copy))
         
-        # shutil.copy2(pthGRD_orig, pthGRD_copy)
-        subprocess.getoutput('cp -r '+pthGRD_lut_orig+' '+pthGRD_lut_copy) # executes as parallel 
-        subprocess.getoutput('cp -r '+pthGRD_lut_orig +'.hdr' +' '+pthGRD_lut_copy + '.hdr')
-        print('Copied \t{} \t to\n\t {}'.format(pthGRD_lut_orig, pthGRD_lut_copy))
-        if i==0: # first time only
-            subprocess.getoutput('cp -r '+pthANN_orig+' '+pthANN_copy_1) # padelE_36000_17093_007_170908_L090_CX_01/raw/padelE_36000_17093_007_170908_L090_CX_01.ann ---> padelE_36000_17093_007_170908_L090_CX_01/complex_lut/padelE_36000_17093_007_170908_L090_CX_01.ann
-            subprocess.getoutput('cp -r '+pthANN_orig+' '+pthANN_copy_2) # padelE_36000_17093_007_170908_L090_CX_01/raw/padelE_36000_17093_007_170908_L090_CX_01.ann ---> padelE_36000_17093_007_170908_L090_CX_01/orig_grd/padelE_36000_17093_007_170908_L090_CX_01.ann
-            print('Copied ANN \t{} \t to\n\t {}\tand\n\t {}'.format(pthANN_orig, pthANN_copy_1, pthANN_copy_2))
-        # subprocess.getoutput('cp '+pthGRD_orig+' '+pthGRD_copy)
-
-            ## build real-valued grd paths
-        pthA1=os.path.join(origDir, base + pol_real[i] + '_' + corrstr + '.grd')
-        pthB1=pthGRD_lut_orig
-        pthOut1=os.path.join(outDir, pol_real[i] + '_GeomLut_factor.tif')
+            ## real-valued grd paths
+        pthLUT[pol_real[i]]=pthGRD_lut_orig
+        pthOrig[pol_real[i]]=os.path.join(origDir, base + pol_real[i] + '_' + corrstr + '.grd')
         
             ## build header
-        genHDRfromTXT(os.path.join(os.path.dirname(pthA1), base + '_' + corrstr + '.ann'), pthA1, 'HHHH')
-        
-            ## calculate correction ratio between default GRD and RTC GRD
-        cmd='gdal_calc.py --quiet -A ' + pthA1 + ' -B ' + pthB1 + ' --calc=B/A --co=COMPRESS=LZW --NoDataValue=-9999 --overwrite --outfile=' + pthOut1
-        print('Executing:\n\t {}'.format(cmd))
-        subprocess.getoutput(cmd)
-
-    for i in range(3):        
-            ## load for complex
-        # pthA=r'F:\UAVSAR\bakerc_16008_19059_012_190904_L090_CX_01\raw\combined_LUT_geom_mean\HHHH_GeomLut_factor.grd'
-        pthA2=os.path.join(outDir, pol_complex[i][:2] + pol_complex[i][:2] + '_GeomLut_factor.tif') #'/mnt/f/UAVSAR/bakerc_16008_19059_012_190904_L090_CX_01/raw/combined_LUT_geom_mean/HHHH_GeomLut_factor.tif'
-        pthB2=os.path.join(outDir, pol_complex[i][2:] + pol_complex[i][2:] + '_GeomLut_factor.tif') #'/mnt/f/UAVSAR/bakerc_16008_19059_012_190904_L090_CX_01/raw/combined_LUT_geom_mean/HVHV_GeomLut_factor.tif'
-        pthC2=os.path.join(origDir, base + pol_complex[i] + '_' + corrstr + '.grd')#  '/mnt/f/UAVSAR/bakerc_16008_19059_012_190904_L090_CX_01/raw/orig_grd/bakerc_16008_19059_012_190904_L090HHHV_CX_01.grd'
-        pthOut2=os.path.join(outDir, base + pol_complex[i] + '_' + corrstr + '.grd') # '/mnt/f/UAVSAR/bakerc_16008_19059_012_190904_L090_CX_01/raw/combined_LUT_geom_mean/bakerc_16008_19059_012_190904_L090HHHV_CX_01.grd'
+        _writehdr(pthANN_copy_2, pthOrig[pol_real[i]], 'HHHH')
+    
+    pthC = {}
+    pthOut = {}
+    for i in range(3):
+            ## complex-valued grd paths
+        pthC[pol_complex[i]]=os.path.join(origDir, base + pol_complex[i] + '_' + corrstr + '.grd')#  '/mnt/f/UAVSAR/bakerc_16008_19059_012_190904_L090_CX_01/raw/orig_grd/bakerc_16008_19059_012_190904_L090HHHV_CX_01.grd'
+        pthOut[pol_complex[i]]=os.path.join(outDir, base + pol_complex[i] + '_' + corrstr + '.grd') # '/mnt/f/UAVSAR/bakerc_16008_19059_012_190904_L090_CX_01/raw/combined_LUT_geom_mean/bakerc_16008_19059_012_190904_L090HHHV_CX_01.grd'
         
             ## build header
-        genHDRfromTXT(os.path.join(os.path.dirname(pthC2), base + '_' + corrstr + '.ann'), pthC2, 'HHHV')
-        ## gdal load
-        A = gdal.Open(pthA2,gdal.GA_ReadOnly)
-        A = A.ReadAsArray()
-        B = gdal.Open(pthB2,gdal.GA_ReadOnly)
-        B = B.ReadAsArray()
-        C_gdal = gdal.Open(pthC2,gdal.GA_ReadOnly)
-        C = C_gdal.ReadAsArray()
-
-        ## perform calcs on complex GRD images
-        out=C*np.sqrt(A*B)
+        _writehdr(pthANN_copy_2, pthC[pol_complex[i]], 'HHHV')
+    
+        ## memory map the images
+    lut = {pol: np.memmap(pthLUT[pol], dtype='<f4', mode='r', shape=(rows, cols)) for pol in pol_real}
+    orig = {pol: np.memmap(pthOrig[pol], dtype='<f4', mode='r', shape=(rows, cols)) for pol in pol_real}
+    C = {pol: np.memmap(pthC[pol], dtype='<c8', mode='r', shape=(rows, cols)) for pol in pol_complex}
+    out = {}
+    for pol in pol_complex:
+        if os.path.lexists(pthOut[pol]):
+            os.remove(pthOut[pol]) # don't write through a link to another file
+        out[pol] = np.memmap(pthOut[pol], dtype='<c8', mode='w+', shape=(rows, cols))
 
-        ## write to geotiff
-        out_gdal = gdal.GetDriverByName('ENVI').Create(pthOut2, C_gdal.RasterXSize, C_gdal.RasterYSize, 1, gdal.GDT_CFloat32)
-        out_gdal.GetRasterBand(1).WriteArray(out)
-        out_gdal.GetRasterBand(1).SetNoDataValue(-9999)
-        out_gdal.SetGeoTransform(C_gdal.GetGeoTransform())
-        out_gdal.SetProjection(C_gdal.GetProjection())
-        out_gdal.FlushCache()
-        out_gdal=None # necessary if debugging...
-        print('\nWrote geometric mean correction: {}\n'.format(pthOut2))
+    for row in range(0, rows, blocksize):
+        block = slice(row, min(row+blocksize, rows))
+        
+            ## calculate correction ratio between default GRD and RTC GRD, once for each diagonal term
+        with np.errstate(divide='ignore', invalid='ignore'):
+            factor = {pol: lut[pol][block] / orig[pol][block] for pol in pol_real}
+        
+            ## perform calcs on complex GRD images, using geometric mean of the ratios
+        for pol in pol_complex:
+            with np.errstate(invalid='ignore'):
+                out[pol][block] = C[pol][block]*np.sqrt(factor[pol[:2] + pol[:2]]*factor[pol[2:] + pol[2:]])
+    
+    for pol in pol_complex:
+        out[pol].flush()
+        _writehdr(pthANN_copy_1, pthOut[pol], 'HHHV')
+        print('\nWrote geometric mean correction: {}\n'.format(pthOut[pol]))
+    del lut, orig, C, out
 
 ## testing
 if __name__ == "__main__":
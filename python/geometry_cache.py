@@ -0,0 +1,182 @@
+"""On-disk cache for the facet model geometry products of uavsar_calib.
+
+The products written by the DEM facet decomposition (the geometry file
+saved with "uavsar_calib -g", the geocoding transformation LUT, and the
+look and slope angle files) only depend on the annotation parameters read
+by load_ann.h (see Annotation.calib_params()) and on the DEM.  They do not depend on the polarization or on
+the vegetation LUT, so the area-only and LUT correction passes over a scene
+can share them.
+
+Cache entries are stored in subdirectories of the cache directory, named
+by a hash of the annotation parameters and the DEM contents.  The total
+size of the cache is capped, and least recently used entries are evicted
+when the cap is exceeded.
+
+The cache location defaults to a "geometry_cache" folder in the data path,
+and can be overridden with the UAVSAR_GEOMETRY_CACHE environment variable.
+The size cap (in GB) can be set with UAVSAR_GEOMETRY_CACHE_MAXGB.
+"""
+
+import hashlib
+import os
+import shutil
+import stat
+import tempfile
+import time
+
+import annotation
+
+
+# Bump this if the geometry products written by uavsar_calib change.
+CACHE_VERSION = '2'
+
+# Products stored in each cache entry.
+PRODUCTS = ['geom', 'trans', 'look', 'slope']
+
+# Default cache size cap, in GB.
+DEFAULT_MAXGB = 20
+
+
+def cachedir(datapath):
+    """Returns the geometry cache directory to use for a data path."""
+    return os.environ.get('UAVSAR_GEOMETRY_CACHE',
+                          os.path.join(datapath, 'geometry_cache'))
+
+
+def cachemaxbytes():
+    """Returns the geometry cache size cap, in bytes."""
+    return int(float(os.environ.get('UAVSAR_GEOMETRY_CACHE_MAXGB',
+                                    DEFAULT_MAXGB)) * 1e9)
+
+
+def geometrykey(annfile, hgtfile=None, hgtval=None):
+    """Content hash identifying the facet model geometry of a scene.
+
+        Arguments:
+            annfile (str): Path and filename of the annotation file.
+            hgtfile (str): Path and filename of the (binary) DEM used by
+                uavsar_calib.
+            hgtval (float): Height of the flat DEM used instead of hgtfile
+                (with "uavsar_calib -e").
+
+        Returns:
+            key (str): Hex digest of the annotation parameters read by
+                load_ann.h and the DEM contents (or height).
+
+    """
+    h = hashlib.sha1()
+    h.update(('uavsar_geometry_cache '+CACHE_VERSION+'\n').encode())
+
+    # The polarization-specific MLC filenames are left out on purpose, and
+    # the DEM filename does not matter since its contents are hashed.
+    par = annotation.load(annfile).calib_params()
+    del par['dem']
+    for name in sorted(par):
+        h.update((name+' = '+repr(par[name])+'\n').encode())
+
+    if hgtval is not None:
+        h.update(('flat DEM height = '+repr(float(hgtval))+'\n').encode())
+    else:
+        with open(hgtfile, 'rb') as hgt:
+            for chunk in iter(lambda: hgt.read(16*1024*1024), b''):
+                h.update(chunk)
+
+    return h.hexdigest()
+
+
+def _linkorcopy(src, dst):
+    """Hard links src to dst, or copies it if linking is not possible."""
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def fetch(key, products, path=None):
+    """Retrieves geometry products from the cache.
+
+        Arguments:
+            key (str): Cache key from geometrykey().
+            products (dict): Destination filenames, keyed by product name
+                (see PRODUCTS).  Only the products listed here are fetched.
+            path (str): Cache directory.
+
+        Returns:
+            hit (bool): True if all of the requested products were found
+                and have been linked or copied to their destinations.
+
+    """
+    entry = os.path.join(path, key)
+
+    if not all(os.path.isfile(os.path.join(entry, name)) for name in products):
+        return False
+
+    for name in products:
+        _linkorcopy(os.path.join(entry, name), products[name])
+
+    # Update the entry's timestamp for LRU eviction.
+    os.utime(entry, None)
+    print('geometry_cache -- Using cached geometry: '+entry)
+    return True
+
+
+def store(key, products, path=None, maxbytes=None):
+    """Adds geometry products to the cache.
+
+        The files are hard linked into the cache when possible, and made
+        read-only, since they may be shared with the data folder.
+
+        Arguments:
+            key (str): Cache key from geometrykey().
+            products (dict): Filenames of the products to store, keyed by
+                product name (see PRODUCTS).
+            path (str): Cache directory.
+            maxbytes (int): Cache size cap, in bytes.  Default: value from
+                cachemaxbytes().
+
+    """
+    if maxbytes is None:
+        maxbytes = cachemaxbytes()
+
+    entry = os.path.join(path, key)
+    if os.path.isdir(entry):
+        return
+
+    # Fill a temporary folder first, so that partially written entries are
+    # never visible to other processes.
+    os.makedirs(path, exist_ok=True)
+    tmpentry = tempfile.mkdtemp(prefix='.tmp_'+key+'_', dir=path)
+    for name in products:
+        _linkorcopy(products[name], os.path.join(tmpentry, name))
+        os.chmod(os.path.join(tmpentry, name), stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+
+    try:
+        os.rename(tmpentry, entry)
+        print('geometry_cache -- Stored geometry: '+entry)
+    except OSError: # another process stored the same entry first
+        shutil.rmtree(tmpentry, ignore_errors=True)
+
+    evict(path, maxbytes)
+
+
+def evict(path, maxbytes):
+    """Removes least recently used cache entries until the total size of
+    the cache is at most maxbytes."""
+    entries = []
+    total = 0
+    for name in os.listdir(path):
+        entry = os.path.join(path, name)
+        if name.startswith('.') or not os.path.isdir(entry):
+            continue
+        size = sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+        entries.append((os.path.getmtime(entry), size, entry))
+        total += size
+
+    for mtime, size, entry in sorted(entries):
+        if total <= maxbytes:
+            break
+        print('geometry_cache -- Evicting: '+entry)
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
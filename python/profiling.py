@@ -0,0 +1,202 @@
+"""Per-stage timing and memory profiling for the calibration workflow.
+
+When profiling is enabled, batchcal(), createlut(), mergelut() and runcal()
+append one JSON object per line to a log file for each stage of each scene
+(annotation parsing, DEM conversion, calibration, geocoding, header
+creation, postprocessing, LUT binning, and LUT smoothing).  Each event
+records:
+
+    stage, scene        Name of the stage, and of the scene (if any).
+    host, pid           Where the stage ran.
+    start, end          Unix timestamps, and the elapsed wall-clock seconds.
+    read_bytes,         Bytes read from and written to storage by the
+    write_bytes         process and by the programs it ran in the stage
+                        (page cache hits are not counted).
+    peak_rss            Peak resident set size of the process so far, in
+                        bytes.
+    child_peak_rss      Largest peak resident set size of the programs run
+                        in the stage (e.g., uavsar_calib), in bytes, or null
+                        if there were none.  On Linux, it is sampled from
+                        /proc while the programs run (every POLL seconds),
+                        since the rusage of a child process also includes
+                        the memory of the Python process it was started
+                        from.
+    children            Number of programs run in the stage.
+
+plus any stage-specific fields (e.g., the polarization).  Stages can be
+nested, in which case the outer stage includes the inner ones.
+
+Profiling is enabled by setting the RADIOCAL_PROFILE environment variable to
+the path of the log file, or by the profilefile argument of the functions
+above (which sets the variable, so that worker processes and later calls
+also log to the same file).  The log can be shared by many processes, since
+each event is appended with a single write.
+
+Example:
+
+    with profiling.stage('geocode', scene, pol='HHHH'):
+        print(profiling.getoutput(geocode_exec))
+"""
+
+import contextlib
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+
+ENV = 'RADIOCAL_PROFILE'
+
+# Interval for sampling the peak memory of running programs, in seconds.
+POLL = 0.05
+
+# Open stages of this process, innermost last.
+_stack = []
+
+
+def enable(logfile):
+    """Enables profiling for this process and the processes it starts,
+    appending events to logfile."""
+    os.environ[ENV] = os.path.abspath(logfile)
+
+
+def enabled():
+    """Returns True if profiling is enabled."""
+    return bool(os.environ.get(ENV))
+
+
+def _maxrss(ru):
+    """Peak resident set size from a resource usage struct, in bytes."""
+    return ru.ru_maxrss*(1 if sys.platform == 'darwin' else 1024)
+
+
+def _iobytes():
+    """Bytes read from and written to storage by this process so far, or
+    (None, None) if this is not available (e.g., not on Linux)."""
+    try:
+        with open('/proc/self/io', 'r') as f:
+            io = dict(line.split(':') for line in f if ':' in line)
+        return int(io['read_bytes']), int(io['write_bytes'])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def _write(event):
+    """Appends an event to the log file."""
+    line = (json.dumps(event, sort_keys=True)+'\n').encode()
+    fd = os.open(os.environ[ENV], os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+
+@contextlib.contextmanager
+def stage(name, scene=None, **fields):
+    """Context manager which logs a stage event when the block finishes (or
+    fails, in which case the event has "failed": true).  Does nothing if
+    profiling is not enabled.
+
+        Arguments:
+            name (str): Name of the stage (e.g., 'calib').
+            scene (str): Name of the scene, if the stage belongs to one.
+            **fields: Extra fields to log (must be JSON serializable).
+
+    """
+    if not enabled():
+        yield
+        return
+
+    current = {'children': 0, 'child_peak_rss': None,
+               'child_read_bytes': 0, 'child_write_bytes': 0}
+    _stack.append(current)
+    read0, write0 = _iobytes()
+    start = time.time()
+    failed = True
+    try:
+        yield
+        failed = False
+    finally:
+        end = time.time()
+        read1, write1 = _iobytes()
+        _stack.remove(current)
+
+        event = {'event': 'stage', 'stage': name, 'scene': scene,
+                 'host': socket.gethostname(), 'pid': os.getpid(),
+                 'start': start, 'end': end, 'seconds': end - start,
+                 'read_bytes': None, 'write_bytes': None,
+                 'peak_rss': _maxrss(resource.getrusage(resource.RUSAGE_SELF)),
+                 'child_peak_rss': current['child_peak_rss'],
+                 'children': current['children']}
+        if read0 is not None:
+            event['read_bytes'] = read1 - read0 + current['child_read_bytes']
+            event['write_bytes'] = write1 - write0 + current['child_write_bytes']
+        if failed:
+            event['failed'] = True
+        event.update(fields)
+        _write(event)
+
+
+def _hwm(pid):
+    """Peak resident set size (VmHWM) of a running process and of its
+    descendants, in bytes, or 0 if it is not available (e.g., the process
+    has exited)."""
+    peak = 0
+    try:
+        with open('/proc/{}/status'.format(pid), 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    peak = int(line.split()[1])*1024
+        with open('/proc/{0}/task/{0}/children'.format(pid), 'r') as f:
+            children = [int(child) for child in f.read().split()]
+    except (OSError, ValueError):
+        return peak
+    for child in children:
+        peak = max(peak, _hwm(child))
+    return peak
+
+
+def getoutput(cmd):
+    """Runs a shell command and returns its output (stdout and stderr), like
+    subprocess.getoutput().  If profiling is enabled, the resource usage of
+    the command is added to the open stages."""
+    if not (enabled() and _stack):
+        return subprocess.getoutput(cmd)
+
+    proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT, text=True)
+    output = []
+    reader = threading.Thread(target=lambda: output.append(proc.stdout.read()))
+    reader.start()
+
+    # Sample the peak memory until the command exits, then reap it here to
+    # get its resource usage (which includes the programs run by the shell):
+    sampled = os.path.isdir('/proc/self')
+    peak = 0
+    while True:
+        pid, status, ru = os.wait4(proc.pid, os.WNOHANG)
+        if pid != 0:
+            break
+        if sampled:
+            peak = max(peak, _hwm(proc.pid))
+        time.sleep(POLL)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    reader.join()
+    proc.stdout.close()
+
+    if not sampled:
+        peak = _maxrss(ru)
+    for current in _stack:
+        current['children'] += 1
+        current['child_peak_rss'] = max(current['child_peak_rss'] or 0, peak)
+        current['child_read_bytes'] += ru.ru_inblock*512
+        current['child_write_bytes'] += ru.ru_oublock*512
+
+    output = output[0] if output else ''
+    if output.endswith('\n'):
+        output = output[:-1]
+    return output
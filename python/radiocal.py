@@ -5,7 +5,10 @@ UAVSAR Radiometric Calibration Module
 The actual radiometric calibration is done by the C programs uavsar_calib_area
 and uavsar_calib_veg.  These are helper functions which allow easier batch
 processing and calibration LUT creation.  Batch processing is performed using
-the batchcal() function.  LUT creation is done using createlut().
+the batchcal() function.  LUT creation is done using createlut().  A LUT can
+be applied to already area corrected GRD files using applylut(), without
+running the calibration program again.  LUTs can be updated with new scenes
+using mergelut(), from the per-scene partial sums saved by createlut().
 
 See function definitions for the allowed arguments, or radiocal_script.py for
 an example script that calls the functions.
@@ -15,15 +18,25 @@ Created on Tue May 26 11:29:51 2015
 @author: mdenbina
 """
 
+import json
+import multiprocessing
 import numpy as np
 import os
-import subprocess
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 import osgeo.gdal as gdal
 import scipy.signal
 from scipy.stats import binned_statistic
 import matplotlib.pyplot as plt
 
 from buildUAVSARhdr import genHDRfromTXT
+import annotation
+import geometry_cache
+import profiling
+import resampler
+import uavsar_lib
 
 
 
@@ -33,7 +46,10 @@ def batchcal(datapath, programpath, calibprog, geocodeprog, caltblroot,
              calname='area_veg', docorrectionflag=True, zerodemflag=False, 
              createmaskflag=True, createlookflag=False, createslopeflag=False, 
              overwriteflag=False, postprocessflag=True, minlook=25, 
-             maxlook=64, pol=[0,1,2], hgtval=0, scene=None):
+             maxlook=64, pol=[0,1,2], hgtval=0, scene=None, cacheflag=True,
+             resampleflag=False, fusedgeocodeflag=False, saverdcflag=True,
+             covarianceflag=False, profilefile=None, nthreads=1,
+             libraryflag=False):
     """Function to perform batch radiometric calibration given a folder
     containing UAVSAR data.
     
@@ -51,8 +67,10 @@ def batchcal(datapath, programpath, calibprog, geocodeprog, caltblroot,
     - docorrectionflag, a flag that determines whether the correction programs
         are actually called (you can set to False for testing, for example)
     - zerodemflag, a flag that determines whether the .hgt file is used for
-        DEM information (if False), or whether a flat, zero height DEM file
-        is temporarily created (if True).
+        DEM information (if False), or whether a flat DEM of height hgtval is
+        used instead (if True).  The flat DEM is not written to disk: the
+        calibration program is given the height (with its -e option), and
+        the .hgt file is not needed.
     - createmaskflag, a flag that determines if the mask data (which records
         which pixels were able to be corrected) generated by the calibration
         program is saved.
@@ -83,8 +101,70 @@ def batchcal(datapath, programpath, calibprog, geocodeprog, caltblroot,
         if you only want to process a single scene.  Otherwise, leave this
         at the default value of None in order to process all scenes in the
         folder.
+    - cacheflag, a flag that determines whether the facet model geometry,
+        geocoding transformation, look angle, and slope angle are taken from
+        (and saved to) the geometry cache, so that repeated runs over the
+        same scene (e.g., the area only and vegetation LUT corrections) only
+        compute them once.  See geometry_cache.py for the cache location and
+        size settings.
+    - resampleflag, a flag that determines whether geocoding is done in
+        Python using a sparse resampling operator (see resampler.py) instead
+        of calling the geocode executable for each image.  The operator is
+        built from the geocoding transformation once per scene, and saved in
+        the data folder as <root>resampler.npz for later runs.  The results
+        are identical, but the transformation is only read once per scene.
+        Note that the operator may need several GB of memory for large
+        scenes.
+    - fusedgeocodeflag, a flag that determines whether the calibration
+        program geocodes the calibrated image itself (using its -q option),
+        instead of writing the calibrated .mlc file and then geocoding it
+        with the geocode executable.  This avoids writing and reading back
+        the .mlc file, but the calibration program then keeps the
+        calibrated images of the whole scene in memory: 4 bytes per MLC
+        pixel for each polarization, or 36 bytes per pixel for all six
+        terms with covarianceflag.  Scenes for which this would exceed
+        8 GB (or the limit in GB given by the UAVSAR_CALIB_GEOCODE_MAXGB
+        environment variable) are geocoded separately instead.
+    - saverdcflag, a flag that determines whether the calibrated .mlc files
+        in radar coordinates are kept.  If set to False together with
+        fusedgeocodeflag, the .mlc files are never written (unless the
+        scene is too large to geocode in memory, see above).  If set to False
+        without fusedgeocodeflag, they are removed after geocoding.
+    - covarianceflag, a flag that determines whether all six terms of the
+        covariance matrix (HHHH, HVHV, VVVV, HHHV, HHVV, and HVVV) are
+        calibrated, instead of the polarizations given by pol.  The
+        calibration program is then run once per scene (with polarization
+        COV), and corrects the off-diagonal terms with the geometric mean of
+        the correction ratios of their two diagonal terms.  The six terms
+        are geocoded together, by the calibration program itself if
+        fusedgeocodeflag is set, or otherwise in one pass with the sparse
+        resampling operator (since the geocode executable only handles
+        float images).  Requires the .mlc files of all six terms.
+    - profilefile, the filename of a JSON-lines log to which the time,
+        storage I/O, and peak memory of each stage of each scene are
+        appended (see profiling.py).  Profiling can also be enabled with the
+        RADIOCAL_PROFILE environment variable.  Default: None.
+    - nthreads, the number of worker threads used by the calibration
+        program (its -n option) for the DEM facet model and the correction.
+        The results do not depend on the number of threads.  Default: 1.
+    - libraryflag, a flag that determines whether the correction and the
+        geocoding are done in-process by the libuavsar shared library (see
+        uavsar_lib.py) instead of by the executables.  The calibration
+        program is then only run when the facet model geometry of a scene
+        is not available yet (i.e., for its first polarization, if it is not
+        in the geometry cache).  The other polarizations are calibrated and
+        geocoded in memory, so the .mlc files are only written if
+        saverdcflag is set, and resampleflag and fusedgeocodeflag have no
+        effect on them.  The results are identical.  If the library cannot
+        be loaded, the executables are used.
     
     """   
+    if profilefile is not None:
+        profiling.enable(profilefile)
+    
+    uselib = (libraryflag == True) and uavsar_lib.available()
+    if (libraryflag == True) and (uselib == False):
+        print('batchcal -- Cannot load the libuavsar shared library.  Using the executables instead.')
     
     pol_str = ['HHHH','VVVV','HVHV']
     pol_shortstr = ['HH','VV','HV']   
@@ -92,146 +172,431 @@ def batchcal(datapath, programpath, calibprog, geocodeprog, caltblroot,
     lat = None
     lon = None
     
-    os.chdir(datapath)
+    # All files are referred to by absolute paths, and the temporary files
+    # for each scene are written to a scratch folder of their own, so that
+    # several batchcal calls (e.g., for different scenes or polarizations
+    # in the same folder) can safely run at the same time.
+    datapath = os.path.abspath(datapath)
     
     # Browse through the directory, looking for the .ann files, and for each
     # .ann file, do the calibration on the HH, HV, and VV polarizations:
-    files = os.listdir('.')
+    files = os.listdir(datapath)
     for file in files:
         if file.endswith('.ann') and ((scene is None) or (scene in file)):
             print(file)
-            rootname = file[0:-14]
-            hgtname_tif = file[0:-4] + '_hgt.tif' #'.hgt'
-            hgtname=file[0:-4]+'.hgt' # file to use for calib_exe, which expects binary format
+            scenename = file[0:-4]
+            annfile = os.path.join(datapath, file)
+            rootname = os.path.join(datapath, file[0:-14])
+            hgtname_tif = os.path.join(datapath, file[0:-4] + '_hgt.tif') #'.hgt'
+            hgtname = os.path.join(datapath, file[0:-4]+'.hgt') # file to use for calib_exe, which expects binary format
             skip = False
             
             # Load the annotation file info:
-            anndata = open(file).read().splitlines()
-            
-            mlc_cols_str = str([s for s in anndata if 'mlc_pwr.set_cols' in s]) # find string containing the number of mlc columns
-            mlc_cols = int(str(mlc_cols_str.split(sep='=')[1]).split(sep=';')[0])
-            
-            grd_rows_str = str([s for s in anndata if 'grd_pwr.set_rows' in s]) # find string containing the number of grd rows
-            grd_rows = int(str(grd_rows_str.split(sep='=')[1]).split(sep=';')[0])
+            with profiling.stage('ann', scenename):
+                ann = annotation.load(annfile)
             
-            grd_cols_str = str([s for s in anndata if 'grd_pwr.set_cols' in s]) # find string containing the number of grd columns
-            grd_cols = int(str(grd_cols_str.split(sep='=')[1]).split(sep=';')[0])
+            mlc_cols = int(ann['mlc_pwr.set_cols'])
+            mlc_rows = int(ann['mlc_pwr.set_rows'])
+            grd_rows = int(ann['grd_pwr.set_rows'])
+            grd_cols = int(ann['grd_pwr.set_cols'])
             
-            # convert tif to binary format for calib_exe to work
-            if not os.path.isfile(hgtname) or overwriteflag: # if binary .hgt file doesn't already exist
-                print('Converting .tif to binary: {} > {}'.format(hgtname_tif, hgtname))
-                translate_exe = 'gdal_translate -of ENVI -co "SUFFIX=ADD" '+hgtname_tif+' '+hgtname
-                print('Executing: ' + translate_exe)
-                print(subprocess.getoutput(translate_exe))
+            scratch = tempfile.mkdtemp(prefix='.batchcal_'+file[0:-4]+'_', dir=datapath)
             
-            if (zerodemflag == True) and (docorrectionflag == True):
-                # Rename current DEM:
-                mvhgt_exec = 'mv '+hgtname+' '+hgtname+'_orig'
-                print('Executing: ' + mvhgt_exec)
-                print(subprocess.getoutput(mvhgt_exec))
+            try:
+                # convert tif to binary format for calib_exe to work
+                if (zerodemflag == False) and (not os.path.isfile(hgtname) or overwriteflag): # if binary .hgt file doesn't already exist
+                    with profiling.stage('hgt', scenename):
+                        print('Converting .tif to binary: {} > {}'.format(hgtname_tif, hgtname))
+                        hgtname_temp = os.path.join(scratch, os.path.basename(hgtname))
+                        translate_exe = 'gdal_translate -of ENVI -co "SUFFIX=ADD" '+hgtname_tif+' '+hgtname_temp
+                        print('Executing: ' + translate_exe)
+                        print(profiling.getoutput(translate_exe))
+                        if os.path.isfile(hgtname_temp):
+                            if os.path.isfile(hgtname_temp+'.hdr'):
+                                os.replace(hgtname_temp+'.hdr', hgtname+'.hdr')
+                            os.replace(hgtname_temp, hgtname)
                 
-                # Create flat DEM: # HERE I modified to write it with header file
-                zerodem = np.ones((grd_rows,grd_cols),dtype='float32') * hgtval
-                zerodem.tofile(hgtname)
-                # genHDRfromTXT(file,hgtname+'.grd','HHHH')
-            
-            # Take the latitude/longitude of the corners from the ann file:
-            ULlat = str([s for s in anndata if 'Approximate Upper Left Latitude' in s])
-            ULlat = float(str(ULlat.split(sep='=')[1]).split(sep='\'')[0])
-            ULlon = str([s for s in anndata if 'Approximate Upper Left Longitude' in s])
-            ULlon = float(str(ULlon.split(sep='=')[1]).split(sep='\'')[0])
-            URlat = str([s for s in anndata if 'Approximate Upper Right Latitude' in s])
-            URlat = float(str(URlat.split(sep='=')[1]).split(sep='\'')[0])
-            URlon = str([s for s in anndata if 'Approximate Upper Right Longitude' in s])
-            URlon = float(str(URlon.split(sep='=')[1]).split(sep='\'')[0])
-            LLlat = str([s for s in anndata if 'Approximate Lower Left Latitude' in s])
-            LLlat = float(str(LLlat.split(sep='=')[1]).split(sep='\'')[0])
-            LLlon = str([s for s in anndata if 'Approximate Lower Left Longitude' in s])
-            LLlon = float(str(LLlon.split(sep='=')[1]).split(sep='\'')[0])
-            LRlat = str([s for s in anndata if 'Approximate Lower Right Latitude' in s])
-            LRlat = float(str(LRlat.split(sep='=')[1]).split(sep='\'')[0])
-            LRlon = str([s for s in anndata if 'Approximate Lower Right Longitude' in s])
-            LRlon = float(str(LRlon.split(sep='=')[1]).split(sep='\'')[0])
-            
-            if lat is None:
-                lat = np.array([ULlat, URlat, LLlat, LRlat])
-                lon = np.array([ULlon, URlon, LLlon, LRlon])
-            else:
-                lat = np.append(lat, (ULlat, URlat, LLlat, LRlat))
-                lon = np.append(lon, (ULlon, URlon, LLlon, LRlon))
-            
-            
-            for p in range(0,np.size(pol)):
-                mlcfile = rootname+pol_str[pol[p]]+'_'+calname+'.mlc'
-                grdfile = rootname+pol_str[pol[p]]+'_'+calname+'.grd'
+                # Take the latitude/longitude of the corners from the ann file:
+                ULlat = float(ann['Approximate Upper Left Latitude'])
+                ULlon = float(ann['Approximate Upper Left Longitude'])
+                URlat = float(ann['Approximate Upper Right Latitude'])
+                URlon = float(ann['Approximate Upper Right Longitude'])
+                LLlat = float(ann['Approximate Lower Left Latitude'])
+                LLlon = float(ann['Approximate Lower Left Longitude'])
+                LRlat = float(ann['Approximate Lower Right Latitude'])
+                LRlon = float(ann['Approximate Lower Right Longitude'])
                 
-                if (grdfile in files) and (overwriteflag == False):
-                    print(grdfile,' already exists -- skipping...')
-                    skip = True
+                if lat is None:
+                    lat = np.array([ULlat, URlat, LLlat, LRlat])
+                    lon = np.array([ULlon, URlon, LLlon, LRlon])
                 else:
-                    # calib_exec = calibprog+' '+file+' '+pol_str[pol[p]]+' geomap_uavsar.trans '+mlcfile+' '+caltblfile
-                    if caltblroot is not None:
-                        caltblfile = caltblroot+'_'+pol_shortstr[pol[p]]+'.flt'
-                        calib_exec = calibprog+' -u geomap_uavsar.trans -c '+caltblfile+' -l look_temp -s slope_temp -m mask_temp '+file+' '+pol_str[pol[p]]+' '+mlcfile
+                    lat = np.append(lat, (ULlat, URlat, LLlat, LRlat))
+                    lon = np.append(lon, (ULlon, URlon, LLlon, LRlon))
+                
+                
+                # The facet model geometry only depends on the .ann and DEM,
+                # so it is computed for the first polarization and saved to
+                # geomfile, then reused for the remaining polarizations.
+                geomfile = os.path.join(scratch, 'geometry_uavsar.geom')
+                transfile = os.path.join(scratch, 'geomap_uavsar.trans')
+                lookfile = os.path.join(scratch, 'look_temp')
+                slopefile = os.path.join(scratch, 'slope_temp')
+                maskfile = os.path.join(scratch, 'mask_temp')
+                geomproducts = {'geom': geomfile, 'trans': transfile,
+                                'look': lookfile, 'slope': slopefile}
+                geomready = False
+                resampleop = None
+                
+                # Each calibration run corrects one polarization, or all
+                # terms of the covariance matrix at once (COV):
+                if covarianceflag == True:
+                    calpols = ['COV']
+                else:
+                    calpols = [pol_str[pol[p]] for p in range(0,np.size(pol))]
+                
+                for calpol in calpols:
+                    if calpol == 'COV':
+                        terms = annotation.COV_TERMS
                     else:
-                        calib_exec = calibprog+' -u geomap_uavsar.trans -l look_temp -s slope_temp -m mask_temp '+file+' '+pol_str[pol[p]]+' '+mlcfile
-                    geocode_exec = geocodeprog+' '+mlcfile+' '+str(mlc_cols)+' geomap_uavsar.trans '+grdfile+' '+str(grd_cols)+' '+str(grd_rows)
+                        terms = [calpol]
+                    fused = (fusedgeocodeflag == True) and _fusedgeocodefits(terms, mlc_rows, mlc_cols)
+                    if (fusedgeocodeflag == True) and (fused == False):
+                        print('radiocal.batchcal | Calibrated images of '+calpol+' too large to keep in memory for fused geocoding -- geocoding separately.')
+                    mlcfile = rootname+calpol+'_'+calname+'.mlc'
+                    grdfile = rootname+calpol+'_'+calname+'.grd'
+                    grdfile_temp = os.path.join(scratch, os.path.basename(grdfile))
+                    mlcfiles = [rootname+term+'_'+calname+'.mlc' for term in terms]
+                    grdfiles = [rootname+term+'_'+calname+'.grd' for term in terms]
+                    grdfiles_temp = [os.path.join(scratch, os.path.basename(f)) for f in grdfiles]
                     
-                    if docorrectionflag == True:
-                        print('Executing: ' + calib_exec)
-                        print(subprocess.getoutput(calib_exec))
-                        print('Executing: ' + geocode_exec)
-                        print(subprocess.getoutput(geocode_exec))
+                    if all(os.path.isfile(f) for f in grdfiles) and (overwriteflag == False):
+                        print(grdfile,' already exists -- skipping...')
+                        skip = True
+                    else:
+                        if (docorrectionflag == True) and (geomready == False) and (cacheflag == True):
+                            geomcache = geometry_cache.cachedir(datapath)
+                            if zerodemflag == True:
+                                geomkey = geometry_cache.geometrykey(annfile, hgtval=hgtval)
+                            else:
+                                geomkey = geometry_cache.geometrykey(annfile, hgtname)
+                            geomready = geometry_cache.fetch(geomkey, geomproducts, geomcache)
                         
-                        # Create header file:
-                        genHDRfromTXT(file,grdfile,pol_str[pol[p]])
-                
-                
-    
-            if (docorrectionflag == True) and (skip == False):
-                if createmaskflag == True:
-                    geocode_mask_exec = geocodeprog + ' mask_temp '+str(mlc_cols)+' geomap_uavsar.trans '+rootname+'mask.grd '+str(grd_cols)+' '+str(grd_rows)
-                    print('Executing: ' + geocode_mask_exec)
-                    print(subprocess.getoutput(geocode_mask_exec))
-                    genHDRfromTXT(file,rootname+'mask.grd',pol_str[0])
-    
-                if createslopeflag == True:
-                    mvslope_exec = 'mv slope_temp '+rootname+'slope.grd'
-                    print('Executing: ' + mvslope_exec)
-                    print(subprocess.getoutput(mvslope_exec))
-                    genHDRfromTXT(file,rootname+'slope.grd',pol_str[0])
+                        # calib_exec = calibprog+' '+file+' '+pol_str[pol[p]]+' geomap_uavsar.trans '+mlcfile+' '+caltblfile
+                        if geomready:
+                            calib_exec = calibprog+' -G '+geomfile+' '
+                            if fused == True:
+                                calib_exec += '-t '+transfile+' '
+                        else:
+                            calib_exec = calibprog+' -g '+geomfile+' -u '+transfile+' -l '+lookfile+' -s '+slopefile+' '
+                            if zerodemflag == True:
+                                calib_exec += '-e '+repr(float(hgtval))+' '
+                        
+                        if nthreads > 1:
+                            calib_exec += '-n '+str(nthreads)+' '
+                        
+                        if fused == True:
+                            calib_exec += '-q '+grdfile_temp+' '
+                            if saverdcflag == True:
+                                calib_outfile = mlcfile
+                            else:
+                                calib_outfile = '-'
+                        else:
+                            calib_outfile = mlcfile
+                        
+                        if caltblroot is not None:
+                            if calpol == 'COV':
+                                caltblfile = caltblroot # uavsar_calib adds _HH.flt, _HV.flt, and _VV.flt
+                            else:
+                                caltblfile = caltblroot+'_'+calpol[0:2]+'.flt'
+                            calib_exec += '-c '+caltblfile+' -m '+maskfile+' '+annfile+' '+calpol+' '+calib_outfile
+                        else:
+                            calib_exec += '-m '+maskfile+' '+annfile+' '+calpol+' '+calib_outfile
+                        geocode_exec = geocodeprog+' '+mlcfile+' '+str(mlc_cols)+' '+transfile+' '+grdfile_temp+' '+str(grd_cols)+' '+str(grd_rows)
+                        
+                        if docorrectionflag == True:
+                            if uselib and geomready:
+                                # Calibrate (and geocode) in-process, from the
+                                # geometry of the first polarization or cache:
+                                print('Calibrating: ' + mlcfile + ' > ' + grdfile)
+                                with profiling.stage('calib', scenename, pol=calpol):
+                                    uavsar_lib.calibrate(annfile, terms, geomfile,
+                                                         mlcfiles if saverdcflag == True else None,
+                                                         caltbl=caltblfile if caltblroot is not None else None,
+                                                         maskfile=maskfile, transfile=transfile,
+                                                         grdfiles=grdfiles_temp, nthreads=nthreads)
+                            else:
+                                print('Executing: ' + calib_exec)
+                                with profiling.stage('calib', scenename, pol=calpol):
+                                    print(profiling.getoutput(calib_exec))
+                                if (geomready == False) and os.path.isfile(geomfile):
+                                    geomready = True
+                                    if cacheflag == True:
+                                        geometry_cache.store(geomkey, geomproducts, geomcache)
+                                if fused == True:
+                                    pass # already geocoded by the calibration program
+                                elif uselib:
+                                    with profiling.stage('geocode', scenename, pol=calpol):
+                                        print('Geocoding: ' + mlcfile + ' > ' + grdfile)
+                                        uavsar_lib.geocodefiles(transfile,mlcfiles,grdfiles_temp,mlc_rows,mlc_cols,grd_rows,grd_cols,
+                                                                ['<f4' if term in pol_str else '<c8' for term in terms],nthreads)
+                                elif (resampleflag == True) or (calpol == 'COV'):
+                                    with profiling.stage('geocode', scenename, pol=calpol):
+                                        if resampleop is None:
+                                            resampleop = resampler.load(rootname+'resampler.npz',transfile,mlc_rows,mlc_cols,grd_rows,grd_cols)
+                                        print('Geocoding: ' + mlcfile + ' > ' + grdfile)
+                                        resampler.geocodebands(resampleop,mlcfiles,grdfiles_temp,mlc_cols,grd_cols,
+                                                               ['<f4' if term in pol_str else '<c8' for term in terms])
+                                else:
+                                    print('Executing: ' + geocode_exec)
+                                    with profiling.stage('geocode', scenename, pol=calpol):
+                                        print(profiling.getoutput(geocode_exec))
+                            
+                            for term, mlcterm, grdterm, grdterm_temp in zip(terms, mlcfiles, grdfiles, grdfiles_temp):
+                                if os.path.isfile(grdterm_temp):
+                                    os.replace(grdterm_temp, grdterm)
+                                
+                                if (saverdcflag == False) and os.path.isfile(mlcterm):
+                                    os.remove(mlcterm)
+                                
+                                # Create header file:
+                                with profiling.stage('header', scenename, pol=term):
+                                    genHDRfromTXT(annfile,grdterm,term)
+                    
                     
-                if createlookflag == True:
-                    mvlook_exec = 'mv look_temp '+rootname+'look.grd'
-                    print('Executing: ' + mvlook_exec)
-                    print(subprocess.getoutput(mvlook_exec))
-                    genHDRfromTXT(file,rootname+'look.grd',pol_str[0])
+        
+                if (docorrectionflag == True) and (skip == False):
+                    if createmaskflag == True:
+                        maskgrd_temp = os.path.join(scratch, 'mask.grd')
+                        with profiling.stage('geocode', scenename, pol='mask'):
+                            if uselib:
+                                print('Geocoding: ' + maskfile + ' > ' + rootname+'mask.grd')
+                                uavsar_lib.geocodefiles(transfile,[maskfile],[maskgrd_temp],mlc_rows,mlc_cols,grd_rows,grd_cols,
+                                                        nthreads=nthreads)
+                            elif resampleflag == True:
+                                if resampleop is None:
+                                    resampleop = resampler.load(rootname+'resampler.npz',transfile,mlc_rows,mlc_cols,grd_rows,grd_cols)
+                                print('Geocoding: ' + maskfile + ' > ' + rootname+'mask.grd')
+                                resampler.geocode(resampleop,maskfile,maskgrd_temp,mlc_cols,grd_cols)
+                            else:
+                                geocode_mask_exec = geocodeprog + ' '+maskfile+' '+str(mlc_cols)+' '+transfile+' '+maskgrd_temp+' '+str(grd_cols)+' '+str(grd_rows)
+                                print('Executing: ' + geocode_mask_exec)
+                                print(profiling.getoutput(geocode_mask_exec))
+                        if os.path.isfile(maskgrd_temp):
+                            os.replace(maskgrd_temp, rootname+'mask.grd')
+                        with profiling.stage('header', scenename, pol='mask'):
+                            genHDRfromTXT(annfile,rootname+'mask.grd',pol_str[0])
+        
+                    # The look and slope files may be hard linked to the
+                    # geometry cache, and may even be links to the same file
+                    # as the existing destination, in which case a rename
+                    # would do nothing.  So remove the destination first.
+                    if (createslopeflag == True) and os.path.isfile(slopefile):
+                        if os.path.lexists(rootname+'slope.grd'):
+                            os.remove(rootname+'slope.grd')
+                        print('Moving: ' + slopefile + ' > ' + rootname+'slope.grd')
+                        os.replace(slopefile, rootname+'slope.grd')
+                        with profiling.stage('header', scenename, pol='slope'):
+                            genHDRfromTXT(annfile,rootname+'slope.grd',pol_str[0])
+                        
+                    if (createlookflag == True) and os.path.isfile(lookfile):
+                        if os.path.lexists(rootname+'look.grd'):
+                            os.remove(rootname+'look.grd')
+                        print('Moving: ' + lookfile + ' > ' + rootname+'look.grd')
+                        os.replace(lookfile, rootname+'look.grd')
+                        with profiling.stage('header', scenename, pol='look'):
+                            genHDRfromTXT(annfile,rootname+'look.grd',pol_str[0])
+            
+            finally:
+                shutil.rmtree(scratch, ignore_errors=True)
     
     
     
-            if (zerodemflag == True) and (docorrectionflag == True):
-                # Put back the DEM:
-                mvhgt_exec = 'mv '+hgtname+'_orig '+hgtname
-                print('Executing: ' + mvhgt_exec)
-                print(subprocess.getoutput(mvhgt_exec))
+            if (postprocessflag == True) and (docorrectionflag == True) and (skip == False):
+                if covarianceflag == True:
+                    terms = annotation.COV_TERMS
+                else:
+                    terms = [pol_str[pol[p]] for p in range(0,np.size(pol))]
+                grdfiles = [rootname+term+'_'+calname+'.grd' for term in terms]
+                with profiling.stage('postprocess', scenename):
+                    _postprocess(grdfiles, rootname+'mask.grd', rootname+'look.grd',
+                                 grd_rows, grd_cols, minlook, maxlook,
+                                 dtypes=['<f4' if term in pol_str else '<c8' for term in terms])
+
     
     
+def _fusedgeocodefits(terms, mlc_rows, mlc_cols):
+    """Whether the calibration program can geocode the calibrated images of
+    terms itself (-q).  It then keeps them in memory for the whole scene (4
+    bytes per MLC pixel for each intensity term, and 8 for each complex
+    term), which it refuses above 8 GB, or above the limit in GB given by
+    the UAVSAR_CALIB_GEOCODE_MAXGB environment variable."""
+    planes = sum(1 if term in ['HHHH','VVVV','HVHV'] else 2 for term in terms)
+    maxgb = float(os.environ.get('UAVSAR_CALIB_GEOCODE_MAXGB', 8))
+    return 4.0*planes*mlc_rows*mlc_cols/1e9 <= maxgb
+    
+    
+    
+def _postprocess(grdfiles, maskfile, lookfile, grd_rows, grd_cols, minlook,
+                 maxlook, blocksize=1024, dtypes=None):
+    """Sets the pixels of the calibrated GRD images which are masked, not
+    finite, or outside of the look angle range to zero.
+    
+    All of the polarizations are done in a single pass over row blocks, so
+    that the mask and look angle files are only read once, and the invalid
+    pixels are only found once for each block.  dtypes gives the data type
+    of each file ('<f4' by default, or '<c8' for the off-diagonal covariance
+    matrix terms).
+    
+    """
+    if dtypes is None:
+        dtypes = ['<f4']*len(grdfiles)
+    
+    mask = np.memmap(maskfile,shape=(grd_rows,grd_cols),dtype='<f4',mode='r')
+    look = np.memmap(lookfile,shape=(grd_rows,grd_cols),dtype='<f4',mode='r')
+    data = [np.memmap(grdfile,shape=(grd_rows,grd_cols),dtype=dtype,mode='r+') for grdfile, dtype in zip(grdfiles, dtypes)]
+    
+    for row in range(0, grd_rows, blocksize):
+        rows = slice(row, min(row+blocksize, grd_rows))
+        
+        lookblock = look[rows]
+        invalid = (mask[rows] > 0) | (lookblock < minlook) | (lookblock > maxlook)
+        
+        for datablock in (d[rows] for d in data):
+            datablock[invalid | np.logical_not(np.isfinite(datablock))] = 0
+    
+    for d in data:
+        d.flush()
+    del data, mask, look
+    
+    
+    
+def applylut(datapath, caltblroot, calname='area_veg', corrstr='area_only',
+             pol=[0,1,2], flatdemflag=False, overwriteflag=False,
+             scene=None, blocksize=1024):
+    """Apply a vegetation LUT to area corrected GRD files.
+    
+    This performs the same vegetation LUT correction as the calibration
+    program, but starts from the area corrected GRD files, and the look and
+    slope angle GRD files created by batchcal() (with createlookflag and
+    createslopeflag enabled).  The facet model therefore does not need to be
+    run again, so that trying out a new LUT only takes a few seconds per
+    scene.  The LUT bins are computed in the same way as in uavsar_calib.
+    Note that the look and slope angles used here are the geocoded values
+    for each GRD pixel, rather than the values for each radar pixel used by
+    uavsar_calib, so the results will differ slightly near the edges of
+    strong topography.
+    
+    The images are processed in blocks of rows, so that memory use is
+    independent of the scene size.
+    
+    Input Arguments:
+    
+    - datapath, the path to the folder containing the UAVSAR data (which
+        should include the .ann file, and the GRD files created by batchcal)
+    - caltblroot, the full path and root filename of the calibration LUT to
+        use.  (e.g., programpath+'caltbl_LA_GulfCo_Wetlands')
+    - calname, a descriptive name to append to the calibrated files.
+    - corrstr, the filename descriptor of the area corrected GRD files to
+        apply the LUT to (the calname used when running batchcal).
+    - pol, list of polarizations to correct.  0: HH, 1: VV, 2: HV.
+    - flatdemflag, set to True if the range slope should be assumed to be
+        zero (e.g., if there is no slope angle file).
+    - overwriteflag, a flag that determines if already created calibrated
+        files are overwritten, or skipped.
+    - scene, part of the filename of a specific scene you wish to process,
+        if you only want to process a single scene.
+    - blocksize, the number of GRD rows to process at once.
+    
+    """
+    pol_str = ['HHHH','VVVV','HVHV']
+    pol_shortstr = ['HH','VV','HV']
+    
+    # Same thresholds as the calibration program:
+    min_cs = 0.001
+    void_correction_val = -1.0
+    lowlook = np.degrees(0.35)
+    lowlookslope = np.degrees(0.1)
+    
+    files = os.listdir(datapath)
+    for file in files:
+        if file.endswith('.ann') and ((scene is None) or (scene in file)):
+            print(file)
+            rootname = os.path.join(datapath, file[0:-14])
+            
+            ann = annotation.load(os.path.join(datapath, file))
+            grd_rows = int(ann['grd_pwr.set_rows'])
+            grd_cols = int(ann['grd_pwr.set_cols'])
+            
+            look = np.memmap(rootname+'look.grd',shape=(grd_rows,grd_cols),dtype='<f4',mode='r')
+            if flatdemflag == False:
+                slope = np.memmap(rootname+'slope.grd',shape=(grd_rows,grd_cols),dtype='<f4',mode='r')
+            if os.path.isfile(rootname+'mask.grd'):
+                mask = np.memmap(rootname+'mask.grd',shape=(grd_rows,grd_cols),dtype='<f4',mode='r')
+            else:
+                mask = None
+            
+            for p in range(0,np.size(pol)):
+                infile = rootname+pol_str[pol[p]]+'_'+corrstr+'.grd'
+                outfile = rootname+pol_str[pol[p]]+'_'+calname+'.grd'
+                
+                if os.path.isfile(outfile) and (overwriteflag == False):
+                    print(outfile,' already exists -- skipping...')
+                    continue
+                
+                caltblfile = caltblroot+'_'+pol_shortstr[pol[p]]+'.flt'
+                print('Applying '+caltblfile+' to '+infile+' ...')
+                vegtable = np.fromfile(caltblfile, dtype='<f4').reshape((900,900))
+                vegnorm = vegtable[450,350]
+                
+                # Write to a temporary file first, so that an interrupted run
+                # never leaves a partially written outfile (which would be
+                # skipped by the next run, or written through a hard link to
+                # it):
+                tmpfile = outfile+'.'+str(os.getpid())+'.tmp'
+                data = np.memmap(infile,shape=(grd_rows,grd_cols),dtype='<f4',mode='r')
+                out = np.memmap(tmpfile,shape=(grd_rows,grd_cols),dtype='<f4',mode='w+')
+                
+                for row in range(0, grd_rows, blocksize):
+                    rows = slice(row, min(row+blocksize, grd_rows))
+                    lookblk = look[rows]
+                    if flatdemflag == False:
+                        slopeblk = slope[rows]
+                    else:
+                        slopeblk = np.zeros(lookblk.shape, dtype='<f4')
+                    
+                    # LUT bins, truncated the same way as the C integer casts:
+                    e_look = lookblk.astype(np.int32)*10
+                    e_slope = (slopeblk+90.0).astype(np.int32)*5
+                    inlut = (e_look >= 0) & (e_look <= 899) & (e_slope >= 0) & (e_slope <= 899)
+                    
+                    cs = np.ones(lookblk.shape, dtype='<f4')
+                    cs[inlut] = vegtable[e_slope[inlut], e_look[inlut]]
+                    
+                    # Only correct pixels that were corrected by the area
+                    # correction:
+                    dataout = np.array(data[rows])
+                    valid = np.isfinite(dataout) & (dataout > 0)
+                    if mask is not None:
+                        valid &= (mask[rows] == 0)
+                    
+                    void = valid & ((cs <= min_cs) | ((lookblk < lowlook) & (np.abs(slopeblk) > lowlookslope)))
+                    valid &= ~void
+                    
+                    dataout[valid] = dataout[valid] / cs[valid] * vegnorm
+                    dataout[void] = void_correction_val
+                    out[rows] = dataout
+                
+                out.flush()
+                del out
+                del data
+                os.replace(tmpfile, outfile)
+                genHDRfromTXT(os.path.join(datapath, file),outfile,pol_str[pol[p]])
+            
+            del look
+            del mask
+            if flatdemflag == False:
+                del slope
     
-            if (postprocessflag == True) and (docorrectionflag == True) and (skip == False):
-                for p in range(0,np.size(pol)):
-                    grdfile = rootname+pol_str[pol[p]]+'_'+calname+'.grd'
-                    data = np.memmap(grdfile,shape=(grd_rows,grd_cols),dtype='<f4',mode='r+')
-                    mask = np.memmap(rootname+'mask.grd',shape=(grd_rows,grd_cols),dtype='<f4',mode='r')
-                    look = np.memmap(rootname+'look.grd',shape=(grd_rows,grd_cols),dtype='<f4',mode='r')
-                                           
-                    data[mask > 0] = 0
-                    data[np.logical_not(np.isfinite(data))] = 0
-                    data[look < minlook] = 0
-                    data[look > maxlook] = 0
-                    del data
-                    del mask
-                    del look
-
     
     
 def sgolay2d (z, window_size, order, derivative=None):
@@ -318,91 +683,236 @@ def sgolay2d (z, window_size, order, derivative=None):
 
 
 
-def createlut(rootpath, sardata, maskdata, LUTpath, LUTname, allowed,
-              pol=[0,1,2], corrstr='area_only', min_cutoff=0,
-              max_cutoff=np.inf, flatdemflag=False, sgfilterflag=True, 
-              sgfilterwindow=51, min_look=22, max_look=65, min_samples=1):
-    """Create a LUT that is a function of look angle and range slope,
-    for use in radiometric calibration if vegetation.
+def _readblocks(dataset, blocksize):
+    """Generator returning the rows of a GDAL dataset in blocks of at most
+    blocksize rows."""
+    for row in range(0, dataset.RasterYSize, blocksize):
+        yield dataset.ReadAsArray(0, row, dataset.RasterXSize, min(blocksize, dataset.RasterYSize-row))
+    
+    
+    
+def _blockpercentiles(blocks, q):
+    """Percentiles of positive float32 data that is read in blocks.
+    
+    Gives the same result as np.percentile(data, qq) (with the default
+    linear interpolation) for each percentile qq of q, on all of the data,
+    without having all of the data in memory at once.  Like np.percentile
+    with a scalar percentile and float32 data, the two order statistics on
+    either side of the percentile are interpolated in float32 arithmetic,
+    with the weight computed in float64.  For positive floats, the order of the values is the
+    same as the order of their bit patterns, so the first pass histograms
+    the upper 16 bits of each value to find which group of values contains
+    each of the needed order statistics, and the second pass histograms the
+    lower 16 bits of the values in those groups to find the exact values.
     
     Input Arguments:
     
-    - rootpath, the pathname containing the UAVSAR data you wish to use to
-        generate the LUT.
-    - sardata, a list containing the specific UAVSAR scenes to use to
-        generate the LUT.  These should include only the flight, line,
-        data take, and date parts of the filename, not the full filename
-        (e.g., gulfco_14011_15058_109_150509).
-    - maskdata, a list the same size as sardata, containing the filenames of
-        the mask arrays (e.g., land cover information) to use for each UAVSAR
-        scene.  These files should have the same pixel spacing and extents
-        as the UAVSAR GRD files.  This can be done in QGIS, for example, using
-        the Raster Calculator.
-    - LUTpath, a path to a folder of where to save the created LUT.
-    - LUTname, the filename for the LUT.
-    - allowed, the values of the mask data for pixels to be used in the LUT
-        creation process.  (e.g., for CCAP land cover, 15 and 18 are the land
-        cover ID numbers for palustrine emergent wetland, and estuarine
-        emergent wetland, respectively).  If the masks are boolean, this can
-        be set to True or 1, for example.
-    - pol, list of polarizations to correct.  0: HH, 1: VV, 2: HV.  Default
-        value is [0,1,2], to process all three.  Even if only one polarization
-        is desired, still use a list to avoid an error, e.g., pol = [2] to
-        only process the HV, rather than just pol = 2.
-    - corrstr, the filename descriptor for the correction to load.  Generally,
-        this should probably be 'area_only', to load the area corrected images,
-        since the area corrected images are the ones we wish to use to create
-        the LUT.
-    - min_cutoff, minimum backscatter value, in the same units as the input 
-        UAVSAR GRD data (for area only, this is linear units), for a pixel
-        to be included in the LUT.  Note, these cutoff values should be based
-        on HV backscatter.  To be consistent between the polarizations, we
-        always mask out the same pixels for each polarization, and the pixels
-        excluded based on backscatter always use the HVHV.
-    - max_cutoff, maximum backscatter value, in the same units as the input
-        UAVSAR GRD data, for a pixel to be included in the LUT.
-    - flatdemflag, set to False to use the range slope.  Set to True if the
-        data was processed with a flat "DEM" and there is no range slope
-        information.
-    - sgfilterflag, flag to determine if the Savitzky-Golay filter should
-        be used to smooth the LUT.  Note that if flatdemflag is enabled,
-        there's some messing around so that at the edges of the data where
-        the Savitzky-Golay filter doesn't have a full window of data (and
-        begins to smooth the data with zeroes), we switch over to a small
-        moving averaging window instead.  If flatdemflag is disabled, this
-        is not done, and the edges of the LUT are kind of questionable.  This
-        aspect could probably use some more work.
-    - sgfilterwindow, the window size of the Savitzky-Golay filter.
-    - min_look, minimum look angle for a pixel to be included in the LUT.
-    - max_look, maximum look angle for a pixel to be included in the LUT.
-    - min_samples, the minimum number of samples for each LUT bin.  If there
-        are less than this number of samples in a given bin, that bin will be
-        set to void.
+    - blocks, a function returning an iterator over the data blocks.  It is
+        called once for each pass.
+    - q, list of percentiles to compute (0 to 100).
+    
+    Returns a list of the percentiles, as float32 values.
     
     """
+    hist = np.zeros(65536, dtype=np.int64)
+    for block in blocks():
+        bits = np.ascontiguousarray(block, dtype='float32').ravel().view(np.uint32)
+        hist += np.bincount(bits >> 16, minlength=65536)
+    
+    n = int(np.sum(hist))
+    if n == 0:
+        raise ValueError('radiocal._blockpercentiles | No data to compute percentiles from.')
+    cumhist = np.cumsum(hist)
+    
+    # Ranks of the order statistics needed for each percentile, and the
+    # interpolation weight between them, as computed by np.percentile:
+    ranks = []
+    for qq in q:
+        index = (n-1)*np.true_divide(qq,100)
+        lo = int(np.floor(index))
+        ranks.append((lo, min(lo+1, n-1), float(index-lo)))
+    
+    groups = {}
+    for lo, hi, gamma in ranks:
+        for r in (lo, hi):
+            groups[int(np.searchsorted(cumhist, r, side='right'))] = np.zeros(65536, dtype=np.int64)
+    
+    for block in blocks():
+        bits = np.ascontiguousarray(block, dtype='float32').ravel().view(np.uint32)
+        for g in groups:
+            groups[g] += np.bincount(bits[(bits >> 16) == g] & 0xFFFF, minlength=65536)
+    
+    def orderstat(r):
+        g = int(np.searchsorted(cumhist, r, side='right'))
+        if g > 0:
+            r -= cumhist[g-1]
+        low = int(np.searchsorted(np.cumsum(groups[g]), r, side='right'))
+        return np.array([(g << 16) | low], dtype=np.uint32).view(np.float32)[0]
+    
+    # Linear interpolation, in the same way as np.percentile (a and b are
+    # float32 and gamma a Python float, so this is done in float32):
+    result = []
+    for lo, hi, gamma in ranks:
+        a = orderstat(lo)
+        b = orderstat(hi)
+        diff = b - a
+        if gamma >= 0.5:
+            result.append(b - diff*(1-gamma))
+        else:
+            result.append(a + diff*gamma)
+    
+    return result
+    
+    
+    
+def _lutbins(look, slope, flatdemflag):
+    """LUT bin index (0 to 810000-1, or 0 to 900-1 if flatdemflag is True)
+    for each pixel, or -1 for pixels outside of the LUT.
+    
+    The bins are the same as those given by scipy.stats.binned_statistic
+    with the bin edges used by createlut().  The bin index only depends on
+    the look and slope angles, so it is computed once and used for all of
+    the polarizations.
     
-    # List of strings corresponding to the polarization you wish to create LUT for.  (e.g,. 'HVHV' for the HV channel)
+    """
+    bins_look=np.linspace(0,90, 901)
+    bins_slope=np.linspace(-45,45, 901)
+    if flatdemflag == False:
+        mask_look=np.digitize(look, bins_look)
+        mask_slope=np.digitize(slope, bins_slope) 
+        mask_lookslope=mask_look+(900*mask_slope) # should have 810,000 or 810,001unique entires!
+        
+        # The bins are the integers 0 to 810000, with the last bin also
+        # including the right edge (as in binned_statistic):
+        index = mask_lookslope.astype(np.int64)
+        index[index == 810000] = 810000-1
+        index[index > 810000] = -1
+    else:
+        # Floating point look angles, so use binned_statistic's handling of
+        # values on the bin edges directly (it cannot bin an empty array, as
+        # for a block without valid pixels):
+        if len(look) == 0:
+            return np.zeros(0, dtype=np.int64)
+        index = binned_statistic(look, look, 'count', bins=bins_look).binnumber - 1
+        index[index >= 900] = -1
+    
+    return index
+    
+    
+    
+def _binaccumulate(bin_val, bin_num, index, values):
+    """Adds a block of pixels to the running LUT bin sums and counts.
+    
+    Input Arguments:
+    
+    - bin_val, array of running sums, with shape (number of polarizations,
+        number of bins).  Updated in place.
+    - bin_num, array of running counts (the same for every polarization),
+        with shape (number of bins,).  Updated in place.
+    - index, the bin index of each pixel, from _lutbins().
+    - values, array of pixel values with shape (number of polarizations,
+        number of pixels).
+    
+    The sums for all of the polarizations are computed with a single
+    weighted bincount.  They are accumulated one value at a time, in order,
+    starting from the current running sum, so the result does not depend on
+    how the data is split into blocks.
+    
+    """
+    npol, nbins = bin_val.shape
+    valid = index >= 0
+    index = index[valid]
+    
+    stacked = np.concatenate([np.arange(npol*nbins)] + [index + p*nbins for p in range(npol)])
+    weights = np.concatenate([bin_val.ravel()] + [values[p][valid] for p in range(npol)])
+    bin_val[:] = np.bincount(stacked, weights=weights, minlength=npol*nbins).reshape((npol, nbins))
+    bin_num += np.bincount(index, minlength=nbins)
+    
+    
+    
+def _lutinputs(rootpath, rootname, maskfile, pol, corrstr, flatdemflag):
+    """Filenames of the images read by createlut() for one scene: the mask,
+    look angle, HV image (used for the backscatter cutoffs), slope angle (if
+    flatdemflag is False, otherwise None), and the image of each polarization
+    in pol.  Raises IOError if any of them is missing."""
     pol_str = ['HHHH','VVVV','HVHV']
-    shortpol_str = ['HH','VV','HV']   
     
-    # Empty LUT arrays:
-    # LUT_val = np.zeros((900,900,np.size(pol))) # will hold the cumulative sum of all pixels that fall in this bin
-    LUT_num = np.zeros((900,900,np.size(pol))) # will hold count of of all pixels that fall in this bin
-    LUT_val=np.zeros((900,900,np.size(pol)))
+    mask_pth = rootpath+maskfile
+    look_pth = rootpath+rootname+'_look.grd'
+    hvimage_pth = rootpath+rootname+'_'+'HVHV_'+corrstr+'.grd'
+    if flatdemflag == False:
+        slope_pth = rootpath+rootname+'_slope.grd'
+    else:
+        slope_pth = None
+    sarimage_pth = [rootpath+rootname+'_'+pol_str[pol[p]]+'_'+corrstr+'.grd' for p in range(0,np.size(pol))] # auto naming
     
+    for pth in [mask_pth, look_pth, hvimage_pth, slope_pth] + sarimage_pth:
+        if (pth is not None) and not os.path.isfile(pth):
+            raise IOError('File: {} not found.'.format(pth))
     
-    for num in range(0,np.size(sardata)):
-        rootname = sardata[num][0:-5]
-        driver = gdal.GetDriverByName('ENVI')
-        driver.Register()
+    return mask_pth, look_pth, hvimage_pth, slope_pth, sarimage_pth
+    
+    
+    
+def _autolook(look_ds, blocksize):
+    """Automatic min_look and max_look for createlut(): the 9th and 95th
+    percentiles of the valid look angles of a scene."""
+    return _blockpercentiles(lambda: (look[look>0] for look in _readblocks(look_ds, blocksize)), [9, 95])
+    
+    
+    
+def _scenesums(inputs, allowed, npol, min_cutoff, max_cutoff, flatdemflag,
+               min_look, max_look, blocksize):
+    """Sums and counts of the LUT bins for one scene.
+    
+    inputs are the filenames from _lutinputs().  If min_look and max_look
+    are both None, they are set to the 9th and 95th percentiles of the
+    scene's look angles.  Returns the sums (shape (npol, number of bins)),
+    the counts (shape (number of bins,)), and the min_look and max_look used.
+    
+    """
+    mask_pth, look_pth, hvimage_pth, slope_pth, sarimage_pth = inputs
+    
+    driver = gdal.GetDriverByName('ENVI')
+    driver.Register()
+    
+    # Open the mask, look, slope, etc.
+    mask_ds = gdal.Open(mask_pth,gdal.GA_ReadOnly)
+    look_ds = gdal.Open(look_pth,gdal.GA_ReadOnly)
+    
+    # Use HV image to mask out backscatter values outside the range:
+    hvimage_ds = gdal.Open(hvimage_pth)
+    
+    if flatdemflag == False:
+        slope_ds = gdal.Open(slope_pth, gdal.GA_ReadOnly) # if using created slope file
+    
+    sarimage_ds = []
+    for p in range(0,npol): # HHHH, HHHHV, etc. for each scene
+        print('Processing '+sarimage_pth[p]+' ...')
+        sarimage_ds.append(gdal.Open(sarimage_pth[p]))
+    
+    cols = look_ds.RasterXSize
+    rows = look_ds.RasterYSize
+    
+    # Running sums and counts for each LUT bin, accumulated over the blocks
+    # (flattened, in the same order as LUT_val).  The counts are the same for
+    # every polarization:
+    if flatdemflag == False:
+        nbins = 900*900
+    else:
+        nbins = 900
+    bin_val = np.zeros((npol,nbins))
+    bin_num = np.zeros(nbins, dtype='int64')
+    
+    # Auto min/max look
+    if min_look==None and max_look==None:
+        min_look, max_look = _autolook(look_ds, blocksize)
+    
+    for row in range(0, rows, blocksize):
+        nrows = min(blocksize, rows-row)
+        
+        mask = mask_ds.ReadAsArray(0, row, cols, nrows)
         
-        # Load the mask, look, slope, etc.
-        mask_pth = rootpath+maskdata[num]
-        if not os.path.isfile(mask_pth):
-            raise IOError('File: {} not found.'.format(mask_pth))
-        mask = gdal.Open(mask_pth,gdal.GA_ReadOnly)
-        mask = mask.ReadAsArray()
-
         # binarize landcover classification to only include classes of interest
         if 1==1: # quick fix to use all of mask without loading external file
             mask_bool = np.zeros(mask.shape,dtype='bool')
@@ -411,82 +921,218 @@ def createlut(rootpath, sardata, maskdata, LUTpath, LUTname, allowed,
             del mask
         else:
             mask_bool = np.ones (mask.shape,dtype='bool')
-            
-        look_pth = rootpath+rootname+'_look.grd'
-        # look_pth = '/att/nobackup/ekyzivat/tmp/rtc/padelE_36000_18047_000_180821_L090_CX_01/raw/run_auto_name/padelE_36000_18047_000_180821_look.grd' # for testing: intermediate/bespoke GRD file
-        if not os.path.isfile(look_pth):
-            raise IOError('File: {} not found.'.format(look_pth))
-        look = gdal.Open(look_pth,gdal.GA_ReadOnly)
-        look = look.ReadAsArray()
+        
+        look = look_ds.ReadAsArray(0, row, cols, nrows)
         # look = np.degrees(look.ReadAsArray()) # changed to degrees
-    
-        # Auto min/max look
-        if min_look==None and max_look==None:
-            min_look=np.percentile(look[look>0], 9)
-            max_look=np.percentile(look[look>0], 95)
         
         # Mask out look angles outside the range:
         mask_bool = mask_bool & (look > min_look) & (look < max_look)
-    
         
-        # Use HV image to mask out backscatter values outside the range:
-        sarimage_pth=rootpath+rootname+'_'+'HVHV_'+corrstr+'.grd'
-        if not os.path.isfile(sarimage_pth):
-            raise IOError('File: {} not found.'.format(sarimage_pth))
-        sarimage = gdal.Open(sarimage_pth)
-        sarimage = sarimage.ReadAsArray()
+        sarimage = hvimage_ds.ReadAsArray(0, row, cols, nrows)
         sarimage[~np.isfinite(sarimage)] = -99
         mask_bool = mask_bool & (sarimage > min_cutoff) & (sarimage < max_cutoff)  # positive mask
         
         # apply same mask to look file
         look = look[mask_bool]
-    
-    
+        
         if flatdemflag == False:
-            # slope = gdal.Open(rootpath+sardata[num]+'_'+corrstr+'.slope',gdal.GA_ReadOnly) # if using default slope file
-            slope_pth = rootpath+rootname+'_slope.grd'
-            if not os.path.isfile(slope_pth):
-                raise IOError('File: {} not found.'.format(slope_pth))
-            slope = gdal.Open(slope_pth, gdal.GA_ReadOnly) # if using created slope file
-            slope = slope.ReadAsArray()
+            slope = slope_ds.ReadAsArray(0, row, cols, nrows)
             # slope = np.degrees(slope.ReadAsArray()) # changed to degrees
             slope = slope[mask_bool] #NOTE : I didn't need to mask out the -10000 nodata value bc it is out of the range I'm binning
+        else:
+            slope = None
+        
+        # Populate the LUT:
+        index = _lutbins(look, slope, flatdemflag)
+        
+        sarimage = [] # loop through HHHH, HHHHV, etc. for each scene
+        for p in range(0,npol):
+            sarimage.append(sarimage_ds[p].ReadAsArray(0, row, cols, nrows)[mask_bool]) # reshapes sarimage to linear vector
+        
+        _binaccumulate(bin_val, bin_num, index, sarimage)
+    
+    del mask_ds, look_ds, hvimage_ds, sarimage_ds
+    if flatdemflag == False:
+        del slope_ds
+    
+    return bin_val, bin_num, min_look, max_look
+    
+    
+    
+def _lutparams(maskfile, allowed, pol, corrstr, min_cutoff, max_cutoff,
+               flatdemflag, min_look, max_look):
+    """Binning parameters of a scene's LUT partial sums, as a JSON string.
+    min_look and max_look are the values used (after the automatic values
+    are found), so that partial sums binned with different look angle
+    ranges are never reused or merged together."""
+    def tojson(val):
+        return None if val is None else float(val)
+    
+    return json.dumps({'maskfile': maskfile,
+                       'allowed': np.atleast_1d(allowed).tolist(),
+                       'pol': [int(p) for p in pol],
+                       'corrstr': corrstr,
+                       'min_cutoff': tojson(min_cutoff),
+                       'max_cutoff': tojson(max_cutoff),
+                       'flatdemflag': bool(flatdemflag),
+                       'min_look': tojson(min_look),
+                       'max_look': tojson(max_look)}, sort_keys=True)
+    
+    
+    
+def _savepartial(partialfile, bin_val, bin_num, params, min_look, max_look):
+    """Saves a scene's LUT partial sums and counts, with the binning
+    parameters from _lutparams() and the min_look and max_look used."""
+    # Write to a temporary file first, so that a partially written file is
+    # never used:
+    tmpfile = partialfile+'.'+str(os.getpid())+'.npz'
+    np.savez_compressed(tmpfile, bin_val=bin_val, bin_num=bin_num,
+                        params=np.array(params), min_look=np.array(min_look),
+                        max_look=np.array(max_look))
+    os.replace(tmpfile, partialfile)
+    
+    
+    
+def _loadpartial(partialfile):
+    """Loads a scene's LUT partial sums and counts saved by _savepartial().
+    Returns the sums, counts, binning parameters (dict), and the min_look
+    and max_look used."""
+    with np.load(partialfile) as data:
+        return (data['bin_val'], data['bin_num'], json.loads(str(data['params'])),
+                data['min_look'][()], data['max_look'][()])
+    
     
+    
+def _reusepartial(partialfile, params, inputs):
+    """Loads a scene's saved LUT partial sums, if they were created with the
+    same parameters (from _lutparams()), after the last change to the input
+    images.  Returns the sums, counts, min_look and max_look, or None if the
+    partial sums need to be computed again."""
+    if not os.path.isfile(partialfile):
+        return None
+    
+    newest = max(os.path.getmtime(pth) for pth in [inputs[0], inputs[1], inputs[2], inputs[3]] + inputs[4] if pth is not None)
+    if os.path.getmtime(partialfile) < newest:
+        return None
+    
+    bin_val, bin_num, saved_params, min_look, max_look = _loadpartial(partialfile)
+    if saved_params != json.loads(params):
+        return None
+    
+    print('Using saved partial sums: '+partialfile)
+    return bin_val, bin_num, min_look, max_look
+    
+    
+    
+def _lutslots(shm, nworkers, npol, nbins):
+    """Views of the per-worker LUT sums (shape (nworkers, npol, nbins)) and
+    counts (shape (nworkers, nbins)) in a shared memory block."""
+    slot_val = np.ndarray((nworkers, npol, nbins), dtype='float64', buffer=shm.buf)
+    slot_num = np.ndarray((nworkers, nbins), dtype='int64', buffer=shm.buf, offset=slot_val.nbytes)
+    return slot_val, slot_num
+    
+    
+    
+# Shared memory block, and this process's slot in it, for the workers of
+# _parallelsums().
+_lutshm = None
+_lutslot = None
+    
+def _lutworkerinit(shmname, nworkers, npol, nbins, counter):
+    """Process pool initializer for _parallelsums(): attaches the shared
+    memory block, and takes the next free slot in it."""
+    global _lutshm, _lutslot
+    with counter.get_lock():
+        slot = counter.value
+        counter.value += 1
+    
+    _lutshm = shared_memory.SharedMemory(name=shmname)
+    slot_val, slot_num = _lutslots(_lutshm, nworkers, npol, nbins)
+    _lutslot = (slot_val[slot], slot_num[slot])
+    
+    
+    
+def _lutworker(task, allowed, npol, min_cutoff, max_cutoff, flatdemflag,
+               blocksize, partialflag):
+    """Computes the LUT partial sums of one scene in a worker process, and
+    adds them to the worker's slot.  task is (inputs, min_look, max_look,
+    partialfile, params), as in _parallelsums()."""
+    inputs, min_look, max_look, partialfile, params = task
+    with profiling.stage('lutbinning', os.path.basename(inputs[1])[0:-len('_look.grd')]):
+        bin_val, bin_num, min_look, max_look = _scenesums(inputs, allowed, npol,
+                                                          min_cutoff, max_cutoff,
+                                                          flatdemflag, min_look,
+                                                          max_look, blocksize)
+    if partialflag:
+        _savepartial(partialfile, bin_val, bin_num, params, min_look, max_look)
+    
+    _lutslot[0][:] += bin_val
+    _lutslot[1][:] += bin_num
+    
+    
+    
+def _parallelsums(tasks, allowed, npol, min_cutoff, max_cutoff, flatdemflag,
+                  blocksize, partialflag, nworkers):
+    """Computes the LUT partial sums of several scenes on a process pool, and
+    returns the total sums and counts.
+    
+    Each worker process adds the sums of the scenes it processes to its own
+    slot of a shared memory block, so the 900x900 arrays of each scene are
+    never pickled.  The slots are added together at the end.
+    
+    """
+    if flatdemflag == False:
+        nbins = 900*900
+    else:
+        nbins = 900
+    nworkers = min(nworkers, len(tasks))
+    
+    shm = shared_memory.SharedMemory(create=True, size=nworkers*(npol+1)*nbins*8)
+    slot_val = slot_num = None
+    try:
+        slot_val, slot_num = _lutslots(shm, nworkers, npol, nbins)
+        slot_val[:] = 0
+        slot_num[:] = 0
         
-        for p in range(0,np.size(pol)): # loop through HHHH, HHHHV, etc. for each scene
-            # sarimage_pth=rootpath+sardata[num]+pol_str[pol[p]]+'_'+corrstr+'.grd' # manual
-            sarimage_pth=rootpath+rootname+'_'+pol_str[pol[p]]+'_'+corrstr+'.grd' # auto naming    
-            # sarimage_pth='/att/nobackup/ekyzivat/tmp/rtc/padelE_36000_18047_000_180821_L090_CX_01/raw/padelE_36000_18047_000_180821_L090HHHH_CX_01.grd' # (For testing)
-            if not os.path.isfile(sarimage_pth):
-                raise IOError('File: {} not found.'.format(sarimage_pth))       
-            print('Processing '+sarimage_pth+' ...')
-            sarimage = gdal.Open(sarimage_pth)
-            sarimage = sarimage.ReadAsArray()
-            sarimage = sarimage[mask_bool] # reshapes sarimage to linear vector
-            
-            
-            # Populate the LUT:
-            dim = np.size(sarimage)
-            
-            ## masked version
-            bins_look=np.linspace(0,90, 901)
-            bins_slope=np.linspace(-45,45, 901)
-            if flatdemflag == False:
-                mask_look=np.digitize(look, bins_look)
-                mask_slope=np.digitize(slope, bins_slope) 
-                mask_lookslope=mask_look+(900*mask_slope) # should have 810,000 or 810,001unique entires!
-                zonal_lookslope=binned_statistic(mask_lookslope, sarimage, 'sum', bins=np.linspace(0, 810000,810001))
-                zonal_lookslope_count=binned_statistic(mask_lookslope, sarimage, 'count', bins=np.linspace(0, 810000,810001))
-                LUT_val[:,:,p]=np.reshape(zonal_lookslope.statistic, (900,900))  # by default, reshape uses C order, with last element changing fastest
-                LUT_num[:,:,p]=np.reshape(zonal_lookslope_count.statistic, (900,900))   
-                ## remove zeros         
-            else:
-                # mask_slope=np.ones(mask_look.shape, mask_look.dtype)*450
-                # put into LUT and LUT_num_temp for all colums at once w/o looping
-                zonal_look=binned_statistic(look, sarimage, 'sum', bins=bins_look)
-                zonal_look_count=binned_statistic(look, sarimage, 'count', bins=bins_look)
-                LUT_num[:,:,p]=np.tile(zonal_look_count.statistic,(900,1)) # np.transpose
-                LUT_val[:,:,p]= np.tile(zonal_look.statistic,(900,1)) 
+        counter = multiprocessing.Value('i', 0)
+        with ProcessPoolExecutor(max_workers=nworkers, initializer=_lutworkerinit,
+                                 initargs=(shm.name, nworkers, npol, nbins, counter)) as pool:
+            futures = [pool.submit(_lutworker, task, allowed, npol, min_cutoff,
+                                   max_cutoff, flatdemflag, blocksize, partialflag) for task in tasks]
+            for future in futures:
+                future.result() # raises the worker's exception, if any
+        
+        bin_val = np.sum(slot_val, axis=0)
+        bin_num = np.sum(slot_num, axis=0)
+    finally:
+        slot_val = slot_num = None # release the views before closing
+        shm.close()
+        shm.unlink()
+    
+    return bin_val, bin_num
+    
+    
+    
+def _finalizelut(bin_val, bin_num, pol, LUTpath, LUTname, flatdemflag,
+                 sgfilterflag, sgfilterwindow, min_look, max_look, min_samples):
+    """Turns the LUT bin sums and counts into the final LUT for each
+    polarization (averaging, min_samples masking, smoothing, and look angle
+    extrapolation), and saves it to LUTpath.  See createlut() for the
+    arguments."""
+    shortpol_str = ['HH','VV','HV']   
+    
+    # Empty LUT arrays:
+    # LUT_val = np.zeros((900,900,np.size(pol))) # will hold the cumulative sum of all pixels that fall in this bin
+    LUT_num = np.zeros((900,900,np.size(pol))) # will hold count of of all pixels that fall in this bin
+    LUT_val=np.zeros((900,900,np.size(pol)))
+    
+    for p in range(0,np.size(pol)):
+        if flatdemflag == False:
+            LUT_val[:,:,p]=np.reshape(bin_val[p], (900,900))  # by default, reshape uses C order, with last element changing fastest
+            LUT_num[:,:,p]=np.reshape(bin_num, (900,900))   
+        else:
+            LUT_num[:,:,p]=np.tile(bin_num,(900,1)) # np.transpose
+            LUT_val[:,:,p]= np.tile(bin_val[p],(900,1)) 
 
     # Finalize the LUT:    
     print('Finalizing look up tables...')
@@ -513,37 +1159,38 @@ def createlut(rootpath, sardata, maskdata, LUTpath, LUTname, allowed,
         startloc = 10
         endloc = 890
         if sgfilterflag == True:
-            if flatdemflag == True:
-                # Don't want to smooth the zeroes:
-                foundstart = False
-                foundend = False
-                LUT[LUT == 0] = np.nan
-                for lookbin in range(10,890):
-                    if (LUT_num_temp[450,lookbin] > 1) and (foundstart == False):
-                        foundstart = True
-                        startloc = lookbin
-                    if (LUT_num_temp[450,lookbin] == 1) and (foundstart == True) and (foundend == False):
-                        foundend = True
-                        endloc = lookbin
-                    if (foundstart == True) and (foundend == False):
-                        LUTma[450,lookbin] = np.nanmean(LUT[450,lookbin-2:lookbin+3])
+            with profiling.stage('smoothing', LUTname, pol=shortpol_str[pol[p]]):
+                if flatdemflag == True:
+                    # Don't want to smooth the zeroes:
+                    foundstart = False
+                    foundend = False
+                    LUT[LUT == 0] = np.nan
+                    for lookbin in range(10,890):
+                        if (LUT_num_temp[450,lookbin] > 1) and (foundstart == False):
+                            foundstart = True
+                            startloc = lookbin
+                        if (LUT_num_temp[450,lookbin] == 1) and (foundstart == True) and (foundend == False):
+                            foundend = True
+                            endloc = lookbin
+                        if (foundstart == True) and (foundend == False):
+                            LUTma[450,lookbin] = np.nanmean(LUT[450,lookbin-2:lookbin+3])
                                   
-                # Smooth it:
-                LUT[np.logical_not(np.isfinite(LUT))] = 0
-                LUTsm = scipy.signal.savgol_filter(LUT,sgfilterwindow,3,axis=1)
+                    # Smooth it:
+                    LUT[np.logical_not(np.isfinite(LUT))] = 0
+                    LUTsm = scipy.signal.savgol_filter(LUT,sgfilterwindow,3,axis=1)
                 
-                # Set any bin without a full smoothing window to the moving
-                # average smoothed LUT, which ignores the zero values:
-                LUTsm[450,startloc:startloc+int(np.ceil(sgfilterwindow/2)+1)] = LUTma[450,startloc:int(startloc+np.ceil(sgfilterwindow/2)+1)]
-                LUTsm[450,endloc-int(np.ceil(sgfilterwindow/2)):endloc+1] = LUTma[450,endloc-int(np.ceil(sgfilterwindow/2)):endloc+1]
+                    # Set any bin without a full smoothing window to the moving
+                    # average smoothed LUT, which ignores the zero values:
+                    LUTsm[450,startloc:startloc+int(np.ceil(sgfilterwindow/2)+1)] = LUTma[450,startloc:int(startloc+np.ceil(sgfilterwindow/2)+1)]
+                    LUTsm[450,endloc-int(np.ceil(sgfilterwindow/2)):endloc+1] = LUTma[450,endloc-int(np.ceil(sgfilterwindow/2)):endloc+1]
                 
                 
-                LUTsm[LUT_num_temp < min_samples*LUT.shape[0]/5] = 0
-                LUT = LUTsm[450,:]
-                LUT = np.tile(LUT,(900,1))
-            else:
-                LUTsm = sgolay2d(LUT,sgfilterwindow,3,derivative=None) # TODO: check that my result is same as original (i.e. SG filter in 2D behaves diff than 1D).  also try setting 0 -> NaN bf filter.
-                LUTsm[LUT_num_temp < min_samples] = 0
+                    LUTsm[LUT_num_temp < min_samples*LUT.shape[0]/5] = 0
+                    LUT = LUTsm[450,:]
+                    LUT = np.tile(LUT,(900,1))
+                else:
+                    LUTsm = sgolay2d(LUT,sgfilterwindow,3,derivative=None) # TODO: check that my result is same as original (i.e. SG filter in 2D behaves diff than 1D).  also try setting 0 -> NaN bf filter.
+                    LUTsm[LUT_num_temp < min_samples] = 0
                 
                 
         # Copy edges of LUT along look angle axis to rest of data, in case
@@ -576,3 +1223,210 @@ def createlut(rootpath, sardata, maskdata, LUTpath, LUTname, allowed,
         plt.plot(np.linspace(0, 90, LUT.shape[1]), np.nanmean(LUT,axis=0),label='caltbl_'+LUTname+'_'+shortpol_str[pol[p]]) # This returns runtime error for empty rows
         plt.xlabel('Incidence angle'); plt.ylabel('Magnitude')
         plt.savefig(LUTpath+'calplot_'+LUTname+'_'+shortpol_str[pol[p]]+'.png') # run before: LUT[LUT==0]=np.nan
+
+
+
+def createlut(rootpath, sardata, maskdata, LUTpath, LUTname, allowed,
+              pol=[0,1,2], corrstr='area_only', min_cutoff=0,
+              max_cutoff=np.inf, flatdemflag=False, sgfilterflag=True, 
+              sgfilterwindow=51, min_look=22, max_look=65, min_samples=1,
+              blocksize=1024, partialflag=True, nworkers=1, profilefile=None):
+    """Create a LUT that is a function of look angle and range slope,
+    for use in radiometric calibration if vegetation.
+    
+    Input Arguments:
+    
+    - rootpath, the pathname containing the UAVSAR data you wish to use to
+        generate the LUT.
+    - sardata, a list containing the specific UAVSAR scenes to use to
+        generate the LUT.  These should include only the flight, line,
+        data take, and date parts of the filename, not the full filename
+        (e.g., gulfco_14011_15058_109_150509).  The LUT bins are averaged
+        over all of the scenes.  Note: in earlier versions, each scene
+        replaced the sums of the previous one, so only the last scene in
+        sardata contributed to the LUT.
+    - maskdata, a list the same size as sardata, containing the filenames of
+        the mask arrays (e.g., land cover information) to use for each UAVSAR
+        scene.  These files should have the same pixel spacing and extents
+        as the UAVSAR GRD files.  This can be done in QGIS, for example, using
+        the Raster Calculator.
+    - LUTpath, a path to a folder of where to save the created LUT.
+    - LUTname, the filename for the LUT.
+    - allowed, the values of the mask data for pixels to be used in the LUT
+        creation process.  (e.g., for CCAP land cover, 15 and 18 are the land
+        cover ID numbers for palustrine emergent wetland, and estuarine
+        emergent wetland, respectively).  If the masks are boolean, this can
+        be set to True or 1, for example.
+    - pol, list of polarizations to correct.  0: HH, 1: VV, 2: HV.  Default
+        value is [0,1,2], to process all three.  Even if only one polarization
+        is desired, still use a list to avoid an error, e.g., pol = [2] to
+        only process the HV, rather than just pol = 2.
+    - corrstr, the filename descriptor for the correction to load.  Generally,
+        this should probably be 'area_only', to load the area corrected images,
+        since the area corrected images are the ones we wish to use to create
+        the LUT.
+    - min_cutoff, minimum backscatter value, in the same units as the input 
+        UAVSAR GRD data (for area only, this is linear units), for a pixel
+        to be included in the LUT.  Note, these cutoff values should be based
+        on HV backscatter.  To be consistent between the polarizations, we
+        always mask out the same pixels for each polarization, and the pixels
+        excluded based on backscatter always use the HVHV.
+    - max_cutoff, maximum backscatter value, in the same units as the input
+        UAVSAR GRD data, for a pixel to be included in the LUT.
+    - flatdemflag, set to False to use the range slope.  Set to True if the
+        data was processed with a flat "DEM" and there is no range slope
+        information.
+    - sgfilterflag, flag to determine if the Savitzky-Golay filter should
+        be used to smooth the LUT.  Note that if flatdemflag is enabled,
+        there's some messing around so that at the edges of the data where
+        the Savitzky-Golay filter doesn't have a full window of data (and
+        begins to smooth the data with zeroes), we switch over to a small
+        moving averaging window instead.  If flatdemflag is disabled, this
+        is not done, and the edges of the LUT are kind of questionable.  This
+        aspect could probably use some more work.
+    - sgfilterwindow, the window size of the Savitzky-Golay filter.
+    - min_look, minimum look angle for a pixel to be included in the LUT.
+    - max_look, maximum look angle for a pixel to be included in the LUT.
+        If both min_look and max_look are None, they are set to the 9th and
+        95th percentiles of the look angles of the first scene in sardata,
+        and used for all of the scenes.
+    - min_samples, the minimum number of samples for each LUT bin.  If there
+        are less than this number of samples in a given bin, that bin will be
+        set to void.
+    - blocksize, the number of rows of the GRD images to read at once.  The
+        images are processed block by block, so the memory used does not
+        depend on the scene size.
+    - partialflag, flag to save the sums and counts of the LUT bins for each
+        scene in LUTpath (as lutpartial_<LUTname>_<scene>.npz), so that they
+        can be merged with other scenes using mergelut().  If a scene's
+        partial sums were already saved with the same parameters, they are
+        used instead of reading the scene's images again.
+    - nworkers, the number of worker processes to use.  If greater than one,
+        the scenes are processed in parallel, and their sums are added
+        together at the end.
+    - profilefile, the filename of a JSON-lines log to which the time,
+        storage I/O, and peak memory of the LUT binning of each scene and of
+        the LUT smoothing are appended (see profiling.py).  Profiling can
+        also be enabled with the RADIOCAL_PROFILE environment variable.
+    
+    """
+    if profilefile is not None:
+        profiling.enable(profilefile)
+    
+    # Auto min/max look is set by the first scene, and used for all of the
+    # scenes:
+    if min_look==None and max_look==None and np.size(sardata) > 0:
+        inputs = _lutinputs(rootpath, sardata[0][0:-5], maskdata[0], pol, corrstr, flatdemflag)
+        look_ds = gdal.Open(inputs[1], gdal.GA_ReadOnly)
+        min_look, max_look = _autolook(look_ds, blocksize)
+        del look_ds
+    
+    bin_val = None
+    tasks = [] # scenes to process in parallel, if nworkers > 1
+    for num in range(0,np.size(sardata)):
+        rootname = sardata[num][0:-5]
+        inputs = _lutinputs(rootpath, rootname, maskdata[num], pol, corrstr, flatdemflag)
+        
+        # Reuse the scene's saved partial sums if they were created with the
+        # same parameters, after the last change to the input images:
+        partialfile = LUTpath+'lutpartial_'+LUTname+'_'+rootname+'.npz'
+        params = _lutparams(maskdata[num], allowed, pol, corrstr, min_cutoff,
+                            max_cutoff, flatdemflag, min_look, max_look)
+        scene = None
+        if partialflag:
+            scene = _reusepartial(partialfile, params, inputs)
+        
+        if (scene is None) and (nworkers > 1):
+            # Computed in parallel after the loop:
+            tasks.append((inputs, min_look, max_look, partialfile, params))
+            continue
+        
+        if scene is None:
+            with profiling.stage('lutbinning', rootname):
+                scene = _scenesums(inputs, allowed, np.size(pol), min_cutoff,
+                                   max_cutoff, flatdemflag, min_look, max_look,
+                                   blocksize)
+            if partialflag:
+                _savepartial(partialfile, scene[0], scene[1], params, scene[2], scene[3])
+        
+        # Add the scene to the totals:
+        if bin_val is None:
+            bin_val, bin_num = scene[0], scene[1]
+        else:
+            bin_val = bin_val + scene[0]
+            bin_num = bin_num + scene[1]
+    
+    if len(tasks) > 0:
+        scenes_val, scenes_num = _parallelsums(tasks, allowed, np.size(pol),
+                                               min_cutoff, max_cutoff,
+                                               flatdemflag, blocksize,
+                                               partialflag, nworkers)
+        if bin_val is None:
+            bin_val, bin_num = scenes_val, scenes_num
+        else:
+            bin_val = bin_val + scenes_val
+            bin_num = bin_num + scenes_num
+    
+    _finalizelut(bin_val, bin_num, pol, LUTpath, LUTname, flatdemflag,
+                 sgfilterflag, sgfilterwindow, min_look, max_look, min_samples)
+    
+    
+    
+def mergelut(partialfiles, LUTpath, LUTname, sgfilterflag=True,
+             sgfilterwindow=51, min_look=None, max_look=None, min_samples=1,
+             profilefile=None):
+    """Create a LUT from the partial sums saved by createlut(), without
+    reading the UAVSAR images again.
+    
+    createlut() saves the sums and counts of the LUT bins for each scene in
+    LUTpath, as lutpartial_<LUTname>_<scene>.npz.  The partial sums from any
+    set of scenes can be added together here to create a LUT for all of
+    them.  For example, to add a new scene to a regional LUT, run createlut()
+    on the new scene only, then merge its partial sums with the ones saved
+    for the previous scenes.
+    
+    Input Arguments:
+    
+    - partialfiles, a list of the partial sum files to merge.  They must all
+        have been created with the same polarizations, flatdemflag, and look
+        angle range (min_look and max_look, or their automatic values).
+    - LUTpath, a path to a folder of where to save the created LUT.
+    - LUTname, the filename for the LUT.
+    - sgfilterflag, sgfilterwindow, min_samples, the same as for createlut().
+    - min_look, max_look, the look angle range of the LUT, used to extrapolate
+        the edges of the LUT.  By default, the values used for the partial
+        sum files.
+    - profilefile, the same as for createlut().
+    
+    """
+    if profilefile is not None:
+        profiling.enable(profilefile)
+    bin_val = None
+    for partialfile in partialfiles:
+        if not os.path.isfile(partialfile):
+            raise IOError('File: {} not found.'.format(partialfile))
+        print('Merging '+partialfile+' ...')
+        scene_val, scene_num, params, scene_min_look, scene_max_look = _loadpartial(partialfile)
+        
+        if bin_val is None:
+            bin_val, bin_num = scene_val, scene_num
+            pol = params['pol']
+            flatdemflag = params['flatdemflag']
+            look_range = (scene_min_look, scene_max_look)
+            if min_look is None:
+                min_look = scene_min_look
+            if max_look is None:
+                max_look = scene_max_look
+        elif (params['pol'] != pol) or (params['flatdemflag'] != flatdemflag):
+            raise ValueError('radiocal.mergelut | Partial sums in {} have different polarizations or flatdemflag than {}.'.format(partialfile, partialfiles[0]))
+        elif (scene_min_look, scene_max_look) != look_range:
+            raise ValueError('radiocal.mergelut | Partial sums in {} were binned with a different look angle range than {}.'.format(partialfile, partialfiles[0]))
+        else:
+            bin_val = bin_val + scene_val
+            bin_num = bin_num + scene_num
+    
+    if bin_val is None:
+        raise ValueError('radiocal.mergelut | No partial sum files given.')
+    
+    _finalizelut(bin_val, bin_num, pol, LUTpath, LUTname, flatdemflag,
+                 sgfilterflag, sgfilterwindow, min_look, max_look, min_samples)
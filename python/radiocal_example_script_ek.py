@@ -15,9 +15,9 @@ import numpy as np
 import os
 import subprocess
 import multiprocessing as mp
-from multiprocessing import Pool
 import complex_RTC # local fxn
 import radiocal
+import workflow
 
 
 # print
@@ -128,11 +128,30 @@ sgfilterwindow = 51 # filter window size--larger windows yield more smoothing
 # parallel pool size
 pool_size=4 #mp.cpu_count() # change for custom
 
-# # STEP 1: Area Correction (in order to make the data to generate the LUT)
-print('DOING AREA CORRECTION...')
-pool = Pool(pool_size)
-for num in range(0,len(sardata)): # do first and third steps all at once as loop; do second  steps as loops within each step
-    pool.apply_async(radiocal.batchcal, args=(datapath[num], programpath, calibprog, geocodeprog, 
+# maximum number of tasks of each stage running at once (stages not listed are
+# only limited by pool_size)
+stage_limits = {'area': pool_size, 'mask': 2, 'lut': pool_size, 'lutcorr': pool_size, 'complex': pool_size}
+
+
+# Landcover mask creation for one scene (STEP 2)
+def buildLandcoverMask(num):
+    target_align_file = datapath[num]+sardata[num][0:-4]+'slope'+'.grd' # just need ground-projected file to align to 
+    landcover_file=datapath[num]+sardata[num][0:-4]+'landcovermask.tif' # output of custom reprojection script
+    if not os.path.isfile(landcover_file): # maybe add "or overwriteflag"
+        print('BUILDING: {}'.format(landcover_file))
+        print(subprocess.getoutput('gdal_reproject_match.sh /att/nobackup/ekyzivat/landcover/ABoVE_LandCover.vrt ' \
+            +landcover_file + ' '+ target_align_file))# HERE
+    else: 
+        print('LANDCOVER MASK ALREADY BUILT: {}'.format(landcover_file))
+
+
+# Each scene goes through the steps below in order, but independently of the
+# other scenes: e.g., a scene's LUT creation starts as soon as its own area
+# correction and landcover mask are done.
+wf = workflow.Workflow()
+for num in range(0,len(sardata)):
+    # # STEP 1: Area Correction (in order to make the data to generate the LUT)
+    area = wf.add(sardata[num]+'_area', 'area', radiocal.batchcal, args=(datapath[num], programpath, calibprog, geocodeprog, 
                                               None,         # caltblroot
                                               'area_only',  # calname
                                               True,         # docorrectionflag
@@ -148,38 +167,18 @@ for num in range(0,len(sardata)): # do first and third steps all at once as loop
                                               hgtval,       # hgtval
                                               sardata[num])) # scene  
 #                                               #     radiocal.batchcal(datapath[num], programpath, calibprog, geocodeprog, None, calname='area_only', docorrectionflag=True, zerodemflag=True, createmaskflag=False, createlookflag=True, createslopeflag=True,  overwriteflag=False, postprocessflag=False, pol=pol, hgtval=hgtval, scene=sardata[num])
-pool.close()
-pool.join()
 
-# # STEP 2: Create landcover mask images
-print('BUILDING LANDCOVER MASKS FROM MOSAIC') # using my custom script (on path) to crop and reproject from landcover mosaic
-for num in range(0,len(sardatabase)): 
-    target_align_file = datapath[num]+sardata[num][0:-4]+'slope'+'.grd' # just need ground-projected file to align to 
-    landcover_file=datapath[num]+sardata[num][0:-4]+'landcovermask.tif' # output of custom reprojection script
-    if not os.path.isfile(landcover_file): # maybe add "or overwriteflag"
-        print('BUILDING: {}'.format(landcover_file))
-        print(subprocess.getoutput('gdal_reproject_match.sh /att/nobackup/ekyzivat/landcover/ABoVE_LandCover.vrt ' \
-            +landcover_file + ' '+ target_align_file))# HERE
-    else: 
-        print('LANDCOVER MASK ALREADY BUILT: {}'.format(landcover_file))
+    # # STEP 2: Create landcover mask images
+    mask = wf.add(sardata[num]+'_mask', 'mask', buildLandcoverMask, args=(num,), deps=[area]) # using my custom script (on path) to crop and reproject from landcover mosaic
 
-# # STEP 3: LUT Creation
-print('CREATING LUT...')
-pool = Pool(pool_size)
-for num in range(0,len(sardata)): 
-    pool.apply_async(radiocal.createlut, args=(datapath[num], [sardata[num]], [maskdata[num]], LUTpath, LUTname[num], allowed, # no loop bc creatlut already does loop over 3 polarizations
+    # # STEP 3: LUT Creation
+    lut = wf.add(sardata[num]+'_lut', 'lut', radiocal.createlut, args=(datapath[num], [sardata[num]], [maskdata[num]], LUTpath, LUTname[num], allowed, # no loop bc creatlut already does loop over 3 polarizations
                 pol, 'area_only', min_cutoff,
                 max_cutoff, flatdemflag, sgfilterflag, 
-                sgfilterwindow, None, None, 10)) # datapath[num], [sardata[num]], [maskdata[num]], LUTpath, LUTname[num], allowed, # no loop bc creatlut already does loop over 3 polarizationspol=pol, corrstr='area_only', min_cutoff=min_cutoff,max_cutoff=max_cutoff, flatdemflag=flatdemflag, sgfilterflag=sgfilterflag, sgfilterwindow=sgfilterwindow, min_look=minlook, max_look=maxlook, min_samples=10))
-pool.close()
-pool.join()
+                sgfilterwindow, None, None, 10), deps=[mask]) # datapath[num], [sardata[num]], [maskdata[num]], LUTpath, LUTname[num], allowed, # no loop bc creatlut already does loop over 3 polarizationspol=pol, corrstr='area_only', min_cutoff=min_cutoff,max_cutoff=max_cutoff, flatdemflag=flatdemflag, sgfilterflag=sgfilterflag, sgfilterwindow=sgfilterwindow, min_look=minlook, max_look=maxlook, min_samples=10))
 
-
-# # STEP 4:  LUT Correction
-print('DOING LUT CORRECTION...')
-pool = Pool(pool_size)
-for num in range(0,len(sardata)): # do first steps all at once as loop; do second and third steps as loops within each step
-    pool.apply_async(radiocal.batchcal, args=(datapath[num], programpath, calibprog, geocodeprog, 
+    # # STEP 4:  LUT Correction
+    lutcorr = wf.add(sardata[num]+'_lutcorr', 'lutcorr', radiocal.batchcal, args=(datapath[num], programpath, calibprog, geocodeprog, 
                                               LUTpath+'caltbl_'+LUTname[num], # caltblroot      
                                               calname,  # calname
                                               True,         # docorrectionflag
@@ -193,24 +192,20 @@ for num in range(0,len(sardata)): # do first steps all at once as loop; do secon
                                               maxlook,      # maxlook
                                               pol,          # pol
                                               hgtval,       # hgtval
-                                              sardata[num])) # scene  
+                                              sardata[num]), deps=[lut]) # scene  
 #  # radiocal.batchcal, args=(datapath[num], programpath, calibprog, geocodeprog, LUTpath+'caltbl_'+LUTname[num],calname=calname, docorrectionflag=True, zerodemflag=True, createmaskflag=True, createlookflag=True, createslopeflag=True, overwriteflag=False, postprocessflag=False, minlook=minlook, maxlook=maxlook, pol=pol, hgtval=hgtval))
-pool.close()
-pool.join()
 
-# STEP 5:  Complex LUT Correction
-print('DOING Complex LUT CORRECTION...')
-pool = Pool(pool_size) #Pool(pool_size)
-for num in range(0,len(sardata)): # [4]: # # do first steps all at once as loop; do second and third steps as loops within each step
+    # STEP 5:  Complex LUT Correction
     corrstr=sardatabase[num][-5:] # 'CX_01' or 'CX_02'
-    pool.apply_async(complex_RTC.complexRTC, args=(
+    wf.add(sardata[num]+'_complex', 'complex', complex_RTC.complexRTC, args=(
         sardata[num], #'bakerc_16008_19059_012_190904_L090',                                                   # base
         sardata[num][:-5], #'bakerc_16008_19059_012_190904',                                                        # lutBase=
         corrstr, #'CX_01',                                                                                # corrstr
         calname, # 'LUT',                                                                                  # calname=
         datapath[num], #'/mnt/f/UAVSAR/bakerc_16008_19059_012_190904_L090_CX_01/raw/LUT',                       # lutDir=
         datapath[num][:-4]+'default_grd', #'/mnt/f/UAVSAR/bakerc_16008_19059_012_190904_L090_CX_01/raw/orig_grd',                  # origDir=
-        datapath[num][:-4]+'complex_lut')) #'/mnt/f/UAVSAR/bakerc_16008_19059_012_190904_L090_CX_01/raw/auto_test'))                # outDir=
+        datapath[num][:-4]+'complex_lut'), deps=[lutcorr]) #'/mnt/f/UAVSAR/bakerc_16008_19059_012_190904_L090_CX_01/raw/auto_test'))                # outDir=
 
-pool.close()
-pool.join()
+if __name__ == '__main__':
+    print('RUNNING AREA CORRECTION, LANDCOVER MASKS, LUT CREATION, LUT CORRECTION, AND COMPLEX LUT CORRECTION...')
+    wf.run(workers=pool_size, limits=stage_limits)
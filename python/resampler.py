@@ -0,0 +1,217 @@
+"""Sparse RDC to GRD resampling operator for geocoding UAVSAR images.
+
+uavsar_geocode reads the transformation LUT written by "uavsar_calib -u"
+and computes the bilinear interpolation weights again for every image it
+geocodes.  The weights only depend on the transformation LUT, so here they
+are computed once per scene and stored as a sparse matrix, with one row for
+each GRD pixel and one column for each RDC pixel.  Geocoding an image is
+then a sparse matrix-vector product, which can be repeated for any number
+of bands (including complex valued ones) without reading the LUT again.
+
+The weights and the order in which they are summed are the same as in
+uavsar_geocode, so for float32 images the result is bit-identical to the
+output of uavsar_geocode.
+
+The operator is saved in scipy's .npz sparse format, along with an
+identifier of the transformation LUT it was built from, so that it is only
+rebuilt when the LUT changes.
+"""
+
+import os
+import threading
+
+import numpy as np
+import scipy.sparse
+
+
+def _transid(transfile):
+    """Identifier of a transformation LUT file, used to check whether a
+    saved operator is still valid."""
+    st = os.stat(transfile)
+    return np.array([st.st_size, st.st_mtime_ns, st.st_ino], dtype=np.int64)
+
+
+def build(transfile, rdc_rows, rdc_cols, grd_rows, grd_cols, blocksize=1024):
+    """Builds the bilinear resampling operator from a transformation LUT.
+
+        Arguments:
+            transfile (str): Path and filename of the transformation LUT
+                (complex64 range, azimuth pixel coordinates for each GRD
+                pixel).
+            rdc_rows (int): Number of rows of the RDC images.
+            rdc_cols (int): Number of columns of the RDC images.
+            grd_rows (int): Number of rows of the GRD images.
+            grd_cols (int): Number of columns of the GRD images.
+            blocksize (int): Number of GRD rows to process at once.
+
+        Returns:
+            op (scipy.sparse.csr_matrix): Resampling operator, of shape
+                (grd_rows*grd_cols, rdc_rows*rdc_cols).
+
+    """
+    trans = np.memmap(transfile, dtype='<c8', mode='r', shape=(grd_rows, grd_cols))
+    xbound = np.float32(rdc_cols - 1)
+    ybound = np.float32(rdc_rows - 1)
+    tol = np.float64(1.0e-5) # compared in double precision, as in C
+
+    counts = []
+    indices = []
+    weights = []
+
+    for row in range(0, grd_rows, blocksize):
+        block = trans[row:min(row+blocksize, grd_rows)].ravel()
+        ranpix = block.real.astype(np.float32)
+        azpix = block.imag.astype(np.float32)
+
+        valid = (ranpix > 0) & (ranpix < xbound) & (azpix > 0) & (azpix < ybound)
+        ranpix[~valid] = 1
+        azpix[~valid] = 1
+
+        x1 = np.floor(ranpix)
+        x2 = np.ceil(ranpix)
+        y1 = np.floor(azpix)
+        y2 = np.ceil(azpix)
+        xexact = np.abs(ranpix - x1).astype(np.float64) < tol
+        yexact = np.abs(azpix - y1).astype(np.float64) < tol
+
+        i11 = y1.astype(np.int64)*rdc_cols + x1.astype(np.int64)
+        i12 = y1.astype(np.int64)*rdc_cols + x2.astype(np.int64)
+        i21 = y2.astype(np.int64)*rdc_cols + x1.astype(np.int64)
+        i22 = y2.astype(np.int64)*rdc_cols + x2.astype(np.int64)
+
+        # Up to four weights per GRD pixel, in the order they are summed by
+        # uavsar_geocode:
+        ind = np.stack((i11, i12, i21, i22), axis=1)
+        wgt = np.stack(((x2-ranpix)*(y2-azpix), (ranpix-x1)*(y2-azpix),
+                        (x2-ranpix)*(azpix-y1), (ranpix-x1)*(azpix-y1)), axis=1)
+        use = np.ones(ind.shape, dtype=bool)
+
+        both = xexact & yexact
+        ind[both, 0] = i11[both]
+        wgt[both, 0] = 1
+        use[both, 1:] = False
+
+        onlyx = xexact & ~yexact
+        ind[onlyx, 1] = i21[onlyx]
+        wgt[onlyx, 0] = (y2-azpix)[onlyx]
+        wgt[onlyx, 1] = (azpix-y1)[onlyx]
+        use[onlyx, 2:] = False
+
+        onlyy = yexact & ~xexact
+        wgt[onlyy, 0] = (x2-ranpix)[onlyy]
+        wgt[onlyy, 1] = (ranpix-x1)[onlyy]
+        use[onlyy, 2:] = False
+
+        use[~valid, :] = False
+
+        counts.append(np.sum(use, axis=1))
+        indices.append(ind[use])
+        weights.append(wgt[use])
+
+    del trans
+
+    indptr = np.zeros(grd_rows*grd_cols+1, dtype=np.int64)
+    np.cumsum(np.concatenate(counts), out=indptr[1:])
+    indices = np.concatenate(indices)
+    weights = np.concatenate(weights).astype(np.float32)
+
+    if max(indptr[-1], rdc_rows*rdc_cols) < np.iinfo(np.int32).max:
+        indptr = indptr.astype(np.int32)
+        indices = indices.astype(np.int32)
+
+    return scipy.sparse.csr_matrix((weights, indices, indptr),
+                                   shape=(grd_rows*grd_cols, rdc_rows*rdc_cols))
+
+
+def load(opfile, transfile, rdc_rows, rdc_cols, grd_rows, grd_cols):
+    """Loads the resampling operator for a scene, building and saving it
+    first if it does not exist or was built from a different LUT.
+
+        Arguments:
+            opfile (str): Path and filename of the saved operator (.npz).
+            transfile (str): Path and filename of the transformation LUT.
+            rdc_rows, rdc_cols, grd_rows, grd_cols (int): Image dimensions,
+                as in build().
+
+        Returns:
+            op (scipy.sparse.csr_matrix): Resampling operator.
+
+    """
+    idfile = opfile[0:-4]+'_trans.npy' if opfile.endswith('.npz') else opfile+'_trans.npy'
+    transid = _transid(transfile)
+    shape = (grd_rows*grd_cols, rdc_rows*rdc_cols)
+
+    if os.path.isfile(opfile) and os.path.isfile(idfile):
+        if np.array_equal(np.load(idfile), transid):
+            op = scipy.sparse.load_npz(opfile).tocsr()
+            if op.shape == shape:
+                print('resampler -- Using saved resampling operator: '+opfile)
+                return op
+
+    print('resampler -- Building resampling operator: '+opfile)
+    op = build(transfile, rdc_rows, rdc_cols, grd_rows, grd_cols)
+
+    # Write to temporary files first, so that other processes never load a
+    # partially written operator:
+    tmpfile = opfile+'.'+str(os.getpid())+'_'+str(threading.get_ident())
+    scipy.sparse.save_npz(tmpfile+'.npz', op, compressed=False)
+    np.save(tmpfile+'.npy', transid)
+    os.replace(tmpfile+'.npz', opfile)
+    os.replace(tmpfile+'.npy', idfile)
+    return op
+
+
+def geocode(op, infile, outfile, rdc_cols, grd_cols, dtype='<f4', blocksize=1024):
+    """Geocodes an RDC image using a resampling operator.
+
+        Arguments:
+            op (scipy.sparse.csr_matrix): Resampling operator from build() or
+                load().
+            infile (str): Path and filename of the RDC image (flat binary).
+            outfile (str): Path and filename of the GRD image to create.
+            rdc_cols (int): Number of columns of the RDC image.
+            grd_cols (int): Number of columns of the GRD image.
+            dtype (str): Data type of the input and output images.  Complex
+                images (e.g., '<c8') are resampled in the same way.
+            blocksize (int): Number of GRD rows to process at once.
+
+    """
+    geocodebands(op, [infile], [outfile], rdc_cols, grd_cols, [dtype], blocksize)
+
+
+def geocodebands(op, infiles, outfiles, rdc_cols, grd_cols, dtypes=None, blocksize=1024):
+    """Geocodes several RDC images of the same scene (e.g., the terms of a
+    covariance matrix) in one pass, slicing each block of the operator once
+    for all of the images.
+
+        Arguments:
+            op (scipy.sparse.csr_matrix): Resampling operator from build() or
+                load().
+            infiles (list): Paths and filenames of the RDC images.
+            outfiles (list): Paths and filenames of the GRD images to create,
+                in the same order as infiles.
+            rdc_cols (int): Number of columns of the RDC images.
+            grd_cols (int): Number of columns of the GRD images.
+            dtypes (list): Data type of each image, as in geocode().
+                Default: '<f4' for all of the images.
+            blocksize (int): Number of GRD rows to process at once.
+
+    """
+    rdc_rows = op.shape[1] // rdc_cols
+    grd_rows = op.shape[0] // grd_cols
+    if dtypes is None:
+        dtypes = ['<f4']*len(infiles)
+
+    data = [np.memmap(infile, dtype=dtype, mode='r', shape=(rdc_rows*rdc_cols,))
+            for infile, dtype in zip(infiles, dtypes)]
+    out = [np.memmap(outfile, dtype=dtype, mode='w+', shape=(grd_rows, grd_cols))
+           for outfile, dtype in zip(outfiles, dtypes)]
+
+    for row in range(0, grd_rows, blocksize):
+        rows = slice(row, min(row+blocksize, grd_rows))
+        opblock = op[rows.start*grd_cols:rows.stop*grd_cols]
+        for band, outband in zip(data, out):
+            outband[rows] = (opblock @ band).reshape((-1, grd_cols))
+
+    del out
+    del data
@@ -0,0 +1,90 @@
+"""Shared fixtures for the tests: a small synthetic scene (see
+benchmark/synthetic.py), and the C++ programs and library built from the
+repository sources.
+
+Run the tests from the python/ folder with "python -m pytest tests".  The
+tests of the programs are skipped if g++ is not available, and the tests of
+radiocal.py if GDAL (osgeo) or matplotlib are not installed.
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+PYDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROOTDIR = os.path.dirname(PYDIR)
+sys.path.insert(0, PYDIR)
+
+from benchmark import synthetic
+
+
+# Same build commands as the Makefile:
+BUILDS = {'uavsar_calib': ['-std=c++11', '-pthread', 'uavsar_calib.cpp'],
+          'uavsar_geocode': ['uavsar_geocode.cpp'],
+          'libuavsar.so': ['-std=c++11', '-pthread', '-shared', '-fPIC', 'uavsar_lib.cpp']}
+
+
+def run(args):
+    """Runs a program, failing the test if it does not succeed."""
+    result = subprocess.run([str(arg) for arg in args], stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT, universal_newlines=True)
+    assert result.returncode == 0, result.stdout
+    return result.stdout
+
+
+def readbytes(filename):
+    with open(filename, 'rb') as f:
+        return f.read()
+
+
+def geocode(programs, scene, infile, outfile, max_lines=None):
+    """Geocodes an MLC image of the scene with uavsar_geocode."""
+    args = [programs['uavsar_geocode'], infile, scene['mlc_cols'], scene['trans'], outfile,
+            scene['grd_cols'], scene['grd_rows']]
+    run(args + ([max_lines] if max_lines is not None else []))
+
+
+@pytest.fixture(scope='session')
+def programs(tmp_path_factory):
+    """Paths of uavsar_calib, uavsar_geocode and libuavsar.so, built in a
+    temporary folder."""
+    if shutil.which('g++') is None:
+        pytest.skip('g++ not found')
+    bindir = tmp_path_factory.mktemp('bin')
+    paths = {}
+    for name, args in BUILDS.items():
+        paths[name] = str(bindir / name)
+        subprocess.check_call(['g++'] + args + ['-o', paths[name]], cwd=ROOTDIR)
+    return paths
+
+
+@pytest.fixture(scope='session')
+def synthscene(tmp_path_factory):
+    """A small synthetic scene (see synthetic.makescene())."""
+    path = str(tmp_path_factory.mktemp('scene'))
+    return synthetic.makescene(path, rows=80, cols=60, origgrdflag=False)
+
+
+@pytest.fixture(scope='session')
+def scene(synthscene, programs, tmp_path_factory):
+    """The synthetic scene, with its facet model geometry ('geom') and
+    transformation LUT ('trans') computed by uavsar_calib."""
+    path = tmp_path_factory.mktemp('geometry')
+    scene = dict(synthscene, geom=str(path / 'geometry.geom'), trans=str(path / 'geomap.trans'))
+    run([programs['uavsar_calib'], '-g', scene['geom'], '-u', scene['trans'],
+         scene['ann'], 'HHHH', path / 'HHHH_area.mlc'])
+    return scene
+
+
+@pytest.fixture(scope='session')
+def caltbl(tmp_path_factory):
+    """Root of random vegetation correction LUT files (<root>_HH.flt, etc.)."""
+    root = str(tmp_path_factory.mktemp('lut') / 'caltbl')
+    rng = np.random.default_rng(0)
+    for p in ['HH', 'HV', 'VV']:
+        (0.5 + rng.random((900, 900))).astype('<f4').tofile(root+'_'+p+'.flt')
+    return root
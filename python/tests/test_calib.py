@@ -0,0 +1,23 @@
+"""uavsar_calib gives the same images when it reuses the geometry saved by
+an earlier run (-G) as when it computes the facet model from the DEM."""
+
+import pytest
+
+from conftest import run, readbytes
+
+
+@pytest.mark.parametrize('pol,lut', [('HVHV', False), ('VVVV', True), ('COV', True)])
+def test_geometry_reuse(programs, scene, caltbl, tmp_path, pol, lut):
+    terms = ['HHHH', 'HVHV', 'VVVV', 'HHHV', 'HHVV', 'HVVV'] if pol == 'COV' else [pol]
+    lutargs = ['-c', caltbl if pol == 'COV' else caltbl+'_'+pol[0:2]+'.flt'] if lut else []
+    run([programs['uavsar_calib'], '-g', tmp_path / 'geometry.geom', '-u', tmp_path / 'geomap.trans',
+         '-m', tmp_path / 'mask_dem'] + lutargs + [scene['ann'], pol, tmp_path / ('dem_'+pol+'.mlc')])
+    run([programs['uavsar_calib'], '-G', scene['geom'], '-m', tmp_path / 'mask_geom'] + lutargs +
+        [scene['ann'], pol, tmp_path / ('geom_'+pol+'.mlc')])
+
+    # The geometry does not depend on the polarization it was computed with:
+    assert readbytes(tmp_path / 'geometry.geom') == readbytes(scene['geom'])
+    assert readbytes(tmp_path / 'geomap.trans') == readbytes(scene['trans'])
+    assert readbytes(tmp_path / 'mask_geom') == readbytes(tmp_path / 'mask_dem')
+    for term in terms:
+        assert readbytes(tmp_path / ('geom_'+term+'.mlc')) == readbytes(tmp_path / ('dem_'+term+'.mlc'))
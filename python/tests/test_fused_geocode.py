@@ -0,0 +1,35 @@
+"""uavsar_calib -q gives the same GRD images as geocoding its output."""
+
+import os
+import subprocess
+
+import resampler
+from conftest import geocode, run, readbytes
+
+
+def test_fused_geocode(programs, scene, tmp_path):
+    """The diagonal terms are checked against uavsar_geocode, and the complex
+    terms against the resampler (checked against uavsar_geocode in
+    test_resampler.py)."""
+    out = tmp_path / 'outCOV.mlc'
+    run([programs['uavsar_calib'], '-G', scene['geom'], '-t', scene['trans'], '-q', tmp_path / 'fusedCOV.grd',
+         '-n', 2, scene['ann'], 'COV', out])
+    op = resampler.build(scene['trans'], scene['mlc_rows'], scene['mlc_cols'],
+                         scene['grd_rows'], scene['grd_cols'])
+    for term in ['HHHH', 'HVHV', 'VVVV', 'HHHV', 'HHVV', 'HVVV']:
+        mlcfile = str(out).replace('COV', term)
+        if term in ['HHHH', 'HVHV', 'VVVV']:
+            geocode(programs, scene, mlcfile, tmp_path / 'separate.grd')
+        else:
+            resampler.geocode(op, mlcfile, str(tmp_path / 'separate.grd'),
+                              scene['mlc_cols'], scene['grd_cols'], dtype='<c8')
+        assert readbytes(tmp_path / ('fused'+term+'.grd')) == readbytes(tmp_path / 'separate.grd')
+
+
+def test_fused_geocode_limit(programs, scene, tmp_path):
+    env = dict(os.environ, UAVSAR_CALIB_GEOCODE_MAXGB='1e-6')
+    result = subprocess.run([programs['uavsar_calib'], '-G', scene['geom'], '-t', scene['trans'],
+                             '-q', str(tmp_path / 'fused.grd'), scene['ann'], 'HHHH', '-'],
+                            stdout=subprocess.PIPE, env=env, universal_newlines=True)
+    assert result.returncode != 0
+    assert 'UAVSAR_CALIB_GEOCODE_MAXGB' in result.stdout
@@ -0,0 +1,12 @@
+"""uavsar_geocode gives the same GRD image whatever the number of MLC lines
+it reads at a time."""
+
+from conftest import geocode, readbytes
+
+
+def test_geocode_max_lines(programs, scene, tmp_path):
+    infile = scene['mlc']['HHHH']
+    geocode(programs, scene, infile, tmp_path / 'all.grd')
+    for max_lines in [2, 3, 17, scene['mlc_rows']]:
+        geocode(programs, scene, infile, tmp_path / 'lines.grd', max_lines)
+        assert readbytes(tmp_path / 'lines.grd') == readbytes(tmp_path / 'all.grd')
@@ -0,0 +1,85 @@
+import os
+import shutil
+
+import geometry_cache
+
+
+def _copyscene(scene, path):
+    """Copies the annotation file and DEM of a scene to path."""
+    ann = shutil.copy(scene['ann'], str(path))
+    hgt = shutil.copy(scene['hgt'], str(path))
+    return ann, hgt
+
+
+def _edit(filename, key, value):
+    """Sets the value of a parameter of an annotation file."""
+    with open(filename) as f:
+        lines = f.read().splitlines()
+    found = False
+    for n, line in enumerate(lines):
+        if line.startswith(key+' '):
+            name, rest = line.split('=', 1)
+            lines[n] = name+'= '+value+('  ;'+rest.split(';', 1)[1] if ';' in rest else '')
+            found = True
+    assert found
+    with open(filename, 'w') as f:
+        f.write('\n'.join(lines)+'\n')
+
+
+def test_geometrykey(synthscene, tmp_path):
+    ann, hgt = _copyscene(synthscene, tmp_path)
+    key = geometry_cache.geometrykey(ann, hgt)
+    assert key == geometry_cache.geometrykey(synthscene['ann'], synthscene['hgt'])
+
+    # The MLC filenames do not change the geometry:
+    _edit(ann, 'mlcHHHH', 'other_HHHH.mlc')
+    assert geometry_cache.geometrykey(ann, hgt) == key
+
+    # The flat DEM height replaces the DEM:
+    assert geometry_cache.geometrykey(ann, hgtval=0.0) != key
+    assert geometry_cache.geometrykey(ann, hgtval=0.0) != geometry_cache.geometrykey(ann, hgtval=10.0)
+
+    # The DEM contents and the annotation parameters do:
+    with open(hgt, 'r+b') as f:
+        f.write(b'\x00\x00\x80\x3f')
+    assert geometry_cache.geometrykey(ann, hgt) != key
+    shutil.copy(synthscene['hgt'], hgt)
+    assert geometry_cache.geometrykey(ann, hgt) == key
+    _edit(ann, 'Global Average Yaw', '0.6')
+    assert geometry_cache.geometrykey(ann, hgt) != key
+
+
+def _products(path, tag):
+    products = {}
+    for name in geometry_cache.PRODUCTS:
+        products[name] = str(path / (tag+'_'+name))
+        with open(products[name], 'wb') as f:
+            f.write((tag+' '+name).encode()*100)
+    return products
+
+
+def test_fetch_store(tmp_path):
+    cache = str(tmp_path / 'cache')
+    products = _products(tmp_path, 'scene1')
+    dest = {name: str(tmp_path / ('fetched_'+name)) for name in products}
+
+    assert not geometry_cache.fetch('key1', dest, cache)
+    geometry_cache.store('key1', products, cache)
+    assert geometry_cache.fetch('key1', dest, cache)
+    for name in products:
+        with open(products[name], 'rb') as a, open(dest[name], 'rb') as b:
+            assert a.read() == b.read()
+
+    # A subset of the products can be fetched, but not missing ones:
+    assert geometry_cache.fetch('key1', {'geom': dest['geom']}, cache)
+    assert not geometry_cache.fetch('key1', {'other': dest['geom']}, cache)
+
+
+def test_evict(tmp_path):
+    cache = str(tmp_path / 'cache')
+    size = sum(os.path.getsize(f) for f in _products(tmp_path, 'key0').values())
+    for n, key in enumerate(['key1', 'key2', 'key3']):
+        geometry_cache.store(key, _products(tmp_path, key), cache, maxbytes=2*size+size//2)
+        os.utime(os.path.join(cache, key), (n, n))
+
+    assert sorted(os.listdir(cache)) == ['key2', 'key3']
@@ -0,0 +1,44 @@
+"""The shared library gives the same bytes as the programs."""
+
+import pytest
+
+from conftest import geocode, run, readbytes
+import uavsar_lib
+
+
+@pytest.fixture(scope='module')
+def lib(programs):
+    if uavsar_lib.load(programs['libuavsar.so']) is None:
+        pytest.skip('libuavsar.so cannot be loaded')
+    return programs['libuavsar.so']
+
+
+@pytest.mark.parametrize('pol,lut', [('HHHH', False), ('HVHV', True), ('COV', True)])
+def test_library(programs, lib, scene, caltbl, tmp_path, pol, lut):
+    """uavsar_lib.calibrate gives the same calibrated, mask, and geocoded
+    images as uavsar_calib -G -q."""
+    terms = ['HHHH', 'HVHV', 'VVVV', 'HHHV', 'HHVV', 'HVVV'] if pol == 'COV' else [pol]
+    args = [programs['uavsar_calib'], '-G', scene['geom'], '-t', scene['trans'], '-m', tmp_path / 'mask_exe',
+            '-q', tmp_path / ('exe_grd_'+pol)]
+    if lut:
+        args += ['-c', caltbl if pol == 'COV' else caltbl+'_'+pol[0:2]+'.flt']
+    run(args + [scene['ann'], pol, tmp_path / ('exe_mlc_'+pol)])
+
+    uavsar_lib.calibrate(scene['ann'], terms, scene['geom'], [str(tmp_path / ('lib_mlc_'+term)) for term in terms],
+                         caltbl=(caltbl if pol == 'COV' else caltbl+'_'+pol[0:2]+'.flt') if lut else None,
+                         maskfile=str(tmp_path / 'mask_lib'), transfile=scene['trans'],
+                         grdfiles=[str(tmp_path / ('lib_grd_'+term)) for term in terms], nthreads=2)
+
+    assert readbytes(tmp_path / 'mask_lib') == readbytes(tmp_path / 'mask_exe')
+    for term in terms:
+        assert readbytes(tmp_path / ('lib_mlc_'+term)) == readbytes(tmp_path / ('exe_mlc_'+term))
+        assert readbytes(tmp_path / ('lib_grd_'+term)) == readbytes(tmp_path / ('exe_grd_'+term))
+
+
+def test_library_geocode(programs, lib, scene, tmp_path):
+    """uavsar_lib.geocodefiles gives the same GRD image as uavsar_geocode."""
+    geocode(programs, scene, scene['mlc']['VVVV'], tmp_path / 'exe.grd')
+    uavsar_lib.geocodefiles(scene['trans'], [scene['mlc']['VVVV']], [str(tmp_path / 'lib.grd')],
+                            scene['mlc_rows'], scene['mlc_cols'], scene['grd_rows'], scene['grd_cols'],
+                            nthreads=3)
+    assert readbytes(tmp_path / 'lib.grd') == readbytes(tmp_path / 'exe.grd')
@@ -0,0 +1,144 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+pytest.importorskip('osgeo')
+pytest.importorskip('matplotlib')
+import radiocal
+from conftest import readbytes
+
+
+def _blocks(data, nblocks):
+    return lambda: iter(np.array_split(data, nblocks))
+
+
+@pytest.mark.parametrize('n', [1, 2, 3, 10, 1001, 65537])
+def test_blockpercentiles(n):
+    rng = np.random.default_rng(n)
+    data = (rng.random(n)*60 + 5).astype('float32')
+    q = [0, 9, 50, 95, 100, 37.3]
+    result = radiocal._blockpercentiles(_blocks(data, 4), q)
+    for value, qq in zip(result, q):
+        expected = np.percentile(data, qq)
+        assert value.dtype == expected.dtype
+        assert value.tobytes() == expected.tobytes()
+
+
+def test_blockpercentiles_interpolation():
+    # Neighbouring order statistics far apart, so that the interpolation
+    # rounds differently in float32 and float64:
+    data = np.array([1.0, 3.0e7+1, 3.0, 7.0e-3, 1.1e7, 2.0], dtype='float32')
+    for qq in [9, 95, 33.3, 66.7]:
+        value = radiocal._blockpercentiles(_blocks(data, 3), [qq])[0]
+        assert value.tobytes() == np.percentile(data, qq).tobytes()
+
+    with pytest.raises(ValueError):
+        radiocal._blockpercentiles(_blocks(np.zeros(0, dtype='float32'), 1), [9])
+
+
+def _partial(path, name, rng, pol=(0, 1, 2), min_look=22.0, max_look=65.0):
+    """Saves random LUT partial sums (flat DEM bins) for one scene, and
+    returns the filename, sums and counts."""
+    bin_num = rng.integers(0, 5, 900)
+    bin_val = rng.random((len(pol), 900))*bin_num
+    params = radiocal._lutparams(name+'.grd', [1], list(pol), 'area_only', 0, None,
+                                 True, min_look, max_look)
+    partialfile = str(path / ('lutpartial_test_'+name+'.npz'))
+    radiocal._savepartial(partialfile, bin_val, bin_num, params, min_look, max_look)
+    return partialfile, bin_val, bin_num
+
+
+def _luts(path, name):
+    return [np.fromfile(str(path / ('caltbl_'+name+'_'+p+'.flt')), dtype='<f4') for p in ['HH', 'VV', 'HV']]
+
+
+def test_mergelut(tmp_path):
+    rng = np.random.default_rng(0)
+    file1, val1, num1 = _partial(tmp_path, 'scene1', rng)
+    file2, val2, num2 = _partial(tmp_path, 'scene2', rng)
+
+    radiocal.mergelut([file1, file2], str(tmp_path)+'/', 'merged', min_samples=2)
+    radiocal._finalizelut(val1+val2, num1+num2, [0, 1, 2], str(tmp_path)+'/', 'summed',
+                          True, True, 51, 22.0, 65.0, 2)
+    for merged, summed in zip(_luts(tmp_path, 'merged'), _luts(tmp_path, 'summed')):
+        assert merged.tobytes() == summed.tobytes()
+
+
+def test_mergelut_mismatch(tmp_path):
+    rng = np.random.default_rng(0)
+    file1 = _partial(tmp_path, 'scene1', rng)[0]
+    file2 = _partial(tmp_path, 'scene2', rng, pol=(0, 1))[0]
+    file3 = _partial(tmp_path, 'scene3', rng, min_look=25.0)[0]
+    with pytest.raises(ValueError):
+        radiocal.mergelut([file1, file2], str(tmp_path)+'/', 'merged')
+    with pytest.raises(ValueError):
+        radiocal.mergelut([file1, file3], str(tmp_path)+'/', 'merged')
+
+
+def test_reusepartial_look_range(tmp_path):
+    rng = np.random.default_rng(0)
+    inputs = []
+    for name in ['mask', 'look', 'hv', 'slope', 'hh']:
+        inputs.append(str(tmp_path / name))
+        open(inputs[-1], 'w').close()
+    inputs = inputs[:4] + [inputs[4:]]
+    partialfile = _partial(tmp_path, 'scene1', rng)[0]
+
+    same = radiocal._lutparams('scene1.grd', [1], [0, 1, 2], 'area_only', 0, None, True, 22.0, 65.0)
+    other = radiocal._lutparams('scene1.grd', [1], [0, 1, 2], 'area_only', 0, None, True, 22.5, 65.0)
+    assert radiocal._reusepartial(partialfile, same, inputs) is not None
+    assert radiocal._reusepartial(partialfile, other, inputs) is None
+
+
+def _envi(filename, data):
+    """Writes a float32 image with an ENVI header, as read by GDAL."""
+    data.astype('<f4').tofile(filename)
+    with open(filename+'.hdr', 'w') as f:
+        f.write('ENVI\nsamples = {}\nlines = {}\nbands = 1\nheader offset = 0\n'
+                'file type = ENVI Standard\ndata type = 4\ninterleave = bsq\n'
+                'byte order = 0\n'.format(data.shape[1], data.shape[0]))
+
+
+@pytest.mark.parametrize('flatdemflag', [True, False])
+def test_scenesums_masked_block(tmp_path, flatdemflag):
+    """A block without valid pixels adds nothing to the LUT bins."""
+    rng = np.random.default_rng(0)
+    mask = np.ones((6, 5))
+    mask[0:2] = 0
+    inputs = []
+    for name, data in [('mask', mask), ('look', 20 + 50*rng.random((6, 5))),
+                       ('hv', rng.random((6, 5))), ('slope', 90*rng.random((6, 5)) - 45),
+                       ('hh', rng.random((6, 5)))]:
+        inputs.append(str(tmp_path / name))
+        _envi(inputs[-1], data)
+    inputs = inputs[:4] + [inputs[4:]]
+
+    val, num = radiocal._scenesums(inputs, [1], 1, 0, 1, flatdemflag, 22.0, 65.0, 6)[0:2]
+    val2, num2 = radiocal._scenesums(inputs, [1], 1, 0, 1, flatdemflag, 22.0, 65.0, 2)[0:2]
+    assert np.array_equal(num2, num) and np.allclose(val2, val)
+    assert 0 < num.sum() <= 20
+
+
+def test_applylut_hard_link(synthscene, tmp_path):
+    """applylut replaces the outfile, rather than writing through a hard link
+    to it (as made by complex_RTC.py), and leaves no temporary files."""
+    ann = shutil.copy(synthscene['ann'], str(tmp_path))
+    rootname = ann[0:-14]
+    shape = (synthscene['grd_rows'], synthscene['grd_cols'])
+    rng = np.random.default_rng(0)
+    (20 + 50*rng.random(shape)).astype('<f4').tofile(rootname+'look.grd')
+    rng.random(shape).astype('<f4').tofile(rootname+'HHHH_area_only.grd')
+    for scale in [1, 2]:
+        (scale*(0.5 + rng.random((900, 900)))).astype('<f4').tofile(str(tmp_path / 'caltbl_HH.flt'))
+        radiocal.applylut(str(tmp_path), str(tmp_path / 'caltbl'), pol=[0], flatdemflag=True,
+                          overwriteflag=True, blocksize=100)
+        if scale == 1:
+            outfile = rootname+'HHHH_area_veg.grd'
+            linked = readbytes(outfile)
+            os.link(outfile, str(tmp_path / 'linked.grd'))
+
+    assert readbytes(str(tmp_path / 'linked.grd')) == linked
+    assert readbytes(outfile) != linked
+    assert not [f for f in os.listdir(str(tmp_path)) if f.endswith('.tmp')]
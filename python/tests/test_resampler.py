@@ -0,0 +1,14 @@
+"""The Python resampler gives the same GRD images as uavsar_geocode."""
+
+import resampler
+from conftest import geocode, readbytes
+
+
+def test_resampler(programs, scene, tmp_path):
+    op = resampler.build(scene['trans'], scene['mlc_rows'], scene['mlc_cols'],
+                         scene['grd_rows'], scene['grd_cols'], blocksize=7)
+    for term in ['HHHH', 'HVHV']:
+        geocode(programs, scene, scene['mlc'][term], tmp_path / 'geocode.grd')
+        resampler.geocode(op, scene['mlc'][term], str(tmp_path / 'resampler.grd'),
+                          scene['mlc_cols'], scene['grd_cols'], blocksize=5)
+        assert readbytes(tmp_path / 'resampler.grd') == readbytes(tmp_path / 'geocode.grd')
@@ -0,0 +1,43 @@
+import pytest
+
+import workflow
+
+
+def _ok(value):
+    return value
+
+
+def _fail():
+    raise RuntimeError('task failed')
+
+
+def test_failed_task_skips_dependents():
+    wf = workflow.Workflow()
+    wf.add('a', 'area', _fail)
+    wf.add('b', 'lut', _ok, args=(1,), deps=['a'])
+    wf.add('c', 'lutcorr', _ok, args=(2,), deps=['b'])
+    wf.add('d', 'area', _ok, args=(3,))
+    wf.add('e', 'lut', _ok, kwargs={'value': 4}, deps=['d'])
+
+    status = wf.run(workers=2)
+
+    assert status == {'a': 'failed', 'b': 'skipped', 'c': 'skipped', 'd': 'done', 'e': 'done'}
+    assert 'RuntimeError: task failed' in wf.tasks['a'].error
+    assert (wf.tasks['d'].result, wf.tasks['e'].result) == (3, 4)
+
+
+def test_stage_limits():
+    wf = workflow.Workflow()
+    for n in range(4):
+        wf.add('t{}'.format(n), 'area', _ok, args=(n,))
+    status = wf.run(workers=3, limits={'area': 1})
+    assert list(status.values()) == ['done']*4
+
+
+def test_unknown_dependency():
+    wf = workflow.Workflow()
+    wf.add('a', 'area', _ok, args=(0,))
+    with pytest.raises(ValueError):
+        wf.add('a', 'area', _ok, args=(0,))
+    with pytest.raises(ValueError):
+        wf.add('b', 'lut', _ok, args=(0,), deps=['missing'])
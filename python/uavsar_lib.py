@@ -0,0 +1,362 @@
+"""In-process radiometric correction and geocoding of UAVSAR images.
+
+The libuavsar shared library (built by the Makefile along with the
+programs) contains the radiometric correction of uavsar_calib and the
+geocoding of uavsar_geocode.  Through it, they can be run from Python on
+NumPy arrays, instead of starting the programs with a command line and
+passing every image through a file.  The arrays (which can also be
+memory mapped files, e.g., np.memmap) are read and written in place by the
+library, without copies, so the correction and geocoding can be chained in
+memory: e.g., the calibrated images need not be saved in RDC coordinates
+to be geocoded.
+
+The results are bit-identical to those of the programs.  The DEM facet
+model is not in the library, since it only needs to be computed once per
+scene: the geometry it produces is saved by "uavsar_calib -g" (which the
+geometry cache keeps, see geometry_cache.py), and passed to correct().
+
+The functions which take arrays need C contiguous arrays of the dtype
+given in their documentation, and raise a ValueError for anything else,
+rather than copying them.  calibrate() and geocodefiles() are wrappers
+which work on files, like the programs.
+
+Example:
+
+    import uavsar_lib
+    if uavsar_lib.available():
+        uavsar_lib.calibrate(annfile, ['HHHH'], geomfile, [mlcfile],
+                             transfile=transfile, grdfiles=[grdfile])
+"""
+
+import ctypes
+import ctypes.util
+import os
+
+import numpy as np
+
+import annotation
+
+
+# Number of planes of a facet model geometry file (see uavsar_calib -g):
+# area, local incidence angle, look angle, range slope, and antenna pattern.
+GEOM_PLANES = 5
+
+# Size of a vegetation correction LUT (slope bins by look angle bins).
+LUT_SIZE = 900
+
+# Diagonal covariance matrix terms, and their polarization numbers in the
+# library.
+DIAG_TERMS = ['HHHH', 'HVHV', 'VVVV']
+
+_ERRORS = {1: 'cannot open the annotation file',
+           2: 'the image dimensions do not match the annotation file',
+           3: 'the terms must be one of HHHH, HVHV, or VVVV, or all six covariance matrix terms'}
+
+# Loaded library, or False if it could not be found.
+_lib = None
+
+
+def _findlib():
+    """Returns the path of the libuavsar shared library: from the repository
+    root (where the Makefile builds it), from ../bin (relative to this
+    script), or from the system library path, or None if not found."""
+    pydir = os.path.dirname(os.path.realpath(__file__))
+    for path in [os.path.join(pydir, '..', 'libuavsar.so'),
+                 os.path.join(pydir, '..', 'bin', 'libuavsar.so')]:
+        if os.path.isfile(path):
+            return os.path.abspath(path)
+    return ctypes.util.find_library('uavsar')
+
+
+def load(libfile=None):
+    """Loads the libuavsar shared library.
+
+        Arguments:
+            libfile (str): Path and filename of the library.  Default: see
+                _findlib().
+
+        Returns:
+            lib (ctypes.CDLL): The library, or None if it cannot be found
+                or loaded.
+
+    """
+    global _lib
+    if (_lib is not None) and (libfile is None):
+        return _lib or None
+
+    if libfile is None:
+        libfile = _findlib()
+    try:
+        lib = ctypes.CDLL(libfile) if libfile is not None else None
+    except OSError as err:
+        print('uavsar_lib -- Cannot load library {}: {}'.format(libfile, err))
+        lib = None
+
+    if lib is not None:
+        ptrs = ctypes.POINTER(ctypes.c_void_p)
+        lib.uavsar_correct.restype = ctypes.c_int
+        lib.uavsar_correct.argtypes = [ctypes.c_char_p, ctypes.c_long, ctypes.c_long, ctypes.c_void_p,
+                                       ctypes.c_int, ctypes.POINTER(ctypes.c_int), ptrs, ptrs,
+                                       ptrs, ptrs, ctypes.c_void_p,
+                                       ctypes.c_int, ptrs, ptrs, ctypes.c_int]
+        lib.uavsar_geocode.restype = ctypes.c_int
+        lib.uavsar_geocode.argtypes = [ctypes.c_void_p, ctypes.c_long, ctypes.c_long, ctypes.c_long, ctypes.c_long,
+                                       ctypes.c_int, ptrs, ptrs,
+                                       ctypes.c_int, ptrs, ptrs, ctypes.c_int]
+    _lib = lib if lib is not None else False
+    return lib
+
+
+def available():
+    """Returns True if the libuavsar shared library can be loaded."""
+    return load() is not None
+
+
+def _checked(arr, dtype, shape, name, writable=False):
+    """Checks that an array can be passed to the library as it is, and
+    returns it.  Raises a ValueError if it has the wrong dtype or shape, is
+    not C contiguous, or is not writable when it must be."""
+    if not isinstance(arr, np.ndarray):
+        raise ValueError('uavsar_lib -- {} must be a NumPy array.'.format(name))
+    if arr.dtype != np.dtype(dtype):
+        raise ValueError('uavsar_lib -- {} must have dtype {}, not {}.'.format(name, dtype, arr.dtype))
+    if arr.shape != tuple(shape):
+        raise ValueError('uavsar_lib -- {} must have shape {}, not {}.'.format(name, tuple(shape), arr.shape))
+    if not arr.flags['C_CONTIGUOUS']:
+        raise ValueError('uavsar_lib -- {} must be C contiguous.'.format(name))
+    if writable and not arr.flags['WRITEABLE']:
+        raise ValueError('uavsar_lib -- {} must be writable.'.format(name))
+    return arr
+
+
+def _pointers(arrays):
+    """Array of the data pointers of a list of arrays (None for NULL)."""
+    return (ctypes.c_void_p * max(len(arrays), 1))(*[None if a is None else a.ctypes.data for a in arrays])
+
+
+def _getlib():
+    lib = load()
+    if lib is None:
+        raise IOError('uavsar_lib -- Cannot find the libuavsar shared library (see the Makefile).')
+    return lib
+
+
+def correct(annfile, terms, geom, mlc, out, caltbls=None, mask=None,
+            ratios=None, nthreads=1):
+    """Radiometric correction of MLC images, as done by uavsar_calib with
+    the facet model geometry from a previous run (its -G option).
+
+        Arguments:
+            annfile (str): Path and filename of the annotation file.
+            terms (list): Covariance matrix terms to calibrate: one of
+                'HHHH', 'HVHV', or 'VVVV', or all six terms in the order of
+                annotation.COV_TERMS (the off-diagonal terms are calibrated
+                with the correction ratios of the diagonal terms).
+            geom (array): Facet model geometry, float32 of shape
+                (GEOM_PLANES, rows, cols), e.g. from geometry().
+            mlc (list): Input image of each term, of shape (rows, cols):
+                float32 for the diagonal terms, complex64 for the
+                off-diagonal terms.
+            out (list): Arrays for the calibrated image of each term, of the
+                same shapes and dtypes as mlc.  For the off-diagonal terms,
+                the input array can be given to calibrate in place, but not
+                for the diagonal terms.
+            caltbls (list): Vegetation correction LUT of each diagonal term,
+                float32 of shape (LUT_SIZE, LUT_SIZE), e.g. from readlut().
+                Default: None (area correction only).
+            mask (array): Array for the validity mask (float32 of shape
+                (rows, cols), 1 for void pixels), or None.
+            ratios (list): Arrays for the correction ratio of each diagonal
+                term (float32 of shape (rows, cols)), or None.  Elements can
+                also be None.
+            nthreads (int): Number of worker threads.  The results do not
+                depend on the number of threads.
+
+    """
+    lib = _getlib()
+    terms = list(terms)
+    if terms == annotation.COV_TERMS:
+        ndiag = 3
+    elif (len(terms) == 1) and (terms[0] in DIAG_TERMS):
+        ndiag = 1
+    else:
+        raise ValueError('uavsar_lib -- Invalid terms: '+_ERRORS[3]+'.')
+    if (len(mlc) != len(terms)) or (len(out) != len(terms)):
+        raise ValueError('uavsar_lib -- mlc and out must have one array per term.')
+
+    shape = np.shape(mlc[0])
+    _checked(geom, '<f4', (GEOM_PLANES,)+shape, 'geom')
+    for k, term in enumerate(terms):
+        dtype = '<f4' if k < ndiag else '<c8'
+        _checked(mlc[k], dtype, shape, term+' input')
+        _checked(out[k], dtype, shape, term+' output', writable=True)
+        if (k < ndiag) and np.shares_memory(mlc[k], out[k]):
+            raise ValueError('uavsar_lib -- The {} output cannot be the input array.'.format(term))
+    if caltbls is not None:
+        if len(caltbls) != ndiag:
+            raise ValueError('uavsar_lib -- caltbls must have one LUT per diagonal term.')
+        for k in range(ndiag):
+            _checked(caltbls[k], '<f4', (LUT_SIZE, LUT_SIZE), terms[k]+' LUT')
+    if mask is not None:
+        _checked(mask, '<f4', shape, 'mask', writable=True)
+    if ratios is not None:
+        if len(ratios) != ndiag:
+            raise ValueError('uavsar_lib -- ratios must have one array per diagonal term.')
+        for k in range(ndiag):
+            if ratios[k] is not None:
+                _checked(ratios[k], '<f4', shape, terms[k]+' ratio', writable=True)
+
+    pols = (ctypes.c_int * ndiag)(*[DIAG_TERMS.index(term)+1 for term in terms[0:ndiag]])
+    status = lib.uavsar_correct(os.fsencode(annfile), shape[0], shape[1], geom.ctypes.data,
+                                ndiag, pols, _pointers(mlc[0:ndiag]),
+                                None if caltbls is None else _pointers(caltbls),
+                                _pointers(out[0:ndiag]),
+                                None if ratios is None else _pointers(ratios),
+                                None if mask is None else mask.ctypes.data,
+                                len(terms)-ndiag, _pointers(mlc[ndiag:]), _pointers(out[ndiag:]),
+                                nthreads)
+    if status != 0:
+        raise ValueError('uavsar_lib -- Correction failed for {}: {}.'.format(annfile, _ERRORS[status]))
+
+
+def geocode(trans, rdc, grd, nthreads=1):
+    """Geocodes RDC images by bilinear interpolation, as done by
+    uavsar_geocode.
+
+        Arguments:
+            trans (array): Transformation LUT (as saved by uavsar_calib -u),
+                complex64 of shape (grd_rows, grd_cols), with the range and
+                azimuth pixel coordinates of each GRD pixel.
+            rdc (list): RDC images, of shape (rows, cols), float32 or
+                complex64.  Complex images are geocoded in the same way.
+            grd (list): Arrays for the GRD images, of shape (grd_rows,
+                grd_cols) and the same dtypes as rdc.
+            nthreads (int): Number of worker threads.
+
+    """
+    lib = _getlib()
+    if len(rdc) != len(grd):
+        raise ValueError('uavsar_lib -- rdc and grd must have the same number of images.')
+    _checked(trans, '<c8', np.shape(trans), 'trans')
+    shape = np.shape(rdc[0]) if len(rdc) > 0 else (0, 0)
+    for k, (band, out) in enumerate(zip(rdc, grd)):
+        dtype = '<c8' if np.iscomplexobj(band) else '<f4'
+        _checked(band, dtype, shape, 'RDC image {}'.format(k))
+        _checked(out, dtype, trans.shape, 'GRD image {}'.format(k), writable=True)
+
+    floats = [k for k in range(len(rdc)) if not np.iscomplexobj(rdc[k])]
+    cpxs = [k for k in range(len(rdc)) if np.iscomplexobj(rdc[k])]
+    lib.uavsar_geocode(trans.ctypes.data, trans.shape[0], trans.shape[1], shape[0], shape[1],
+                       len(floats), _pointers([rdc[k] for k in floats]), _pointers([grd[k] for k in floats]),
+                       len(cpxs), _pointers([rdc[k] for k in cpxs]), _pointers([grd[k] for k in cpxs]),
+                       nthreads)
+
+
+def geometry(geomfile, rows, cols):
+    """Memory maps a facet model geometry file (uavsar_calib -g) of an MLC
+    image of rows x cols pixels, for correct()."""
+    return np.memmap(geomfile, dtype='<f4', mode='r', shape=(GEOM_PLANES, rows, cols))
+
+
+def readlut(caltblfile):
+    """Reads a vegetation correction LUT file (uavsar_calib -c), for
+    correct()."""
+    return np.fromfile(caltblfile, dtype='<f4', count=LUT_SIZE*LUT_SIZE).reshape((LUT_SIZE, LUT_SIZE))
+
+
+def _image(filename, dtype, shape, mode):
+    """Memory maps an image file, or returns an array in memory if
+    filename is None (for mode 'w+')."""
+    if filename is None:
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(filename, dtype=dtype, mode=mode, shape=shape)
+
+
+def calibrate(annfile, terms, geomfile, outfiles, caltbl=None, maskfile=None,
+              transfile=None, grdfiles=None, nthreads=1):
+    """Calibrates and (optionally) geocodes the MLC images of a scene, given
+    the facet model geometry file saved by "uavsar_calib -g".  This is the
+    same as running uavsar_calib with -G (and -q), but in-process.  The
+    calibrated images are only kept in memory if they are not saved.
+
+        Arguments:
+            annfile (str): Path and filename of the annotation file.  The
+                MLC files are the ones it names, in the same folder.
+            terms (list): Covariance matrix terms to calibrate (see
+                correct()).
+            geomfile (str): Path and filename of the geometry file.
+            outfiles (list): Path and filename of the calibrated MLC file of
+                each term, or None to not save them.
+            caltbl (str): Vegetation correction LUT file, as for the -c
+                option of uavsar_calib (with all six terms, the root of the
+                LUT filenames).  Default: None (area correction only).
+            maskfile (str): Path and filename of the validity mask to save,
+                or None.
+            transfile (str): Path and filename of the transformation LUT,
+                for geocoding.
+            grdfiles (list): Path and filename of the geocoded GRD file of
+                each term, or None to not geocode.
+            nthreads (int): Number of worker threads.
+
+    """
+    ann = annotation.load(annfile)
+    shape = (int(ann['mlc_pwr.set_rows']), int(ann['mlc_pwr.set_cols']))
+    datapath = os.path.dirname(os.path.abspath(annfile))
+    dtypes = ['<f4' if term in DIAG_TERMS else '<c8' for term in terms]
+    if outfiles is None:
+        outfiles = [None]*len(terms)
+
+    mlc = [_image(os.path.join(datapath, ann['mlc'+term]), dtype, shape, 'r')
+           for term, dtype in zip(terms, dtypes)]
+    out = [_image(outfile, dtype, shape, 'w+') for outfile, dtype in zip(outfiles, dtypes)]
+    caltbls = None
+    if caltbl is not None:
+        if len(terms) > 1:
+            caltbls = [readlut(caltbl+'_'+term[0:2]+'.flt') for term in terms if term in DIAG_TERMS]
+        else:
+            caltbls = [readlut(caltbl)]
+    mask = _image(maskfile, '<f4', shape, 'w+') if maskfile is not None else None
+
+    correct(annfile, terms, geometry(geomfile, shape[0], shape[1]), mlc, out,
+            caltbls=caltbls, mask=mask, nthreads=nthreads)
+    del mlc, mask
+
+    if grdfiles is not None:
+        grd_shape = (int(ann['grd_pwr.set_rows']), int(ann['grd_pwr.set_cols']))
+        trans = np.memmap(transfile, dtype='<c8', mode='r', shape=grd_shape)
+        grd = [np.memmap(grdfile, dtype=dtype, mode='w+', shape=grd_shape)
+               for grdfile, dtype in zip(grdfiles, dtypes)]
+        geocode(trans, out, grd, nthreads=nthreads)
+        del grd, trans
+    del out
+
+
+def geocodefiles(transfile, infiles, outfiles, rdc_rows, rdc_cols, grd_rows,
+                 grd_cols, dtypes=None, nthreads=1):
+    """Geocodes RDC image files, as done by uavsar_geocode, but in-process
+    and for any number of images (float32 or complex64) at once.
+
+        Arguments:
+            transfile (str): Path and filename of the transformation LUT.
+            infiles (list): Paths and filenames of the RDC images.
+            outfiles (list): Paths and filenames of the GRD images to
+                create, in the same order as infiles.
+            rdc_rows (int): Number of rows of the RDC images.
+            rdc_cols (int): Number of columns of the RDC images.
+            grd_rows (int): Number of rows of the GRD images.
+            grd_cols (int): Number of columns of the GRD images.
+            dtypes (list): Data type of each image ('<f4' or '<c8').
+                Default: '<f4' for all of the images.
+            nthreads (int): Number of worker threads.
+
+    """
+    if dtypes is None:
+        dtypes = ['<f4']*len(infiles)
+    trans = np.memmap(transfile, dtype='<c8', mode='r', shape=(grd_rows, grd_cols))
+    rdc = [np.memmap(infile, dtype=dtype, mode='r', shape=(rdc_rows, rdc_cols))
+           for infile, dtype in zip(infiles, dtypes)]
+    grd = [np.memmap(outfile, dtype=dtype, mode='w+', shape=(grd_rows, grd_cols))
+           for outfile, dtype in zip(outfiles, dtypes)]
+    geocode(trans, rdc, grd, nthreads=nthreads)
+    del grd
+    del rdc
@@ -9,10 +9,15 @@ import argparse
 from glob import glob
 
 from buildUAVSARhdr import genHDRfromTXT
+import annotation
+import geometry_cache
+import profiling
+import uavsar_lib
 
 
 def runcal(annfile, name=None, caltbl=None, look=None, slope=None,
-           mask=None, diff=None):
+           mask=None, diff=None, cache=True, profilefile=None, nthreads=1,
+           library=False):
     """Performs radiometric calibration on a given UAVSAR dataset, and
         geocodes the result.
         
@@ -46,8 +51,27 @@ def runcal(annfile, name=None, caltbl=None, look=None, slope=None,
             mask (bool): Boolean flag that sets whether to save mask file.
             diff (bool): Boolean flag that sets whether to create difference
                 file.
+            cache (bool): Boolean flag that sets whether to use the geometry
+                cache (see geometry_cache.py), so that the DEM facet model is
+                only computed once per scene.
+            profilefile (str): Path and filename of a JSON-lines log to which
+                the time, storage I/O, and peak memory of each stage are
+                appended (see profiling.py).  Profiling can also be enabled
+                with the RADIOCAL_PROFILE environment variable.  Default:
+                None.
+            nthreads (int): Number of worker threads for uavsar_calib (its -n
+                option).  Default: 1.
+            library (bool): Boolean flag that sets whether to calibrate and
+                geocode in-process with the libuavsar shared library (see
+                uavsar_lib.py) when the facet model geometry is available
+                (from the cache, or from the first polarization), and to
+                geocode with it otherwise, instead of running uavsar_calib
+                and uavsar_geocode.  The results are identical.
         
     """
+    if profilefile is not None:
+        profiling.enable(profilefile)
+    
     # Find the programs to call.
     uavsar_calib_prog = subprocess.getoutput('which uavsar_calib')
     uavsar_geocode_prog = subprocess.getoutput('which uavsar_geocode')
@@ -66,6 +90,10 @@ def runcal(annfile, name=None, caltbl=None, look=None, slope=None,
             print('uavsar_radiocal_helper.py -- Cannot find program uavsar_geocode.  Aborting.')
             return
             
+    if library and not uavsar_lib.available():
+        print('uavsar_radiocal_helper.py -- Cannot load the libuavsar shared library.  Using the programs instead.')
+        library = False
+            
     if not os.path.isfile(annfile):
         print('uavsar_radiocal_helper.py -- Cannot find annotation file: "'+annfile+'".  Aborting.')
         return
@@ -74,25 +102,26 @@ def runcal(annfile, name=None, caltbl=None, look=None, slope=None,
         name = 'Cal'
         
     # Load dimensions and filenames from annotation file.  
-    with open(annfile, 'r') as ann:
-        for line in ann:
-            if 'mlc_mag.set_cols' in line:
-                mlc_cols = line.split()[3]
-            elif 'grd_mag.set_cols' in line:
-                grd_cols = line.split()[3]
-            elif 'grd_mag.set_rows' in line:
-                grd_rows = line.split()[3]
-            elif 'mlcHHHH' in line:
-                mlcfileHH = line.split()[2]
-            elif 'mlcHVHV' in line:
-                mlcfileHV = line.split()[2]
-            elif 'mlcVVVV' in line:
-                mlcfileVV = line.split()[2]
+    scenename = os.path.basename(annfile)[0:-4]
+    with profiling.stage('ann', scenename):
+        ann = annotation.load(annfile)
+    mlc_rows = ann.string('mlc_mag.set_rows')
+    mlc_cols = ann.string('mlc_mag.set_cols')
+    grd_cols = ann.string('grd_mag.set_cols')
+    grd_rows = ann.string('grd_mag.set_rows')
+    mlcfileHH = ann.get('mlcHHHH', '')
+    mlcfileHV = ann.get('mlcHVHV', '')
+    mlcfileVV = ann.get('mlcVVVV', '')
+    hgtfile = ann.get('hgt')
         
 
     # Perform the processing for each polarization.
     datapath = os.path.dirname(annfile)
     
+    # The facet model geometry is computed (or loaded from the cache) for
+    # the first polarization, and reused for the others.
+    geomready = False
+    
     for pol in range(3):
         if pol == 0:
             mlcfile = mlcfileHH
@@ -112,14 +141,44 @@ def runcal(annfile, name=None, caltbl=None, look=None, slope=None,
             basefile_nopol = basefile.split(polstr)[0] + basefile.split(polstr)[1]
             
             
+            geomproducts = {'geom': basefile_nopol+'_'+name+'.geom',
+                            'trans': basefile_nopol+'_geomap.trans',
+                            'look': basefile_nopol+'_look_temp',
+                            'slope': basefile_nopol+'_slope_temp'}
+            
+            if not geomready:
+                # Remove old temporary files first, since they may be hard
+                # linked to entries in the geometry cache.
+                for f in geomproducts.values():
+                    if os.path.lexists(f):
+                        os.remove(f)
+                
+                if cache and (hgtfile is not None):
+                    geomcache = geometry_cache.cachedir(datapath)
+                    geomkey = geometry_cache.geometrykey(annfile, datapath+'/'+hgtfile)
+                    geomready = geometry_cache.fetch(geomkey, geomproducts, geomcache)
+            
             # String for call to calibration program.
             calib_exec = uavsar_calib_prog + ' '
             
+            if geomready:
+                calib_exec += '-G '+geomproducts['geom']+' '
+            else:
+                calib_exec += '-g '+geomproducts['geom']+' '
+                calib_exec += '-u '+geomproducts['trans']+' '
+                calib_exec += '-l '+geomproducts['look']+' '
+                calib_exec += '-s '+geomproducts['slope']+' '
+            
+            if nthreads > 1:
+                calib_exec += '-n '+str(nthreads)+' '
+            
+            calfile = None
             if caltbl is not None:
                 calfiles = glob(caltbl+'*'+shortpol+'*.flt')
 
                 if len(calfiles) == 1: 
-                    calib_exec += '-c '+calfiles[0]+' '
+                    calfile = calfiles[0]
+                    calib_exec += '-c '+calfile+' '
                 elif len(calfiles) > 1:
                     print('uavsar_radiocal_helper.py -- Too many calibration table files matching pattern: "'+caltbl+'*'+shortpol+'*.flt".  Aborting.')
                     os._exit(1)
@@ -127,19 +186,12 @@ def runcal(annfile, name=None, caltbl=None, look=None, slope=None,
                     print('uavsar_radiocal_helper.py -- Cannot find calibration table file matching pattern: "'+caltbl+'*'+shortpol+'*.flt".  Aborting.')
                     os._exit(1)
 
-            if look:
-                calib_exec += '-l '+basefile_nopol+'_look.grd '
-
-            if slope:
-                calib_exec += '-s '+basefile_nopol+'_slope.grd '
-                
             if mask:
                 calib_exec += '-m '+basefile_nopol+'_'+name+'_mask.mlc '
 
             if diff:
                 calib_exec += '-d '+basefile+'_'+name+'_diff.mlc '
                 
-            calib_exec += '-u '+basefile+'_geomap.trans '       
             calib_exec += annfile+' '+polstr+' '+basefile+'_'+name+'.mlc'
             
             
@@ -147,22 +199,45 @@ def runcal(annfile, name=None, caltbl=None, look=None, slope=None,
             geocode_exec = uavsar_geocode_prog + ' '
             geocode_exec += basefile+'_'+name+'.mlc '
             geocode_exec += str(mlc_cols) + ' '
-            geocode_exec += basefile+'_geomap.trans '
+            geocode_exec += geomproducts['trans']+' '
             geocode_exec += basefile+'_'+name+'.grd '
             geocode_exec += str(grd_cols) + ' ' + str(grd_rows)
             
             
-            print('uavsar_radiocal_helper.py -- Calibrating file: '+mlcfile)
-            print(subprocess.getoutput(calib_exec))
-            print('uavsar_radiocal_helper.py -- Geocoding file: '+mlcfile)
-            print(subprocess.getoutput(geocode_exec))
-            genHDRfromTXT(annfile, basefile+'_'+name+'.grd', polstr)
+            if library and geomready:
+                # The calibrated image is geocoded in memory.
+                print('uavsar_radiocal_helper.py -- Calibrating and geocoding file: '+mlcfile)
+                with profiling.stage('calib', scenename, pol=polstr):
+                    uavsar_lib.calibrate(annfile, [polstr], geomproducts['geom'], [basefile+'_'+name+'.mlc'],
+                                         caltbl=calfile, maskfile=basefile_nopol+'_'+name+'_mask.mlc' if mask else None,
+                                         transfile=geomproducts['trans'], grdfiles=[basefile+'_'+name+'.grd'],
+                                         nthreads=nthreads)
+            else:
+                print('uavsar_radiocal_helper.py -- Calibrating file: '+mlcfile)
+                with profiling.stage('calib', scenename, pol=polstr):
+                    print(profiling.getoutput(calib_exec))
+                if (not geomready) and os.path.isfile(geomproducts['geom']):
+                    geomready = True
+                    if cache and (hgtfile is not None):
+                        geometry_cache.store(geomkey, geomproducts, geomcache)
+                
+                print('uavsar_radiocal_helper.py -- Geocoding file: '+mlcfile)
+                with profiling.stage('geocode', scenename, pol=polstr):
+                    if library:
+                        uavsar_lib.geocodefiles(geomproducts['trans'], [basefile+'_'+name+'.mlc'], [basefile+'_'+name+'.grd'],
+                                                int(mlc_rows), int(mlc_cols), int(grd_rows), int(grd_cols), nthreads=nthreads)
+                    else:
+                        print(profiling.getoutput(geocode_exec))
+            with profiling.stage('header', scenename, pol=polstr):
+                genHDRfromTXT(annfile, basefile+'_'+name+'.grd', polstr)
             
             if look:
+                os.rename(geomproducts['look'], basefile_nopol+'_look.grd')
                 genHDRfromTXT(annfile, basefile_nopol+'_look.grd', polstr)
                 look = False # no need to do this for more than one polarization
                 
             if slope:
+                os.rename(geomproducts['slope'], basefile_nopol+'_slope.grd')
                 genHDRfromTXT(annfile, basefile_nopol+'_slope.grd', polstr)
                 slope = False # no need to do this for more than one polarization
             
@@ -171,13 +246,19 @@ def runcal(annfile, name=None, caltbl=None, look=None, slope=None,
                 geocode_exec = uavsar_geocode_prog + ' '
                 geocode_exec += basefile_nopol+'_'+name+'_mask.mlc '
                 geocode_exec += str(mlc_cols) + ' '
-                geocode_exec += basefile+'_geomap.trans '
+                geocode_exec += geomproducts['trans']+' '
                 geocode_exec += basefile_nopol+'_'+name+'_mask.grd '
                 geocode_exec += str(grd_cols) + ' ' + str(grd_rows)
                 
                 print('uavsar_radiocal_helper.py -- Geocoding mask file for: '+mlcfile)
-                print(subprocess.getoutput(geocode_exec))
-                genHDRfromTXT(annfile, basefile_nopol+'_'+name+'_mask.grd', polstr)
+                with profiling.stage('geocode', scenename, pol='mask'):
+                    if library:
+                        uavsar_lib.geocodefiles(geomproducts['trans'], [basefile_nopol+'_'+name+'_mask.mlc'], [basefile_nopol+'_'+name+'_mask.grd'],
+                                                int(mlc_rows), int(mlc_cols), int(grd_rows), int(grd_cols), nthreads=nthreads)
+                    else:
+                        print(profiling.getoutput(geocode_exec))
+                with profiling.stage('header', scenename, pol='mask'):
+                    genHDRfromTXT(annfile, basefile_nopol+'_'+name+'_mask.grd', polstr)
                 mask = False # no need to do this for more than one polarization
             
             # Geocode difference file, if we created one.
@@ -185,17 +266,21 @@ def runcal(annfile, name=None, caltbl=None, look=None, slope=None,
                geocode_exec = uavsar_geocode_prog + ' '
                geocode_exec += basefile+'_'+name+'_diff.mlc '
                geocode_exec += str(mlc_cols) + ' '
-               geocode_exec += basefile+'_geomap.trans '
+               geocode_exec += geomproducts['trans']+' '
                geocode_exec += basefile+'_'+name+'_diff.grd '
                geocode_exec += str(grd_cols) + ' ' + str(grd_rows)
                print('uavsar_radiocal_helper.py -- Geocoding difference file for: '+mlcfile)
                print(geocode_exec)
-               print(subprocess.getoutput(geocode_exec))
-               genHDRfromTXT(annfile, basefile+'_'+name+'_diff.grd', polstr)
+               with profiling.stage('geocode', scenename, pol='diff'):
+                   print(profiling.getoutput(geocode_exec))
+               with profiling.stage('header', scenename, pol='diff'):
+                   genHDRfromTXT(annfile, basefile+'_'+name+'_diff.grd', polstr)
                
-            # Remove temporary geomap.trans file used for geocoding.
-            rm_temp = 'rm '+basefile+'_geomap.trans'
-            print(subprocess.getoutput(rm_temp))
+    # Remove temporary geometry and geomap.trans files used for geocoding.
+    if geomready:
+        for f in geomproducts.values():
+            if os.path.lexists(f):
+                os.remove(f)
             
     return
 
@@ -211,6 +296,7 @@ def main():
     parser.add_argument('-s', '--slope', action='store_true', help='Toggle to save slope angle file.')
     parser.add_argument('-m', '--mask', action='store_true', help='Toggle to save validity mask file.')
     parser.add_argument('-d', '--diff', action='store_true', help='Toggle to save difference file.')
+    parser.add_argument('--library', action='store_true', help='Toggle to calibrate and geocode in-process with the libuavsar shared library (built by the Makefile) instead of running uavsar_calib and uavsar_geocode for every polarization.')
     args = parser.parse_args()
     
     if args.input == None:
@@ -218,7 +304,7 @@ def main():
         os._exit(1)
     elif os.path.isfile(args.input):
         runcal(args.input, caltbl=args.cal, name=args.name, look=args.look,
-               slope=args.slope, mask=args.mask, diff=args.diff)
+               slope=args.slope, mask=args.mask, diff=args.diff, library=args.library)
     elif os.path.isdir(args.input):
         print('uavsar_radiocal_helper.py -- Input directory specified.  Batch processing all annotation files found in directory.')
         infiles = [file for file in os.listdir(args.input) if (file.endswith('.ann.txt') or file.endswith('.ann'))]
@@ -226,7 +312,7 @@ def main():
         for annfile in infiles:
             print('uavsar_radiocal_helper.py -- Processing "'+annfile+'"...')
             runcal(os.path.dirname(args.input)+'/'+annfile, caltbl=args.cal, name=args.name, look=args.look,
-                   slope=args.slope, mask=args.mask, diff=args.diff)
+                   slope=args.slope, mask=args.mask, diff=args.diff, library=args.library)
     else:
         print("uavsar_radiocal_helper.py -- Input UAVSAR annotation file or data path does not exist.  Aborting.")
         os._exit(1)
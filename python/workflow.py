@@ -0,0 +1,161 @@
+"""Task graph scheduler for running the radiometric calibration workflow.
+
+A workflow is made of tasks (a function and its arguments), each belonging
+to a stage (e.g., 'area', 'mask', 'lut', 'lutcorr', 'complex'), and each
+depending on any number of other tasks.  Usually the tasks for one scene
+depend on each other, but not on the tasks for other scenes, so that a
+scene can move on to its next stage as soon as its own previous stage is
+finished, without waiting for all of the other scenes.
+
+Tasks are run on a local process pool.  The number of tasks of each stage
+running at the same time can be limited separately (e.g., to limit the
+number of memory hungry calibration runs, while allowing more LUT creation
+tasks).  If a task fails, the tasks depending on it are skipped, and the
+other tasks continue.
+
+Example:
+
+    wf = workflow.Workflow()
+    for scene in scenes:
+        wf.add(scene+'_area', 'area', radiocal.batchcal, args=(...))
+        wf.add(scene+'_lut', 'lut', radiocal.createlut, args=(...),
+               deps=[scene+'_area'])
+    wf.run(workers=8, limits={'area': 4})
+"""
+
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+
+class Task(object):
+    """A function call to run as part of a Workflow.
+
+        Arguments:
+            name (str): Unique name of the task.
+            stage (str): Stage the task belongs to, used for the per-stage
+                concurrency limits.
+            func (function): Function to call.  Must be picklable (e.g., a
+                module level function).
+            args (tuple): Positional arguments for func.
+            kwargs (dict): Keyword arguments for func.
+            deps (list): Names of the tasks which must finish successfully
+                before this task can start.
+
+    """
+    def __init__(self, name, stage, func, args=(), kwargs=None, deps=()):
+        self.name = name
+        self.stage = stage
+        self.func = func
+        self.args = tuple(args)
+        self.kwargs = dict(kwargs) if kwargs is not None else {}
+        self.deps = list(deps)
+        self.status = 'pending'
+        self.error = None
+        self.result = None
+
+
+def _runtask(func, args, kwargs):
+    """Runs a task in a worker process, returning the traceback as a string
+    if it fails (so that it can be printed by the parent process)."""
+    try:
+        return (True, func(*args, **kwargs))
+    except Exception:
+        return (False, traceback.format_exc())
+
+
+class Workflow(object):
+    """Dependency graph of tasks, run on a local process pool."""
+
+    def __init__(self):
+        self.tasks = {}
+        self.order = []
+
+    def add(self, name, stage, func, args=(), kwargs=None, deps=()):
+        """Adds a task to the workflow.  See Task for the arguments.  The
+        dependencies must already have been added.  Returns the task name,
+        so that it can be used directly in the deps of later tasks."""
+        if name in self.tasks:
+            raise ValueError('workflow -- Task {} already exists.'.format(name))
+        for dep in deps:
+            if dep not in self.tasks:
+                raise ValueError('workflow -- Task {} depends on unknown task {}.'.format(name, dep))
+        self.tasks[name] = Task(name, stage, func, args, kwargs, deps)
+        self.order.append(name)
+        return name
+
+    def _skip(self, name):
+        """Marks the pending tasks depending (directly or indirectly) on a
+        failed task as skipped."""
+        for other in self.order:
+            task = self.tasks[other]
+            if (task.status == 'pending') and (name in task.deps):
+                task.status = 'skipped'
+                print('workflow -- Skipping '+other+' (depends on '+name+').')
+                self._skip(other)
+
+    def run(self, workers=4, limits=None):
+        """Runs the workflow, and waits until all tasks are finished.
+
+            Arguments:
+                workers (int): Number of worker processes.
+                limits (dict): Maximum number of running tasks for each
+                    stage, keyed by stage name.  Stages not listed here are
+                    only limited by the number of workers.
+
+            Returns:
+                status (dict): Final status of each task ('done', 'failed',
+                    or 'skipped'), keyed by task name.
+
+        """
+        if limits is None:
+            limits = {}
+
+        running = {}
+        stagecount = {}
+        starttime = time.time()
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            while True:
+                # Start every task whose dependencies are done, in the order
+                # the tasks were added, as long as its stage has room:
+                for name in self.order:
+                    task = self.tasks[name]
+                    if task.status != 'pending' or len(running) >= workers:
+                        continue
+                    if not all(self.tasks[dep].status == 'done' for dep in task.deps):
+                        continue
+                    if stagecount.get(task.stage, 0) >= limits.get(task.stage, workers):
+                        continue
+                    print('workflow -- Starting '+name+' ('+task.stage+').')
+                    task.status = 'running'
+                    stagecount[task.stage] = stagecount.get(task.stage, 0) + 1
+                    running[pool.submit(_runtask, task.func, task.args, task.kwargs)] = name
+
+                if len(running) == 0:
+                    break
+
+                finished, notfinished = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    task = self.tasks[running.pop(future)]
+                    stagecount[task.stage] -= 1
+                    try:
+                        ok, result = future.result()
+                    except Exception: # e.g., the worker process was killed
+                        ok, result = False, traceback.format_exc()
+
+                    if ok:
+                        task.status = 'done'
+                        task.result = result
+                        print('workflow -- Finished '+task.name+'.')
+                    else:
+                        task.status = 'failed'
+                        task.error = result
+                        print('workflow -- Task '+task.name+' failed:\n'+result)
+                        self._skip(task.name)
+
+        status = {name: self.tasks[name].status for name in self.order}
+        print('workflow -- Finished in {:.1f} s: {} done, {} failed, {} skipped.'.format(
+              time.time()-starttime, list(status.values()).count('done'),
+              list(status.values()).count('failed'), list(status.values()).count('skipped')))
+        return status
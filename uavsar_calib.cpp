@@ -7,14 +7,25 @@
 #include <time.h>
 #include <float.h>
 #include <cstring>
+#include <thread>
+#include <algorithm>
+#include <list>
+#include <cstdlib>
 #include "optionparser.h"
 #include "load_ann.h"
+#include "bilinear.h"
+#include "uavsar_core.h"
 
 using namespace std;
 
 extern char *optarg;
 extern int optopt;
 
+//Default limit (in GB) of the memory used by -q to keep the calibrated
+//images, which can be changed with the UAVSAR_CALIB_GEOCODE_MAXGB
+//environment variable.
+const double GEOCODE_MAXGB = 8;
+
 
 string SplitFilename (const string& str)
 {
@@ -32,6 +43,64 @@ string SplitFilename (const string& str)
 }
 
 
+//Filename for one covariance matrix term, given a filename containing COV
+//(the last COV is replaced by the term, e.g., HHHV).  Returns an empty
+//string if the filename does not contain COV.
+string CovFilename (const string& name, const string& term)
+{
+    size_t found = name.rfind("COV");
+    if (found == string::npos)
+        return "";
+    return name.substr(0,found) + term + name.substr(found+3);
+}
+
+//Number of DEM lines per worker thread in each block of the facet model
+//loop.
+const long FACET_BLOCK_LINES = 16;
+
+//Spacing (in m) of the DEM columns projected to find the part of each DEM
+//line that can map into the RDC image (see column_span in main).  Over this
+//distance, the projection deviates from a straight line by much less than
+//an RDC pixel.
+const double FOOTPRINT_SAMPLE_SPACING = 100.0;
+
+//Facet model results for one DEM pixel, computed by the worker threads
+//before they are added to the RDC geometry.
+struct facet_struct {
+    float ranpix, azpix; //RDC coordinates
+    bool valid; //true if the pixel lies in the valid RDC range
+    double area, inc, look, slope, antcor; //area, local incidence, look angle, range slope, and antenna pattern
+};
+
+//Adds the contribution of a facet at distance dist to one RDC pixel.
+inline void add_facet(const facet_struct &f, float dist, rdc_geom &g)
+{
+    g.area += f.area/dist;
+    g.theta += f.inc/dist;
+    g.wgt += 1.0f/dist;
+    g.look += f.look/dist;
+    g.slope += f.slope/dist;
+    g.antcor += f.antcor/dist;
+}
+
+//Size of the buffers of the input image files, which are read one line at
+//a time, so that they are read with fewer, larger system calls (which
+//matters most on network file systems).  The outputs are written in blocks
+//of lines instead, since ofstream passes writes larger than 1 kB straight
+//through to the system.
+const long IO_BUFFER_SIZE = 1 << 20;
+
+//Opens a binary file with a buffer of IO_BUFFER_SIZE bytes instead of the
+//default (a few kB).  The buffer is added to buffers, which must not be
+//destroyed before the file is closed.
+template <class Stream>
+void open_buffered(Stream &file, const string &name, ios::openmode mode, list<vector<char> > &buffers)
+{
+    buffers.push_back(vector<char>(IO_BUFFER_SIZE));
+    file.rdbuf()->pubsetbuf(&buffers.back()[0], IO_BUFFER_SIZE);
+    file.open(name.c_str(), mode | ios::binary);
+}
+
 struct Arg: public option::Arg
 {
     static void printError(const char* msg1, const option::Option& opt, const char* msg2)
@@ -75,15 +144,26 @@ struct Arg: public option::Arg
         if (msg) printError("Option '", option, "' requires a numeric argument\n");
         return option::ARG_ILLEGAL;
     }
+    
+    static option::ArgStatus Real(const option::Option& option, bool msg)
+    {
+        char* endptr = 0;
+        if (option.arg != 0 && strtod(option.arg, &endptr)){};
+        if (endptr != option.arg && *endptr == 0)
+            return option::ARG_OK;
+        
+        if (msg) printError("Option '", option, "' requires a real number argument\n");
+        return option::ARG_ILLEGAL;
+    }
 };
 
 
-enum  optionIndex { UNKNOWN, HELP, OUT, CORR, AREA, TRANSIN, TRANSOUT, SIM, LOOK, SLOPE, MASK, RATIO };
+enum  optionIndex { UNKNOWN, HELP, OUT, CORR, AREA, TRANSIN, TRANSOUT, SIM, LOOK, SLOPE, MASK, RATIO, GEOMOUT, GEOMIN, GEOCODE, THREADS, HEIGHT };
 const option::Descriptor usage[] =
 {
-    {UNKNOWN, 0, "", "",Arg::None, "Usage: uavsar_calib [-c vegetation_lut] [-a output_area] [-t trans_in] [-u trans_out] [-i local_incidence_out] [-l look_angle_out] [-s slope_angle_out] [-m mask_out] <ann file> <pol> <output intensity image>\n\n"
+    {UNKNOWN, 0, "", "",Arg::None, "Usage: uavsar_calib [-c vegetation_lut] [-a output_area] [-t trans_in] [-u trans_out] [-i local_incidence_out] [-l look_angle_out] [-s slope_angle_out] [-m mask_out] [-g geometry_out] [-G geometry_in] [-q geocoded_out] [-n threads] [-e height] <ann file> <pol> <output intensity image>\n\n"
         "Required Arguments:" },
-    {UNKNOWN, 0, "", "",Arg::None, "  <ann file>\tAnnotation file.\n  <pol>\t4-letter polarization string (HHHH, HVHV, or VVVV).\n  <output file>\tDestination filename for radiometrically calibrated intensity image.\n\n"
+    {UNKNOWN, 0, "", "",Arg::None, "  <ann file>\tAnnotation file.\n  <pol>\t4-letter polarization string (HHHH, HVHV, or VVVV), or COV to calibrate all six covariance matrix terms (HHHH, HVHV, VVVV, HHHV, HHVV, and HVVV) in one run.  The off-diagonal terms are calibrated with the geometric mean of the correction ratios of their two diagonal terms.  With COV, the output filenames (and the -q filename) must contain COV, which is replaced by each term, and -c gives the root of the LUT filenames (<root>_HH.flt, <root>_HV.flt, and <root>_VV.flt).\n  <output file>\tDestination filename for radiometrically calibrated intensity image.  If -q is given, this can be - to only save the geocoded image.\n\n"
         "Optional Arguments:" },
     {HELP, 0,"h", "help",Arg::None,"  -h  \tPrint usage and exit." },
     {OUT, 0,"o", "out",Arg::Required, "  -o <output file>  \tOptional flag to save corrected intensity image." },
@@ -96,6 +176,11 @@ const option::Descriptor usage[] =
     {SLOPE, 0,"s","slope",Arg::Required, "  -s <slope file>  \tOptional flag to save output range-facing terrain slope angle map." },
     {MASK, 0, "m", "mask",Arg::Required, "  -m <mask file>  \tOptional flag to create a validity mask file which shows pixels where the radiometric calibration could not be performed.  Only valid for vegetation LUT correction using the -c option." },
     {RATIO, 0, "r", "ratio",Arg::Required, "  -r <ratio file>  \tOptional flag to create a ratio file which contains the ratio between the calibrated and uncalibrated images." },
+    {GEOMOUT, 0, "g", "gout",Arg::Required, "  -g <geometry file>  \tOptional flag to save the facet model geometry (area, local incidence, look, range slope, and antenna pattern in RDC coordinates) so that other polarizations can be calibrated without repeating the DEM facet decomposition." },
+    {GEOMIN, 0, "G", "gin",Arg::Required, "  -G <geometry file>  \tOptional flag to load facet model geometry previously saved with -g, instead of decomposing the DEM.  Cannot be combined with -u, -i, -l, or -s, since those are produced by the DEM facet decomposition.  If -t is given, it is only used for geocoding with -q." },
+    {GEOCODE, 0, "q", "geocode",Arg::Required, "  -q <geocoded file>  \tOptional flag to geocode the calibrated intensity image in the same run, using the transformation look up table given with -u or -t, and save it (with the same dimensions as the DEM).  This gives the same result as running uavsar_geocode on the output intensity image.  The calibrated images are kept in memory for the whole scene: 4 bytes per MLC pixel for each intensity term, and 8 for each complex term (36 with COV).  -q is refused if this exceeds 8 GB, or the limit (in GB) given by the UAVSAR_CALIB_GEOCODE_MAXGB environment variable; run uavsar_geocode on the output instead." },
+    {THREADS, 0, "n", "threads",Arg::Numeric, "  -n <threads>  \tOptional flag to set the number of worker threads for the DEM facet decomposition and the correction (default: 1).  The results do not depend on the number of threads." },
+    {HEIGHT, 0, "e", "height",Arg::Real, "  -e <height>  \tOptional flag to use a flat DEM of constant height (in m above the ellipsoid) instead of the DEM file named in the annotation file, which is then not needed.  The DEM dimensions and posting are still taken from the annotation file." },
     {UNKNOWN, 0, "", "",Arg::None, "\nExample Usage:\n"
         "  uavsar_calib -c caltbl_NewHampshire_WhiteMountain_HH.flt -u geomap.trans Brtlet_07101_09061_001_090814_L090_CX_01.ann HHHH Brtlet_HHHH_Cal.mlc "},
     {0,0,0,0,0,0}
@@ -119,27 +204,30 @@ int main(int argc, char* argv[]){
     }
     
 
-    int iter, max_iter = 30, ix1, ix2, iy1, iy2, area_flag = 0, LUTin_flag = 0, LUTout_flag = 0, sim_flag = 0, correct_flag = 0, look_flag = 0, slope_flag = 0, mask_flag = 0, ratio_flag = 0,
-      error_flag = 0, poly_method, cos_flag = 0,pol=5,e_look,e_slope,size;
+    int iter, max_iter = 30, ix1, ix2, iy1, iy2, area_flag = 0, geomout_flag = 0, geomin_flag = 0, geocode_flag = 0, rdcout_flag = 0, LUTin_flag = 0, LUTout_flag = 0, sim_flag = 0, correct_flag = 0, look_flag = 0, slope_flag = 0, mask_flag = 0, ratio_flag = 0,
+      cov_flag = 0, ndiag = 1, nterms = 1, nthreads = 1, flat_flag = 0, error_flag = 0, poly_method, cos_flag = 0,pol=5,e_look,e_slope,size;
 
     float Z1, Z2, Z3, Z4, Z5, Z6, Z7, Z8, Z9, Zavg, azpix, ranpix, p, q, deltaDEM_lat, deltaDEM_lon, xbound, ybound, x1, x2, y1, y2, cs, ss, tempout, h, r_area_fe, dist, fx1, fy1;
     
-    float min_correction_ratio = 0.001, max_correction_ratio = 1000.0, void_correction_val = -1.0;
+    float flat_hgt = 0.0;
         
     double ta, tcen, satdist, earth_radius, sat_alt, vsat, velx, alpha, i_cur, j_cur, lat, lon, lvm,  
       slope, aspect, area, area_ref, temp, inc_cor, inc_tol, inc_ltol,slt_range, r_x1, r_x2, slope_r, slope_a, r_l3, slope_actual_r, slope_actual_a, r_look, theta_c, antcor;
 
-    XYZ satxyz, satuvw, Xpix, lkv, SCH, SCH2, temp_raU, nI, nE, look_sch, nL;
+    XYZ satxyz, satuvw, Xpix, lkv, SCH, SCH2, nI, nE, look_sch, nL;
+
+    peg_transform peg_tf;
 
     par_struct par;
     peg_struct peg;
 
     vector<float> LUTcpx(2,0);
 
-    string area_out, LUT_flout, LUT_flin, sim_name, name_orbit, veg_in, look_name, slope_name, mask_name, diff_name;
+    string area_out, LUT_flout, LUT_flin, sim_name, name_orbit, veg_in, look_name, slope_name, mask_name, diff_name, geom_out, geom_in, geocode_name;
 
-    ifstream LUTin, VegTablefile;
-    ofstream LUTout, areaRDCout, ampout, sim_flout, look_out, slope_out, mask_out, ratio_out;
+    list<vector<char> > io_buffers; //buffers of the input files (see open_buffered)
+    ifstream LUTin, VegTablefile[3], geomin, ampfile[6];
+    ofstream LUTout, areaRDCout, geomout, ampout[6], sim_flout, look_out, slope_out, mask_out, ratio_out;
 
     char *temp_char = NULL;
     
@@ -169,6 +257,13 @@ int main(int argc, char* argv[]){
         cout <<"Calibrating for polarization VVVV"<<endl;
         pol = 3;
       }
+
+      if (!strcmp(argv[argc-2],"COV")) {
+        cout <<"Calibrating all covariance matrix terms"<<endl;
+        cov_flag = 1;
+        ndiag = 3;
+        nterms = 6;
+      }
         
       //Filename for correct intensity image.
       correct_flag = 1;
@@ -217,7 +312,26 @@ int main(int argc, char* argv[]){
               case RATIO:
                   ratio_flag = 1;
                   diff_name = opt.arg;
-                  break;            
+                  break;
+              case GEOMOUT:
+                  geomout_flag = 1;
+                  geom_out = opt.arg;
+                  break;
+              case GEOMIN:
+                  geomin_flag = 1;
+                  geom_in = opt.arg;
+                  break;
+              case GEOCODE:
+                  geocode_flag = 1;
+                  geocode_name = opt.arg;
+                  break;
+              case THREADS:
+                  nthreads = atoi(opt.arg);
+                  break;
+              case HEIGHT:
+                  flat_flag = 1;
+                  flat_hgt = atof(opt.arg);
+                  break;
           }
       }
         
@@ -228,6 +342,41 @@ int main(int argc, char* argv[]){
       return 0;
     }
 
+    if (geomin_flag && (LUTout_flag || sim_flag || look_flag || slope_flag)){
+      cout << "Error: -G cannot be combined with -u, -i, -l, or -s\n";
+      exit(1);
+    }
+
+    if (nthreads < 1){
+      cout << "Error: the number of threads (-n) must be at least 1\n";
+      exit(1);
+    }
+
+    if (geocode_flag && !(LUTin_flag || LUTout_flag)){
+      cout << "Error: -q requires a transformation look up table (-t or -u)\n";
+      exit(1);
+    }
+
+    //The calibrated image in RDC coordinates is not saved if it is only
+    //needed for geocoding.
+    rdcout_flag = !(geocode_flag && par.cor_out == "-");
+
+    if (cov_flag && ratio_flag){
+      cout << "Error: -r cannot be combined with COV\n";
+      exit(1);
+    }
+
+    if (cov_flag && ((rdcout_flag && par.cor_out.rfind("COV") == string::npos) || (geocode_flag && geocode_name.rfind("COV") == string::npos))){
+      cout << "Error: with COV, the output filenames must contain COV, which is replaced by the name of each covariance matrix term\n";
+      exit(1);
+    }
+
+    //Names of the terms to calibrate: the diagonal terms first.
+    vector<string> terms(nterms, par.pol);
+    if (cov_flag)
+      for (int t = 0; t < nterms; ++t)
+        terms[t] = COV_TERMS[t];
+
     cout << "\nUAVSAR radiometric calibration software designed and written by Marc Simard and Bryan V. Riel.\n\n";
     cout << "\nCopyright 2010, by the California Institute of Technology. ALL RIGHTS RESERVED. \n";
     cout << "\nUnited States Government Sponsorship acknowledged. \n";
@@ -244,29 +393,69 @@ int main(int argc, char* argv[]){
     load_ann(par, peg);
     xbound = (float)par.width-1; //Bounds for valid RDC coordinates
     ybound = (float)par.height-1;
+
+    if (geocode_flag){
+      const char *maxgb_env = getenv("UAVSAR_CALIB_GEOCODE_MAXGB");
+      double maxgb = maxgb_env ? atof(maxgb_env) : GEOCODE_MAXGB;
+      double geocode_gb = 4.0*(2*nterms-ndiag)*par.height*par.width/1e9;
+      if (geocode_gb > maxgb){
+        cout << "Error: -q would keep " << geocode_gb << " GB of calibrated images in memory, more than the limit of " << maxgb << " GB (set with UAVSAR_CALIB_GEOCODE_MAXGB).  Run uavsar_geocode on the output instead\n";
+        exit(1);
+      }
+    }
     
     // Get path to annotation file.  Assume MLC, HGT, etc. files are in same folder as ANN.
     string path = SplitFilename(par.ann.c_str());
 
     //Create input and output file identifiers
-    string mlcfile = path + par.mlc;
     string hgtfile = path + par.dem;
     
-    ifstream ampfile(mlcfile.c_str(), ios::in | ios::binary);
-    if (!ampfile.is_open()){
-      cout << "Error opening input intensity file " << mlcfile << "\n";
-        exit(1);
-          }
-    else
-      cout << "Opened input intensity file: " << mlcfile << endl;
+    for (int t = 0; t < nterms; ++t){
+      string mlcfile = path + (cov_flag ? par.mlc_cov[t] : par.mlc);
+      open_buffered(ampfile[t], mlcfile, ios::in, io_buffers);
+      if (!ampfile[t].is_open()){
+        cout << "Error opening input intensity file " << mlcfile << "\n";
+          exit(1);
+            }
+      else
+        cout << "Opened input intensity file: " << mlcfile << endl;
+    }
     
-    ifstream DEMfile(hgtfile.c_str(), ios::in | ios::binary);
-    if (!DEMfile.is_open()){
-      cout << "Error opening DEM file " << hgtfile << "\n";
-        exit(1);
-          }
-    else
-      cout << "Opened DEM file: " << hgtfile << endl;
+    ifstream DEMfile;
+    if (geomin_flag){
+      geomin.open(geom_in.c_str(), ios::in | ios::binary);
+      if (!geomin.is_open()){
+        cout << "Error opening input geometry file " << geom_in << "\n";
+          exit(1);
+        }
+      geomin.seekg(0, ios::end);
+      if ((long)geomin.tellg() != (long)(5*sizeof(float)*par.width*par.height)){
+        cout << "Error: input geometry file " << geom_in << " does not match the MLC dimensions\n";
+          exit(1);
+        }
+      geomin.seekg(0, ios::beg);
+      cout << "Opened input geometry file: " << geom_in << endl;
+    }
+    else if (flat_flag)
+      cout << "Using a flat DEM of height " << flat_hgt << " m" << endl;
+    else {
+      open_buffered(DEMfile, hgtfile, ios::in, io_buffers);
+      if (!DEMfile.is_open()){
+        cout << "Error opening DEM file " << hgtfile << "\n";
+          exit(1);
+            }
+      else
+        cout << "Opened DEM file: " << hgtfile << endl;
+    }
+    if (geomout_flag){
+      geomout.open(geom_out.c_str(), ios::out | ios::binary);
+      if (!geomout.is_open()){
+        cout << "Error creating output geometry file " << geom_out << "\n";
+          exit(1);
+        }
+      else
+        cout << "Created output geometry file: " << geom_out << endl;
+    }
     
     if (area_flag){
       areaRDCout.open(area_out.c_str(), ios::out | ios::binary);
@@ -278,7 +467,7 @@ int main(int argc, char* argv[]){
         cout << "Created output area file: " << area_out << endl;
     }
     if (LUTin_flag){
-      LUTin.open(LUT_flin.c_str(), ios::in | ios::binary);
+      open_buffered(LUTin, LUT_flin, ios::in, io_buffers);
       if (!LUTin.is_open()){
         cout << "Error opening input look up table " << LUT_flin << "\n";
           exit(1);
@@ -304,23 +493,29 @@ int main(int argc, char* argv[]){
       else
         cout << "Created output simulated SAR image: " << sim_name << endl;
     }
-    if (correct_flag){
-      ampout.open(par.cor_out.c_str(), ios::out | ios::binary);
-      if (!ampout.is_open()){
-        cout << "Error creating output corrected intensity file " << par.cor_out << "\n";
-          exit(1);
-        }
-      else
-        cout << "Created output corrected intensity file: " << par.cor_out << endl;
+    if (correct_flag && rdcout_flag){
+      for (int t = 0; t < nterms; ++t){
+        string cor_name = cov_flag ? CovFilename(par.cor_out, terms[t]) : par.cor_out;
+        ampout[t].open(cor_name.c_str(), ios::out | ios::binary);
+        if (!ampout[t].is_open()){
+          cout << "Error creating output corrected intensity file " << cor_name << "\n";
+            exit(1);
+          }
+        else
+          cout << "Created output corrected intensity file: " << cor_name << endl;
+      }
     }
     if (cos_flag) {
-      VegTablefile.open(veg_in.c_str(), ios::in | ios::binary);
-      if (!VegTablefile.is_open()){
-        cout << "Error opening input Vegetation Correction file " << veg_in << "\n";
-        exit(1);
+      for (int k = 0; k < ndiag; ++k){
+        string veg_name = cov_flag ? veg_in + "_" + terms[k].substr(0,2) + ".flt" : veg_in;
+        VegTablefile[k].open(veg_name.c_str(), ios::in | ios::binary);
+        if (!VegTablefile[k].is_open()){
+          cout << "Error opening input Vegetation Correction file " << veg_name << "\n";
+          exit(1);
+        }
+        else
+          cout << "Opened input Vegetation Correction file: " << veg_name << endl;
       }
-      else
-        cout << "Opened input Vegetation Correction file: " << veg_in << endl;
     }
     if (look_flag){
         look_out.open(look_name.c_str(), ios::out | ios::binary);
@@ -364,29 +559,43 @@ int main(int argc, char* argv[]){
     vector<float> zero_vec(par.widthDEM,0), simsar(par.widthDEM,0), gc1(par.widthDEM,0), gc2(par.widthDEM,0);
     vector<float> look_array(par.widthDEM,0), slope_array(par.widthDEM,0);
     vector<complex<float> > gc(par.widthDEM,0), gc_out(par.widthDEM,0), zero_vec_cpx(par.widthDEM,0);
-    vector<vector<float> > DEM_buf_float(3,vector<float>(par.widthDEM,0));
-    vector<vector<float> > VegTable( 900, vector<float> (900,0.0001) );
+    vector<vector<float> > VegTables(ndiag, vector<float>(VEG_TABLE_SIZE*VEG_TABLE_SIZE,0.0001));
 
     //Create buffer vectors for JPL areas in RDC coordinates
     vector<float> area_fe_vec(par.width,0), diff_area_fe_vec(par.width,0);
         
-    //Create 2-D vector-vectors for area and local incidence angle estimates in RDC coordinates
-    vector<vector<float> > areaRDC(par.height,vector<float>(par.width,0)), theta_l(par.height,vector<float>(par.width,0)), 
-      count(par.height,vector<float>(par.width,0)), sum_wgt(par.height,vector<float>(par.width,0)),
-      r_looks(par.height,vector<float>(par.width,0)),all_slope_actual_r(par.height,vector<float>(par.width,0)), antcors(par.height,vector<float>(par.width,0));
+    //Facet model geometry in RDC coordinates (row major).  With -G, it is
+    //instead read from the geometry file one block of lines at a time during
+    //the correction.  Otherwise it holds six floats (24 bytes) per RDC pixel
+    //of the whole scene, since the facets of any DEM line can add to any RDC
+    //line, and this is most of the memory used by the facet decomposition.
+    vector<rdc_geom> geom(geomin_flag ? 0 : (long)par.height*par.width, rdc_geom());
+    vector<float> geom_lines_buf(CORRECTION_BLOCK_LINES*par.width,0);
+
+    //Calibrated images kept in memory for geocoding (-q): one plane for
+    //each diagonal term, and two (real and imaginary parts) for each
+    //off-diagonal term.
+    vector<vector<float> > cor_rdc(geocode_flag ? 2*nterms-ndiag : 0, vector<float>((long)par.height*par.width,0));
 
 
     // --------------------   Main code: decompose DEM into facets, compute RDC coordinates, and area/local_inc in RDC  --------------------------
 
     //Estimate parameters at peg point
-    peg.pos = llh2ecef(peg.lat, peg.lon, 0.0f);
-    peg.re = WGS84_A/sqrt(1.0-WGS84_E2*sin(peg.lat)*sin(peg.lat));
-    peg.rn = WGS84_A*(1.0-WGS84_E2)/sqrt(POW3(1.0-WGS84_E2*sin(peg.lat)*sin(peg.lat)));
-    peg.ra = peg.re*peg.rn/(peg.re*cos(peg.heading)*cos(peg.heading) + peg.rn*sin(peg.heading)*sin(peg.heading)); //Radius of approximating sphere at peg
-    temp_raU.x = 0; temp_raU.y = 0; temp_raU.z = peg.ra;
-    peg.raU = ECEF_transform(temp_raU, peg.lat, peg.lon);
+    init_peg(peg);
     r_x1 = peg.ra + par.gavgalt;
     r_x2 = peg.ra + par.gavgterhgt;
+    peg_tf = make_peg_transform(peg);
+
+    //Trigonometric terms of the platform attitude, and of the longitude of
+    //each DEM column, for the facet loop
+    const double sESA = sin(par.ESA), cESA = cos(par.ESA), spitch = sin(par.pitch), cpitch = cos(par.pitch),
+        syaw = sin(par.yaw), cyaw = cos(par.yaw);
+    vector<double> clon_DEM(par.widthDEM), slon_DEM(par.widthDEM);
+    for (long jj = 0; jj < par.widthDEM; ++jj){
+        lon = par.corner_lon + (double)jj*par.spc_lon;
+        clon_DEM[jj] = cos(lon);
+        slon_DEM[jj] = sin(lon);
+    }
     
     //Estimate parameters and DEM spacing (in SCH sense) at image center
     lat = par.corner_lat - 0.5*par.heightDEM*par.spc_lat;
@@ -403,252 +612,432 @@ int main(int argc, char* argv[]){
 
 
 
-    //Enter loop to read or compute transformation LUT and area
-    cout << "\n";
-    i_cur = 0.0;
-    for (long ii = 0; ii < par.heightDEM; ++ii){
+    if (geomin_flag){
+        //Facet model geometry computed by a previous run (see -g)
+        cout << "\nUsing facet model geometry from " << geom_in << endl;
+    }
+    else {
+        //Enter loop to read or compute transformation LUT and area.  The DEM
+        //is processed in blocks of lines: the facets of a block are computed
+        //by the worker threads (each for a part of the lines), and then added
+        //to the RDC geometry by the worker threads (each for a band of RDC
+        //lines, adding the facets in DEM order, so that the sums do not
+        //depend on the number of threads).
+        cout << "\n";
+        long block_lines = FACET_BLOCK_LINES*nthreads, ii0 = 0, nrows = 0;
+        vector<vector<facet_struct> > facets(block_lines, vector<facet_struct>(par.widthDEM));
+        vector<int> iy_min(block_lines), iy_max(block_lines); //RDC lines reached by the facets of each DEM line
+        vector<vector<float> > DEM_buf_float(block_lines+2, vector<float>(par.widthDEM,flat_hgt)); //DEM lines ii0-1 to ii0+nrows
+
+        //With a flat DEM (-e), every facet has zero slope (p = q = 0 below, so
+        //that the aspect is 0)
+        const double flat_slope_r = tan(0.0)*cos(0.0 - peg.heading - PI_HALF), flat_slope_a = tan(0.0)*cos(0.0 - peg.heading),
+            flat_slope_actual_r = atan(flat_slope_r);
+        vector<vector<complex<float> > > gc_buf(LUTin_flag ? block_lines : 0, vector<complex<float> >(par.widthDEM,0));
+        //Per-pixel outputs of the block in DEM coordinates, written with one call each
+        vector<complex<float> > gc_block(LUTout_flag ? block_lines*par.widthDEM : 0);
+        vector<float> look_block(look_flag ? block_lines*par.widthDEM : 0), slope_block(slope_flag ? block_lines*par.widthDEM : 0), sim_block(sim_flag ? block_lines*par.widthDEM : 0);
+
+        //The DEM usually extends well beyond the radar swath.  Unless the RDC
+        //coordinates of every DEM pixel are needed (for the transformation
+        //LUT), the facets are only computed for the columns of each line
+        //which can map into the RDC image.
+        bool cull_flag = !LUTin_flag && !LUTout_flag;
+
+        //Finds the columns j_lo to j_hi of a DEM line (with latitude terms lt
+        //and heights Z) which can map into the RDC image.  The line is split
+        //into intervals of about FOOTPRINT_SAMPLE_SPACING, and the columns
+        //between the intervals are projected at the lowest and highest height
+        //of the intervals next to them.  Since the projection is close to
+        //linear within an interval, and monotonic in the height, the columns
+        //of an interval map to within these projections (plus a pixel) of
+        //its end columns.  The side of the track is not checked, which only
+        //widens the span.
+        long span_step = 1;
+        if (deltaDEM_lon > 0)
+            span_step = max(1L, (long)min(FOOTPRINT_SAMPLE_SPACING/deltaDEM_lon, (double)par.widthDEM));
+        auto column_span = [&](const lat_terms &lt, const vector<float> &Z, long &j_lo, long &j_hi){
+            vector<long> cols;
+            for (long jj = 0; jj < par.widthDEM-1; jj += span_step)
+                cols.push_back(jj);
+            cols.push_back(par.widthDEM-1);
+            long n = cols.size();
+
+            //Height range of each interval, without bad DEM data points (which are never valid)
+            vector<float> zmin(n, FLT_MAX), zmax(n, -FLT_MAX);
+            for (long k = 0; k+1 < n; ++k)
+                for (long jj = cols[k]; jj <= cols[k+1]; ++jj){
+                    if (Z[jj] < -1000)
+                        continue;
+                    if (!(Z[jj] <= FLT_MAX)) //NaN or infinite height: keep the whole line
+                        return;
+                    zmin[k] = min(zmin[k], Z[jj]);
+                    zmax[k] = max(zmax[k], Z[jj]);
+                }
 
-        if (ii % 1000 == 0)
-            cout << "Processed line " << ii << " of " << par.heightDEM << "\r" << flush;
+            //Range of RDC coordinates of each end column, over the heights of
+            //the intervals before and after it
+            vector<float> rmin(n, FLT_MAX), rmax(n, -FLT_MAX), amin(n, FLT_MAX), amax(n, -FLT_MAX);
+            for (long k = 0; k < n; ++k){
+                float hmin = min(zmin[k], k > 0 ? zmin[k-1] : FLT_MAX), hmax = max(zmax[k], k > 0 ? zmax[k-1] : -FLT_MAX);
+                if (hmin > hmax)
+                    continue;
+                for (int e = 0; e < 2; ++e){
+                    double h = e ? hmax : hmin, slt_range;
+                    XYZ SCH = llh2sch(peg_tf, lt, clon_DEM[cols[k]], slon_DEM[cols[k]], h);
+                    float azpix, ranpix;
+                    azpix = (SCH.x-par.so)/par.delta_az;
+                    slt_range = sqrt( POW2(peg.ra+h) + POW2(peg.ra+par.gavgalt) - 2.0*(peg.ra+h) * (peg.ra+par.gavgalt) * cos(SCH.y/peg.ra));
+                    ranpix = (slt_range-par.Ro)/par.delta_R;
+                    if (!(fabs(ranpix) <= FLT_MAX && fabs(azpix) <= FLT_MAX)) //Projection failed: keep the whole line
+                        return;
+                    rmin[k] = min(rmin[k], ranpix);
+                    rmax[k] = max(rmax[k], ranpix);
+                    amin[k] = min(amin[k], azpix);
+                    amax[k] = max(amax[k], azpix);
+                }
+            }
 
-        //If input LUT is provided, read values (cpx format/BIP)
-        if (LUTin_flag)
-            LUTin.read((char *) &gc[0], sizeof(float)*2*par.widthDEM);
-                
-        //Load 3-line input DEM buffer
-        if (ii == 0 || ii == (par.heightDEM-1)){ //Check bounds
-            if (sim_flag)
-                sim_flout.write((char *) &zero_vec[0], sizeof(float)*par.widthDEM);
-            if (LUTout_flag)
-                LUTout.write((char *) &zero_vec_cpx[0], sizeof(float)*2*(par.widthDEM));
-            if (look_flag)
-                look_out.write((char *) &zero_vec[0], sizeof(float)*par.widthDEM);
-            if (slope_flag)
-                slope_out.write((char *) &zero_vec[0], sizeof(float)*par.widthDEM);
-            // if (ratio_flag)
-            //  ratio_out.write((char *) &zero_vec[0], sizeof(float)*par.widthDEM);
+            j_lo = par.widthDEM;
+            j_hi = -1;
+            for (long k = 0; k+1 < n; ++k){
+                if (zmin[k] > zmax[k]) //No valid DEM points
+                    continue;
+                if (max(rmax[k], rmax[k+1]) >= -1.0f && min(rmin[k], rmin[k+1]) <= xbound+1.0f &&
+                    max(amax[k], amax[k+1]) >= -1.0f && min(amin[k], amin[k+1]) <= ybound+1.0f){
+                    j_lo = min(j_lo, cols[k]);
+                    j_hi = max(j_hi, cols[k+1]);
+                }
+            }
+        };
+
+        //Computes the facets of lines r0 to r1-1 of the block
+        auto compute_facets = [&](long r0, long r1){
+            float Z1, Z2, Z3, Z4, Z5, Z6, Z7, Z8, Z9, azpix, ranpix, p, q, x2, y2;
+            double slt_range, slope, tan_slope, aspect, temp, r_x2, r_l3, slope_r, slope_a, slope_actual_r, r_look, c_look, s_look;
+            XYZ SCH, nE, nL, nI;
+            lat_terms lt;
+
+            for (long r = r0; r < r1; ++r){
+                long ii = ii0 + r;
+                vector<facet_struct> &facet = facets[r];
+                iy_min[r] = par.height;
+                iy_max[r] = -1;
+
+                if (ii == 0 || ii == (par.heightDEM-1)){ //Check bounds
+                    for (long jj = 0; jj < par.widthDEM; ++jj){
+                        facet[jj].ranpix = 0.0f;
+                        facet[jj].azpix = 0.0f;
+                        facet[jj].valid = false;
+                    }
+                    continue;
+                }
 
-            i_cur += 1.0;
-            continue;
-        }
-        else {
-            DEMfile.seekg(sizeof(float)*(par.widthDEM*(ii-1)), ios::beg);
-            for (short i = 0; i < 3; ++i)
-                    DEMfile.read((char *) &DEM_buf_float[i][0], sizeof(float)*par.widthDEM);
-        }
-                
-        lat = par.corner_lat - i_cur*par.spc_lat;
-        j_cur = 0.0;
+                lt = make_lat_terms(par.corner_lat - (double)ii*par.spc_lat);
 
+                //Columns outside the swath (only found if the RDC coordinates are not written out)
+                long j_lo = 1, j_hi = par.widthDEM-2;
+                if (cull_flag)
+                    column_span(lt, DEM_buf_float[r+1], j_lo, j_hi);
 
-        for (long jj = 0; jj < par.widthDEM; ++jj){
+                for (long jj = 0; jj < par.widthDEM; ++jj){
+                    facet_struct &f = facet[jj];
+                    f.valid = false;
 
-            if (jj == 0 || jj == (par.widthDEM-1)){ //Check bounds
-                simsar[jj] = 0.0f;
-                j_cur += 1.0;
-                continue;
-            }
+                    if (jj == 0 || jj == (par.widthDEM-1)){ //Check bounds
+                        f.ranpix = 0.0f;
+                        f.azpix = 0.0f;
+                        continue;
+                    }
 
-            //Load DEM into 3x3 window
-            Z1 = DEM_buf_float[0][jj-1];
-            Z2 = DEM_buf_float[0][jj];
-            Z3 = DEM_buf_float[0][jj+1];
-            Z4 = DEM_buf_float[1][jj-1];
-            Z5 = DEM_buf_float[1][jj];
-            Z6 = DEM_buf_float[1][jj+1];
-            Z7 = DEM_buf_float[2][jj-1];
-            Z8 = DEM_buf_float[2][jj];
-            Z9 = DEM_buf_float[2][jj+1];
-
-            //Z1 = par.gavgterhgt; Z2 = Z1; Z3 = Z1; Z4 = Z1; Z5 = Z1; Z6 = Z1; Z7 = Z1; Z8 = Z1; Z9 = Z1;
-
-            if (LUTin_flag){
-                ranpix = gc[jj].real();
-                azpix = gc[jj].imag();
-                slt_range = par.Ro + (double)ranpix*par.delta_R;
-            }
-            else {
-                if (Z5 < -1000){ //Discard bad DEM data point (mainly for UAVSAR DEMs)
-                    azpix = -100.0f;
-                    ranpix = -100.0f;
-                }
-                else {
-                    lon = par.corner_lon + j_cur*par.spc_lon;
-                                        
-                    //Compute SCH coordinates for map pixel
-                    SCH = llh2sch(lat, lon, Z5, par, peg);
-                    
-                    //Convert SCH coordinates to range and azimuth positions
-                    if (SCH.y < 0.0f){
-                        azpix = -100.0f;
-                        ranpix = -100.0f;
+                    if (jj < j_lo || jj > j_hi){ //Cannot map into the RDC image
+                        f.ranpix = -100.0f;
+                        f.azpix = -100.0f;
+                        continue;
+                    }
+
+                    //Load DEM into 3x3 window
+                    Z1 = DEM_buf_float[r][jj-1];
+                    Z2 = DEM_buf_float[r][jj];
+                    Z3 = DEM_buf_float[r][jj+1];
+                    Z4 = DEM_buf_float[r+1][jj-1];
+                    Z5 = DEM_buf_float[r+1][jj];
+                    Z6 = DEM_buf_float[r+1][jj+1];
+                    Z7 = DEM_buf_float[r+2][jj-1];
+                    Z8 = DEM_buf_float[r+2][jj];
+                    Z9 = DEM_buf_float[r+2][jj+1];
+
+                    if (LUTin_flag){
+                        ranpix = gc_buf[r][jj].real();
+                        azpix = gc_buf[r][jj].imag();
+                        slt_range = par.Ro + (double)ranpix*par.delta_R;
                     }
                     else {
-                        azpix = (SCH.x-par.so)/par.delta_az;
-                        slt_range = sqrt( POW2(peg.ra+(double)Z5) + POW2(peg.ra+par.gavgalt) - 2.0*(peg.ra+(double)Z5) * (peg.ra+par.gavgalt) * cos(SCH.y/peg.ra));
-                        ranpix = (slt_range-par.Ro)/par.delta_R;
+                        if (Z5 < -1000){ //Discard bad DEM data point (mainly for UAVSAR DEMs)
+                            azpix = -100.0f;
+                            ranpix = -100.0f;
+                        }
+                        else {
+                            //Compute SCH coordinates for map pixel
+                            SCH = llh2sch(peg_tf, lt, clon_DEM[jj], slon_DEM[jj], Z5);
+
+                            //Convert SCH coordinates to range and azimuth positions
+                            if (SCH.y < 0.0f){
+                                azpix = -100.0f;
+                                ranpix = -100.0f;
+                            }
+                            else {
+                                azpix = (SCH.x-par.so)/par.delta_az;
+                                slt_range = sqrt( POW2(peg.ra+(double)Z5) + POW2(peg.ra+par.gavgalt) - 2.0*(peg.ra+(double)Z5) * (peg.ra+par.gavgalt) * cos(SCH.y/peg.ra));
+                                ranpix = (slt_range-par.Ro)/par.delta_R;
+                            }
+                        }
                     }
-                }               
-                if (LUTout_flag){
-                  //gc_out[jj].real() = ranpix;
-                  //gc_out[jj].imag() = azpix;
-                  gc_out[jj] = std::complex<float>(ranpix,azpix);
-     
+                    f.ranpix = ranpix;
+                    f.azpix = azpix;
+
+                    //Check to see if pixel lies in valid RDC range
+                    x2 = floor(ranpix)+1.0f;
+                    y2 = floor(azpix)+1.0f;
+                    if (ranpix < 0.0f || x2 > xbound || azpix < 0.0f || y2 > ybound )
+                        continue;
+                    f.valid = true;
+                    iy_min[r] = min(iy_min[r], (int)y2-1);
+                    iy_max[r] = max(iy_max[r], (int)y2);
+
+                    if (flat_flag){
+                        slope_r = flat_slope_r;
+                        slope_a = flat_slope_a;
+                        slope_actual_r = flat_slope_actual_r;
+                    }
+                    else {
+                        //Compute slope and aspect for pixel using 3x3 window
+                        p = (Z3 + Z6 + Z9 - Z1 - Z4 - Z7) / (6.0f * deltaDEM_lon);
+                        q = (Z1 + Z2 + Z3 - Z7 - Z8 - Z9) / (6.0f * deltaDEM_lat);
+                        slope = atan(sqrt(p*p + q*q));
+                        if (p == 0.0f){
+                            if (q > 0)
+                                aspect = PI;
+                            else
+                                aspect = 0.0f;
+                        }
+                        else
+                            aspect = PI - atan(q/p) + (PI_HALF*p/fabs(p));
+
+                        //Slope in the range and azimuth directions (for left-looking sensor)
+                        tan_slope = tan(slope);
+                        slope_r = tan_slope*cos(aspect - peg.heading - PI_HALF); // (-PI_HALF) indicates slopes towards radar are positive
+                        slope_a = tan_slope*cos(aspect - peg.heading);  //THESE values are tan(actual_slope_a)
+                        slope_actual_r = atan(slope_r);
+                    }
+                    //Vector (sch) of unit normal vector to surface adjusted for range pixel
+                    temp = -1.0/sqrt(1.0 + POW2(slope_r) + POW2(slope_a));
+                    nE.x = temp*slope_a;
+                    nE.y = temp*slope_r;
+                    nE.z = -temp;
+
+                    //Compute look vector (direction from ground to sensor ---> negative of the convention)
+                    r_x2 = peg.ra+Z5;
+                    r_l3 = (r_x1*r_x1 + slt_range*slt_range - r_x2*r_x2)/(2.0*r_x1*slt_range);
+                    r_look = acos((r_l3 + sESA*spitch)/(cpitch*cESA));
+                    c_look = cos(r_look);
+                    s_look = sin(r_look);
+
+                    nL.x = -sESA*cpitch*cyaw
+                           -cESA*(spitch*c_look*cyaw + s_look*syaw);
+                    nL.y = sESA*cpitch*syaw
+                          -cESA*(-spitch*c_look*syaw + s_look*cyaw);
+                    nL.z = r_l3;
+
+                    //Compute normal vector to imaging plane (remember the reverse direction)
+                    nI.x = 0.0;
+                    nI.y = nL.z;
+                    nI.z = -nL.y;
+
+                    //Compute local incidence angle and map area for facet
+                    f.area = area_ref/fabs(dotXYZ(nE,nI));
+                    f.inc = acos(dotXYZ(nE,nL)); //local incidence angle
+                    f.look = r_look;
+                    f.slope = slope_actual_r;
+
+                    // two-way amplitude gain of antenna
+                    //antcor = pow(sin((acos(par.gavgalt/slt_range)-0.785398)*PI*1.5)/((acos(par.gavgalt/slt_range)-0.785398)*PI*1.5),2);
+                    //antcor = pow(sin((acos((par.gavgalt-par.gavgterhgt)/slt_range)-0.785398)*PI*1.5)/((acos((par.gavgalt-par.gavgterhgt)/slt_range)-0.785398)*PI*1.5),2);
+                    // remove the correction by using actual look angle instead of approximation makes antcor equal to 1
+                    f.antcor = antenna_pattern(r_look);
                 }
             }
+        };
+
+        //Adds the facets of the block to RDC lines iy0 to iy1-1, using 1/dist
+        //IDW to assign incidence angle and area to radar pixels
+        auto add_facets = [&](long iy0, long iy1){
+            float x1, x2, y1, y2, dist;
+            int ix1, ix2, iy1_, iy2;
+
+            for (long r = 0; r < nrows; ++r){
+                if (iy_max[r] < iy0 || iy_min[r] >= iy1)
+                    continue;
+                for (long jj = 0; jj < par.widthDEM; ++jj){
+                    const facet_struct &f = facets[r][jj];
+                    if (!f.valid)
+                        continue;
+
+                    //Establish bounds for bilinear weighting model
+                    y1 = floor(f.azpix); iy1_ = (int)y1;
+                    y2 = y1+1.0f; iy2 = (int)y2;
+                    if (iy2 < iy0 || iy1_ >= iy1)
+                        continue;
+                    x1 = floor(f.ranpix); ix1 = (int)x1;
+                    x2 = x1+1.0f; ix2 = (int)x2;
+
+                    if (iy1_ >= iy0){
+                        dist = sqrt(POW2(x1-f.ranpix) + POW2(y1-f.azpix));
+                        add_facet(f, dist, geom[(long)iy1_*par.width+ix1]);
+
+                        dist = sqrt(POW2(x2-f.ranpix) + POW2(y1-f.azpix));
+                        add_facet(f, dist, geom[(long)iy1_*par.width+ix2]);
+                    }
+                    if (iy2 < iy1){
+                        dist = sqrt(POW2(x1-f.ranpix) + POW2(y2-f.azpix));
+                        add_facet(f, dist, geom[(long)iy2*par.width+ix1]);
 
-            //Establish bounds for bilinear weighting model
-            x1 = floor(ranpix); ix1 = (int)x1;
-            x2 = x1+1.0f; ix2 = (int)x2;
-            y1 = floor(azpix); iy1 = (int)y1;
-            y2 = y1+1.0f; iy2 = (int)y2;        
-                
-            //Check to see if pixel lies in valid RDC range
-            if (ranpix < 0.0f || x2 > xbound || azpix < 0.0f || y2 > ybound ){
-                simsar[jj] = 0.0f;
-                j_cur += 1.0;
-                continue;
+                        dist = sqrt(POW2(x2-f.ranpix) + POW2(y2-f.azpix));
+                        add_facet(f, dist, geom[(long)iy2*par.width+ix2]);
+                    }
+                }
             }
-
-            //Compute slope and aspect for pixel using 3x3 window
-            p = (Z3 + Z6 + Z9 - Z1 - Z4 - Z7) / (6.0f * deltaDEM_lon);
-                q = (Z1 + Z2 + Z3 - Z7 - Z8 - Z9) / (6.0f * deltaDEM_lat);
-            slope = atan(sqrt(p*p + q*q));
-            if (p == 0.0f){
-                if (q > 0)
-                    aspect = PI;
-                else
-                    aspect = 0.0f;
+        };
+
+        for (ii0 = 0; ii0 < par.heightDEM; ii0 += block_lines){
+            nrows = min(block_lines, (long)par.heightDEM-ii0);
+
+            if ((ii0+999)/1000*1000 < ii0+nrows)
+                cout << "Processed line " << (ii0+999)/1000*1000 << " of " << par.heightDEM << "\r" << flush;
+
+            //If input LUT is provided, read values (cpx format/BIP)
+            if (LUTin_flag)
+                for (long r = 0; r < nrows; ++r)
+                    LUTin.read((char *) &gc_buf[r][0], sizeof(float)*2*par.widthDEM);
+
+            //Load the DEM lines of the block, and the lines above and below it.
+            //The line above and the first line were the last two lines of the
+            //previous block, so each DEM line is read once, in order.
+            long first = ii0, last = min(ii0+nrows, (long)par.heightDEM-1);
+            if (ii0 > 0){
+                DEM_buf_float[0].swap(DEM_buf_float[block_lines]);
+                DEM_buf_float[1].swap(DEM_buf_float[block_lines+1]);
+                first = ii0+1;
             }
-            else
-                aspect = PI - atan(q/p) + (PI_HALF*p/fabs(p));
-
-            //Slope in the range and azimuth directions (for left-looking sensor)
-            slope_r = tan(slope)*cos(aspect - peg.heading - PI_HALF); // (-PI_HALF) indicates slopes towards radar are positive
-            slope_a = tan(slope)*cos(aspect - peg.heading);  //THESE values are tan(actual_slope_a)
-            slope_actual_r = atan(slope_r);
-            slope_actual_a = atan(slope_a);
-            //Vector (sch) of unit normal vector to surface adjusted for range pixel
-            temp = -1.0/sqrt(1.0 + POW2(slope_r) + POW2(slope_a));
-            nE.x = temp*slope_a;
-            nE.y = temp*slope_r;
-            nE.z = -temp;           
-
-            //Compute look vector (direction from ground to sensor ---> negative of the convention)
-            r_x2 = peg.ra+Z5;
-            r_l3 = (r_x1*r_x1 + slt_range*slt_range - r_x2*r_x2)/(2.0*r_x1*slt_range);
-            r_look = acos((r_l3 + sin(par.ESA)*sin(par.pitch))/(cos(par.pitch)*cos(par.ESA)));
-            
-            // added by Michael Denbina to put look and slope into arrays for saving.
-            look_array[jj] = r_look*(180.0/PI);
-            slope_array[jj] = slope_actual_r*(180.0/PI);
-
-
-            nL.x = -sin(par.ESA)*cos(par.pitch)*cos(par.yaw)
-                   -cos(par.ESA)*(sin(par.pitch)*cos(r_look)*cos(par.yaw) + sin(r_look)*sin(par.yaw));
-            nL.y = sin(par.ESA)*cos(par.pitch)*sin(par.yaw) 
-                  -cos(par.ESA)*(-sin(par.pitch)*cos(r_look)*sin(par.yaw) + sin(r_look)*cos(par.yaw));
-            nL.z = r_l3;
-
-            //Compute normal vector to imaging plane (remember the reverse direction)
-            nI.x = 0.0;
-            nI.y = nL.z;
-            nI.z = -nL.y;
-
-            //Compute local incidence angle and map area for facet
-            area = area_ref/fabs(dotXYZ(nE,nI));
-            temp = acos(dotXYZ(nE,nL)); //local incidence angle
-            if (sim_flag){
-              simsar[jj] =  temp; //atan(slope_a); //temp;  r_look;
+            for (long l = first; l <= last && !flat_flag; ++l)
+                DEMfile.read((char *) &DEM_buf_float[l-ii0+1][0], sizeof(float)*par.widthDEM);
+
+            run_threads(nthreads, nrows, compute_facets);
+
+            int iy_lo = par.height, iy_hi = -1;
+            for (long r = 0; r < nrows; ++r){
+                iy_lo = min(iy_lo, iy_min[r]);
+                iy_hi = max(iy_hi, iy_max[r]);
             }
+            if (iy_hi >= iy_lo)
+                run_threads(nthreads, iy_hi-iy_lo+1, [&](long b0, long b1){ add_facets(iy_lo+b0, iy_lo+b1); });
+
+            //Write out the per-pixel outputs of the block in DEM coordinates
+            for (long r = 0; r < nrows; ++r){
+                long ii = ii0 + r, n0 = r*par.widthDEM;
+                if (ii == 0 || ii == (par.heightDEM-1)){ //Check bounds
+                    if (sim_flag)
+                        copy(zero_vec.begin(), zero_vec.end(), sim_block.begin()+n0);
+                    if (LUTout_flag)
+                        copy(zero_vec_cpx.begin(), zero_vec_cpx.end(), gc_block.begin()+n0);
+                    if (look_flag)
+                        copy(zero_vec.begin(), zero_vec.end(), look_block.begin()+n0);
+                    if (slope_flag)
+                        copy(zero_vec.begin(), zero_vec.end(), slope_block.begin()+n0);
+                    continue;
+                }
+
+                for (long jj = 0; jj < par.widthDEM; ++jj){
+                    const facet_struct &f = facets[r][jj];
+                    if (!LUTin_flag)
+                        gc_out[jj] = std::complex<float>(f.ranpix,f.azpix);
+                    simsar[jj] = f.valid ? f.inc : 0.0f;
+                    // added by Michael Denbina to put look and slope into arrays for saving.
+                    // (pixels outside of the RDC image keep the values of the line before)
+                    if (f.valid){
+                        look_array[jj] = f.look*(180.0/PI);
+                        slope_array[jj] = f.slope*(180.0/PI);
+                    }
+                }
 
-            // two-way amplitude gain of antenna
-            //antcor = pow(sin((acos(par.gavgalt/slt_range)-0.785398)*PI*1.5)/((acos(par.gavgalt/slt_range)-0.785398)*PI*1.5),2);
-            //antcor = pow(sin((acos((par.gavgalt-par.gavgterhgt)/slt_range)-0.785398)*PI*1.5)/((acos((par.gavgalt-par.gavgterhgt)/slt_range)-0.785398)*PI*1.5),2);
-            // remove the correction by using actual look angle instead of approximation makes antcor equal to 1
-            antcor = pow(sin((r_look-0.785398)*PI*1.5)/((r_look-0.785398)*PI*1.5),2);
-
-            //Use 1/dist IDW to assign incidence angle and area to radar pixel
-            dist = sqrt(POW2(x1-ranpix) + POW2(y1-azpix));
-            areaRDC[iy1][ix1] += area/dist;
-            theta_l[iy1][ix1] += temp/dist;
-            sum_wgt[iy1][ix1] += 1.0f/dist;
-            r_looks[iy1][ix1] += r_look/dist;
-            all_slope_actual_r[iy1][ix1] += slope_actual_r/dist;
-            antcors[iy1][ix1] += antcor/dist;
-
-            dist = sqrt(POW2(x2-ranpix) + POW2(y1-azpix));
-            areaRDC[iy1][ix2] += area/dist;
-            theta_l[iy1][ix2] += temp/dist;
-            sum_wgt[iy1][ix2] += 1.0f/dist;
-            r_looks[iy1][ix2] += r_look/dist;
-            all_slope_actual_r[iy1][ix2] += slope_actual_r/dist;
-            antcors[iy1][ix2] += antcor/dist;
-
-            dist = sqrt(POW2(x1-ranpix) + POW2(y2-azpix));
-            areaRDC[iy2][ix1] += area/dist;
-            theta_l[iy2][ix1] += temp/dist;
-            sum_wgt[iy2][ix1] += 1.0f/dist;
-            r_looks[iy2][ix1] += r_look/dist;
-            all_slope_actual_r[iy2][ix1] += slope_actual_r/dist;
-            antcors[iy2][ix1] += antcor/dist;
-
-            dist = sqrt(POW2(x2-ranpix) + POW2(y2-azpix));
-            areaRDC[iy2][ix2] += area/dist;
-            theta_l[iy2][ix2] += temp/dist;
-            sum_wgt[iy2][ix2] += 1.0f/dist;
-            r_looks[iy2][ix2] += r_look/dist;
-            all_slope_actual_r[iy2][ix2] += slope_actual_r/dist;
-            antcors[iy2][ix2] += antcor/dist;
-            
-            //r_looks[ii][jj] = r_look;
-            //all_slope_actual_r[ii][jj] = slope_actual_r;
-
-            j_cur += 1.0; //Update counter
+                if (LUTout_flag)
+                    copy(gc_out.begin(), gc_out.end(), gc_block.begin()+n0);
+                if (look_flag)
+                    copy(look_array.begin(), look_array.end(), look_block.begin()+n0);
+                if (slope_flag)
+                    copy(slope_array.begin(), slope_array.end(), slope_block.begin()+n0);
+                if (sim_flag)
+                    copy(simsar.begin(), simsar.end(), sim_block.begin()+n0);
+            }
 
+            if (LUTout_flag)
+                LUTout.write((char *) &gc_block[0], sizeof(float)*2*nrows*par.widthDEM);
+            if (look_flag)
+                look_out.write((char *) &look_block[0], sizeof(float)*nrows*par.widthDEM);
+            if (slope_flag)
+                slope_out.write((char *) &slope_block[0], sizeof(float)*nrows*par.widthDEM);
+            if (sim_flag)
+                sim_flout.write((char *) &sim_block[0], sizeof(float)*nrows*par.widthDEM);
         }
-        if (LUTout_flag)
-            LUTout.write((char *) &gc_out[0], sizeof(float)*2*(par.widthDEM));
-        
-        if (look_flag)
-            look_out.write((char *) &look_array[0], sizeof(float)*par.widthDEM);
-        
-        if (slope_flag)
-            slope_out.write((char *) &slope_array[0], sizeof(float)*par.widthDEM);
-        
-        if (sim_flag)
-            sim_flout.write((char *) &simsar[0], sizeof(float)*(par.widthDEM));
-            
-        i_cur += 1.0; //Update counter
-    }
 
 
 
-    //Compute weighted incidence angle and area matrices
-    for (long i = 0; i < par.height; ++i){
-        for (long j = 0; j < par.width; ++j){
-            if (sum_wgt[i][j] < 1.0e-4){
-                theta_l[i][j] = 0.0f;
-                areaRDC[i][j] = 0.0f;
-                r_looks[i][j] = 0.0f;
-                all_slope_actual_r[i][j] = 0.0f;
-                antcors[i][j] =0.0f;
+        //Compute weighted incidence angle and area matrices
+        for (long n = 0; n < (long)geom.size(); ++n){
+            rdc_geom &g = geom[n];
+            if (g.wgt < 1.0e-4){
+                g.theta = 0.0f;
+                g.area = 0.0f;
+                g.look = 0.0f;
+                g.slope = 0.0f;
+                g.antcor = 0.0f;
 
                 continue;
             }
-            theta_l[i][j] /= sum_wgt[i][j];
-            areaRDC[i][j] /= sum_wgt[i][j];
-            r_looks[i][j] /= sum_wgt[i][j];
-            all_slope_actual_r[i][j] /= sum_wgt[i][j];
-            antcors[i][j] /= sum_wgt[i][j];
-
+            g.theta /= g.wgt;
+            g.area /= g.wgt;
+            g.look /= g.wgt;
+            g.slope /= g.wgt;
+            g.antcor /= g.wgt;
         }
     }
+
+    //(Optional) Write out facet model geometry so it can be reused for other polarizations
+    if (geomout_flag){
+        if (geomin_flag)
+            geomout << geomin.rdbuf();
+        else
+            for (int p = 0; p < GEOM_PLANES; ++p)
+                for (long i = 0; i < par.height; i += CORRECTION_BLOCK_LINES){
+                    long n = min((long)CORRECTION_BLOCK_LINES, (long)par.height-i)*par.width;
+                    get_plane(&geom[i*par.width], n, p, &geom_lines_buf[0]);
+                    geomout.write((char *) &geom_lines_buf[0], sizeof(float)*n);
+                }
+        geomout.close();
+    }
     
     //(Optional) Write out RDC area estimate to file
     if (area_flag){
-        for (long i = 0; i < par.height; ++i)
-            areaRDCout.write((char *) &areaRDC[i][0], sizeof(float)*par.width);
+        if (geomin_flag)
+            geomin.seekg(0, ios::beg); //the area is the first plane
+        for (long i = 0; i < par.height; i += CORRECTION_BLOCK_LINES){
+            long n = min((long)CORRECTION_BLOCK_LINES, (long)par.height-i)*par.width;
+            if (geomin_flag)
+                geomin.read((char *) &geom_lines_buf[0], sizeof(float)*n);
+            else
+                get_plane(&geom[i*par.width], n, 0, &geom_lines_buf[0]);
+            areaRDCout.write((char *) &geom_lines_buf[0], sizeof(float)*n);
+        }
         areaRDCout.close();
     }
 
@@ -657,7 +1046,8 @@ int main(int argc, char* argv[]){
     cout << "Writing out incidence angle image........" << flush;
     ofstream inc_flout("slope_range_rdc.bin", ios::out | ios::binary);
     for (long i = 0; i < par.height; ++i){
-        inc_flout.write((char *) &theta_l[i][0], sizeof(float)*par.width);
+        get_plane(&geom[i*par.width], par.width, 1, &geom_lines_buf[0]);
+        inc_flout.write((char *) &geom_lines_buf[0], sizeof(float)*par.width);
     }
     inc_flout.close();
     cout << "Done\n\n";*/
@@ -668,220 +1058,187 @@ int main(int argc, char* argv[]){
       
       cout << "\n\nCorrecting input intensity image " << flush;
       
-      vector<float> amp_in(par.width,0), amp_cor(par.width,0), mask_array(par.width,0), rtc_ratio(par.width,0);
+      //The image is corrected in blocks of lines: the lines of the block
+      //are read, corrected by the worker threads (each for a part of the
+      //range samples), and then written out.
+      long i0 = 0, nlines = 0;
+      //Lines of the block (contiguous, so that each file is read and
+      //written with one call per block)
+      vector<vector<float> > amp_ins(ndiag, vector<float>(CORRECTION_BLOCK_LINES*par.width,0)),
+        mask_arrays(ndiag, vector<float>(CORRECTION_BLOCK_LINES*par.width,0)),
+        rtc_ratios(ndiag, vector<float>(CORRECTION_BLOCK_LINES*par.width,0));
+      //Corrected lines of each diagonal term, after the last line of the previous block
+      vector<vector<float> > amp_cors(ndiag, vector<float>((CORRECTION_BLOCK_LINES+1)*par.width,0));
+      vector<vector<complex<float> > > cpx_ins(nterms-ndiag, vector<complex<float> >(CORRECTION_BLOCK_LINES*par.width,0));
+      //Facet model geometry of the lines of the block (with -G, read from the file)
+      vector<rdc_geom> geom_block(geomin_flag ? CORRECTION_BLOCK_LINES*par.width : 0);
+      vector<float> geom_buf(geomin_flag ? CORRECTION_BLOCK_LINES*par.width : 0);
+      const rdc_geom *geom_lines = NULL;
+      vector<float> mask_cov(CORRECTION_BLOCK_LINES*par.width,0);
+      int pols[3] = {pol, 2, 3}; //pol switch value of each diagonal term
+      if (cov_flag)
+        pols[0] = 1;
+
+      //Compute 1-D look-up vectors for JPL area correction factors
+      compute_area_fe(peg, par, area_fe_vec);
+      
+      //Enter loop to read data and perform radiometric correction
+      const correction_params cp = make_correction_params(par);
+      if (cos_flag){
+          cout << "using Vegetation correction ....." << flush;
+          // reading and processing backscatter data
+            cout << "Reading Vegetation Correction table ....." << flush;
+            for (int k = 0; k < ndiag; ++k)
+              VegTablefile[k].read((char *) &VegTables[k][0], sizeof(float)*VEG_TABLE_SIZE*VEG_TABLE_SIZE);
+      }
+      else
+          cout << "using area correction....." << flush;
+
+      //Corrects range samples j0 to j1-1 of the lines of the block
+      auto correct_samples = [&](long j0, long j1){
+          //Terms which only depend on the geometry, shared by the diagonal terms
+          vector<double> antcors(par.width), cos_incs(par.width);
+
+          for (long r = 0; r < nlines; ++r){
+              const rdc_geom *geom_line = geom_lines + r*par.width;
+              geometry_terms(geom_line, &antcors[0], &cos_incs[0], j0, j1);
+              //Each line starts from the corrected values of the previous
+              //line (see correct_term)
+              for (int k = 0; k < ndiag; ++k)
+                  correct_term(geom_line, &antcors[0], &cos_incs[0], &area_fe_vec[0], cos_flag ? &VegTables[k][0] : NULL, pols[k], cp,
+                               &amp_ins[k][r*par.width], &amp_cors[k][r*par.width], &amp_cors[k][(r+1)*par.width],
+                               &mask_arrays[k][r*par.width], &rtc_ratios[k][r*par.width], j0, j1);
+
+              //Off-diagonal terms, corrected with the ratios of the diagonal terms
+              for (int t = ndiag; t < nterms; ++t)
+                  calibrate_offdiag(&cpx_ins[t-ndiag][r*par.width], &rtc_ratios[COV_PAIRS[t-ndiag][0]][r*par.width], &rtc_ratios[COV_PAIRS[t-ndiag][1]][r*par.width], cp.void_val, j0, j1);
+          }
+      };
+
+      for (i0 = 0; i0 < par.height; i0 += CORRECTION_BLOCK_LINES){
+          nlines = min((long)CORRECTION_BLOCK_LINES, (long)par.height-i0);
+          for (int k = 0; k < ndiag; ++k)
+              ampfile[k].read((char *) &amp_ins[k][0], sizeof(float)*nlines*par.width);
+          for (int t = ndiag; t < nterms; ++t)
+              ampfile[t].read((char *) &cpx_ins[t-ndiag][0], sizeof(float)*2*nlines*par.width);
+
+          if (geomin_flag){
+              for (int p = 0; p < GEOM_PLANES; ++p){
+                  geomin.seekg(sizeof(float)*((long)p*par.height + i0)*par.width, ios::beg);
+                  geomin.read((char *) &geom_buf[0], sizeof(float)*nlines*par.width);
+                  set_plane(&geom_block[0], nlines*par.width, p, &geom_buf[0]);
+              }
+              geom_lines = &geom_block[0];
+          }
+          else
+              geom_lines = &geom[i0*par.width];
+
+          run_threads(nthreads, par.width, correct_samples);
+
+          long n = nlines*par.width;
+          for (int k = 0; k < ndiag; ++k){
+              //Write out corrected data in RDC coordinates
+              if (rdcout_flag)
+                  ampout[k].write((char *) &amp_cors[k][par.width], sizeof(float)*n);
+              if (geocode_flag)
+                  for (long r = 0; r < nlines; ++r)
+                      copy(amp_cors[k].begin()+(r+1)*par.width, amp_cors[k].begin()+(r+2)*par.width, cor_rdc[k].begin()+(i0+r)*par.width);
+
+              if (ratio_flag)
+                  ratio_out.write((char *) &rtc_ratios[k][0], sizeof(float)*n);
+          }
 
-        //Compute 1-D look-up vectors for JPL area correction factors
-        compute_area_fe(peg, par, area_fe_vec);
-        
-        //Enter loop to read data and perform radiometric correction
-        inc_tol = 70.0*RAD; //tolerance for local incidence angle in shadows
-        inc_ltol= 15*RAD;  // low incidence angle. data gets strectched
-        if (cos_flag){
-            cout << "using Vegetation correction ....." << flush;
-            // reading and processing backscatter data
-              cout << "Reading Vegetation Correction table ....." << flush;
-              for (short i = 0; i < 900; ++i)
-                VegTablefile.read((char *) &VegTable[i][0], sizeof(float)*900);
-
-            for (long i = 0; i < par.height; ++i){
-                ampfile.read((char *) &amp_in[0], sizeof(float)*par.width);         
-                for (long j = 0; j < par.width; ++j) {
-                    // Preserve original values
-                    //amp_og[j] = amp_in[j];
-                  
-                    // Remove JPL correction factor
-                    //amp_in[j] = amp_in[j]*area_fe_vec[j];
-                    rtc_ratio[j] = area_fe_vec[j];
-
-                    if (areaRDC[i][j] < 1.0e-6) { // Negligible area calculated for coordinate
-                      //amp_cor[j] = (amp_in[j]);
-                      mask_array[j] = 1; // Added by Michael Denbina to keep track of void pixels. 1 = void pixel
-                    }
-                    else {
-                        inc_cor = theta_l[i][j];
-                        r_look = r_looks[i][j];
-                        slope_actual_r=all_slope_actual_r[i][j];
-
-                        //tempout = amp_in[j]*(area_ref/areaRDC[i][j])/cos(inc_cor);  // AREA CORRECTION
-                        antcor = antcors[i][j] / 
-                          pow(sin((r_look-0.785398)*PI*1.5)/
-                              ((r_look-0.785398)*PI*1.5),2); // antenna correction due to original image not using DEM
-                        //tempout = tempout * antcor;  // ANTENNA SUPPLEMENTAL CORRECTION FOR TOPO
-                        rtc_ratio[j] = rtc_ratio[j]*(area_ref/areaRDC[i][j])/(cos(inc_cor))*antcor;
-
-                        if ( (inc_cor > inc_tol) || (inc_cor < inc_ltol) || (r_look < 0.35 && abs(slope_actual_r) > 0.1) ) {
-                          //amp_cor[j] = tempout;
-                          mask_array[j] = 1; // Added by Michael Denbina to keep track of void pixels. 1 = void pixel
-                        }
-                        else {
-                          mask_array[j] = 0; // Added by Michael Denbina to keep track of void pixels.  0 = valid pixel
-
-
-                          e_look = (int) (r_look*180/PI)*10; 
-                          e_slope= (int) (slope_actual_r*180/PI+90.)*10/2;
-                          
-                          if(e_look < 0 || e_look > 899 || e_slope <0 || e_slope >899 ) cs = 1.0;
-                          else cs = VegTable[e_slope][e_look]; // VEGETATION Table lookup
-                          
-                          // Testing:
-
-
-                          if (cs > 0.001)
-                          switch (pol) {
-                          case 1: 
-
-                            //cs = 0.816471 -0.933689*r_look +0.251198 *pow(r_look,2)+0.246271*slope_actual_r-0.236941*pow(slope_actual_r,2);
-                            //cs = 2.38234 -2.69612*r_look+ 0.709170*pow(r_look,2)+0.726989*slope_actual_r -0.700571*pow(slope_actual_r,2);
-                            
-                            // cout<<" look "<<e_look<<" slope "<<e_slope<<" ";
-                            //if(cs = 0) amp_cor[j]=1;
-                            //amp_cor[j] = (tempout/cs*VegTable[450][350]);
-                            rtc_ratio[j] = rtc_ratio[j]/cs*VegTable[450][350];
-                            break;
-                            
-                          case 2: 
-                            
-                            //cs = 0.255000-0.311589 *r_look +0.0980392*pow(r_look,2)+0.0621085*slope_actual_r -0.0633426*pow(slope_actual_r,2);
-                            //cs = 2.49554 -3.01881*r_look+ 0.934043 *pow(r_look,2)+ 0.615928*slope_actual_r -0.629401*pow(slope_actual_r,2);
-                            
-                            //amp_cor[j] = (tempout/cs*VegTable[450][350]);
-                            rtc_ratio[j] = rtc_ratio[j]/cs*VegTable[450][350];
-                            break;
-                            
-                          case 3:
-
-                            //cs= 0.673232 -0.922350 *r_look +0.343811*pow(r_look,2)+0.128466*slope_actual_r -0.125623*pow(slope_actual_r,2);
-                            //cs= 2.79799 -3.79865*r_look+1.40014*pow(r_look,2)+0.542621*slope_actual_r-0.532302*pow(slope_actual_r,2);
-                            
-                            //amp_cor[j] = (tempout/cs*VegTable[450][350]);
-                            rtc_ratio[j] = rtc_ratio[j]/cs*VegTable[450][350];
-                            break;
-                            
-                            
-                          // default:
-                            
-                          //   amp_cor[j] = tempout/cs;
-                          }
-                          else {
-                              mask_array[j] = 1;
-                              //amp_cor[j] = tempout;
-                          }
-                        }
-                    }
-                    if (!(amp_cor[j] <= DBL_MAX && amp_cor[j] >= -DBL_MAX)) {
-                        //amp_cor[j] = 0;
-                        mask_array[j] = 1;
-                    }
-                    
-                    // Difference
-                    //rtc_ratio[j] = amp_cor[j]/amp_og[j];
-                    
-                    // Apply upper and lower limits to correction factor.
-                    if (rtc_ratio[j] < min_correction_ratio) {
-                        rtc_ratio[j] = min_correction_ratio;
-                    }
-                    else if (rtc_ratio[j] > max_correction_ratio) {
-                        rtc_ratio[j] = max_correction_ratio;
-                    }
-                    
-                    // If mask is set to void, set correction factor to void.
-                    // and keep input value as is
-                    if (mask_array[j] == 1) {
-                        rtc_ratio[j] = void_correction_val;
-                        //amp_cor[j] = amp_in[j];
-                        amp_cor[j] = void_correction_val;
-                    }
-                    
-                    // Update amp_cor, in case rtc_ratio changed.
-                    if (rtc_ratio[j] > 0) {
-                        amp_cor[j] = rtc_ratio[j] * amp_in[j];
-                    } 
-                }           
-                //Write out corrected data in RDC coordinates
-                ampout.write((char *) &amp_cor[0], sizeof(float)*par.width);
-
-                if (ratio_flag)
-                    ratio_out.write((char *) &rtc_ratio[0], sizeof(float)*par.width);
-                
-                if (mask_flag)
-                    mask_out.write((char *) &mask_array[0], sizeof(float)*par.width);
+          for (int t = ndiag; t < nterms; ++t){
+              vector<complex<float> > &cpx_in = cpx_ins[t-ndiag];
+              if (rdcout_flag)
+                  ampout[t].write((char *) &cpx_in[0], sizeof(float)*2*n);
+              if (geocode_flag)
+                  for (long r = 0; r < nlines; ++r)
+                      for (long j = 0; j < par.width; ++j){
+                          cor_rdc[2*t-ndiag][(i0+r)*par.width+j] = cpx_in[r*par.width+j].real();
+                          cor_rdc[2*t-ndiag+1][(i0+r)*par.width+j] = cpx_in[r*par.width+j].imag();
+                      }
+          }
+
+          //The mask is void where any of the diagonal terms is void
+          copy(mask_arrays[0].begin(), mask_arrays[0].begin()+n, mask_cov.begin());
+          for (int k = 1; k < ndiag; ++k)
+              for (long j = 0; j < n; ++j)
+                  mask_cov[j] = max(mask_cov[j], mask_arrays[k][j]);
+
+          if (mask_flag)
+              mask_out.write((char *) &mask_cov[0], sizeof(float)*n);
+
+          for (int k = 0; k < ndiag; ++k)
+              copy(amp_cors[k].begin()+n, amp_cors[k].begin()+n+par.width, amp_cors[k].begin());
+      }
+      cout << "Done" << endl;
+      amp_cors.clear(); amp_ins.clear(); rtc_ratios.clear(); 
+    }
+
+    //-----------------------------   Optional: Geocode corrected intensity image  -----------------------------------
+
+    if (correct_flag && geocode_flag){
+
+        cout << "\nGeocoding corrected intensity image......" << flush;
+
+        //Same bilinear interpolation as uavsar_geocode.  All of the terms
+        //are geocoded in one pass over the transformation look up table.
+        LUTout.close();
+        ifstream geocode_LUT;
+        open_buffered(geocode_LUT, LUTout_flag ? LUT_flout : LUT_flin, ios::in, io_buffers);
+        if (!geocode_LUT.is_open()){
+            cout << "Error opening transformation look up table for geocoding\n";
+            exit(1);
+        }
+        ofstream geocode_out[6];
+        for (int t = 0; t < nterms; ++t){
+            string grd_name = cov_flag ? CovFilename(geocode_name, terms[t]) : geocode_name;
+            geocode_out[t].open(grd_name.c_str(), ios::out | ios::binary);
+            if (!geocode_out[t].is_open()){
+                cout << "Error creating output geocoded intensity file " << grd_name << "\n";
+                exit(1);
             }
         }
-        else {
-            cout << "using area correction....." << flush;
-            for (long i = 0; i < par.height; ++i){
-                ampfile.read((char *) &amp_in[0], sizeof(float)*par.width);         
-                for (long j = 0; j < par.width; ++j) {
-                    ////Preserve original values
-                    //amp_og[j] = amp_in[j];
-                    ////Remove JPL correction factor
-                    //amp_in[j] = amp_in[j]*area_fe_vec[j];
-                    r_look = r_looks[i][j];
-                    antcor = antcors[i][j] / 
-                             pow(sin((r_look-0.785398)*PI*1.5)/
-                             ((r_look-0.785398)*PI*1.5),2); // antenna correction due to original image not using DEM
-                    //amp_in[j] = amp_in[j]* antcor;
-                    rtc_ratio[j] = area_fe_vec[j]*antcor;
-                                        
-                    if (areaRDC[i][j] < 1.0e-6) { //No area calculated for coordinate
-                        //tempout = amp_in[j];
-                        mask_array[j] = 1; // void pixel
-                    }
-                    else {
-                        inc_cor = theta_l[i][j];
-                        if (inc_cor > inc_tol || (inc_cor < inc_ltol)) { // || (r_look < 0.35 && abs(slope_actual_r) > 0.1)) //Pixel is in shadow
-                          //tempout = amp_in[j];
-                          mask_array[j] = 1; // void pixel
-                        }
-                        else {
-                          //tempout = amp_in[j]*(area_ref/areaRDC[i][j])/cos(inc_cor);
-                          rtc_ratio[j] = rtc_ratio[j]*(area_ref/areaRDC[i][j])/cos(inc_cor);
-                          mask_array[j] = 0; // valid pixel
-                        }
 
-                    }
-                    //amp_cor[j] = tempout;
-                    //rtc_ratio[j] = amp_cor[j]/amp_og[j];
-                    amp_cor[j] = rtc_ratio[j] * amp_in[j];
-
-                    // Apply upper and lower limits to correction factor.
-                    if (rtc_ratio[j] < min_correction_ratio) {
-                        rtc_ratio[j] = min_correction_ratio;
-                    }
-                    else if (rtc_ratio[j] > max_correction_ratio) {
-                        rtc_ratio[j] = max_correction_ratio;
-                    }
-                    
-                    // If mask is set to void, set correction factor to void.
-                    // and keep input value as is
-                    if (mask_array[j] == 1) {
-                        rtc_ratio[j] = void_correction_val;
-                        //amp_cor[j] = amp_in[j];
-                        amp_cor[j] = void_correction_val;
-                    }
-                    
-                    // Update amp_cor, in case rtc_ratio changed.
-                    if (rtc_ratio[j] > 0) {
-                        amp_cor[j] = rtc_ratio[j] * amp_in[j];
-                    } 
-                }           
-                //Write out corrected data in RDC coordinates
-                ampout.write((char *) &amp_cor[0], sizeof(float)*par.width);
-                
-                if (mask_flag)
-                    mask_out.write((char *) &mask_array[0], sizeof(float)*par.width);
-
-                if (ratio_flag)
-                    ratio_out.write((char *) &rtc_ratio[0], sizeof(float)*par.width);
+        int nplanes = cor_rdc.size();
+        vector<const float *> rdc_planes(nplanes);
+        for (int k = 0; k < nplanes; ++k)
+            rdc_planes[k] = &cor_rdc[k][0];
+        //Geocoded lines are written out in blocks of CORRECTION_BLOCK_LINES
+        vector<vector<float> > grd_out(nplanes, vector<float>(CORRECTION_BLOCK_LINES*par.widthDEM,0));
+        vector<complex<float> > gc_lines(CORRECTION_BLOCK_LINES*par.widthDEM);
+        vector<complex<float> > grd_cpx(nterms > ndiag ? CORRECTION_BLOCK_LINES*par.widthDEM : 0);
+        for (long i0 = 0; i0 < par.heightDEM; i0 += CORRECTION_BLOCK_LINES){
+            long nlines = min((long)CORRECTION_BLOCK_LINES, (long)par.heightDEM-i0), n = nlines*par.widthDEM;
+            geocode_LUT.read((char *) &gc_lines[0], sizeof(float)*2*n);
+            run_threads(nthreads, n, [&](long j0, long j1){
+                vector<float *> grd_planes(nplanes);
+                for (int k = 0; k < nplanes; ++k)
+                    grd_planes[k] = &grd_out[k][j0];
+                geocode_pixels(&gc_lines[j0], j1-j0, par.width, par.height, nplanes, &rdc_planes[0], &grd_planes[0], 1);
+            });
+            for (int t = 0; t < ndiag; ++t)
+                geocode_out[t].write((char *) &grd_out[t][0], sizeof(float)*n);
+            for (int t = ndiag; t < nterms; ++t){
+                for (long j = 0; j < n; ++j)
+                    grd_cpx[j] = complex<float>(grd_out[2*t-ndiag][j], grd_out[2*t-ndiag+1][j]);
+                geocode_out[t].write((char *) &grd_cpx[0], sizeof(float)*2*n);
             }
         }
+        geocode_LUT.close();
+        for (int t = 0; t < nterms; ++t)
+            geocode_out[t].close();
+        cor_rdc.clear();
         cout << "Done" << endl;
-        amp_cor.clear(); amp_in.clear(); rtc_ratio.clear(); 
     }
 
 
-    DEM_buf_float.clear(); theta_l.clear(); areaRDC.clear(); zero_vec.clear(); LUTcpx.clear(); count.clear(); gc.clear(); gc_out.clear(); simsar.clear();r_looks.clear();all_slope_actual_r.clear(); look_array.clear(); slope_array.clear();
-    DEMfile.close(); LUTout.close(); ampfile.close(); ampout.close(); areaRDCout.close(); sim_flout.close();
+    geom.clear(); zero_vec.clear(); LUTcpx.clear(); gc.clear(); gc_out.clear(); simsar.clear(); look_array.clear(); slope_array.clear();
+    DEMfile.close(); geomin.close(); LUTout.close(); areaRDCout.close(); sim_flout.close();
+    for (int t = 0; t < nterms; ++t){
+        ampfile[t].close(); ampout[t].close();
+    }
     
     if (ratio_flag)
         ratio_out.close();
@@ -0,0 +1,271 @@
+#ifndef FACET_UAVSAR_CORE_H
+#define FACET_UAVSAR_CORE_H
+
+#include <math.h>
+#include <float.h>
+#include <complex>
+#include <thread>
+#include <vector>
+#include "math_uavsar.h"
+#include "bilinear.h"
+
+//Routines shared by uavsar_calib and the libuavsar shared library (see
+//uavsar_lib.cpp): the radiometric correction of the MLC images from the
+//facet model geometry, and the geocoding of the corrected images.
+
+//Diagonal terms (indices in COV_TERMS) whose correction ratios are used for
+//each off-diagonal term: HHHV uses HHHH and HVHV, HHVV uses HHHH and VVVV,
+//and HVVV uses HVHV and VVVV.
+const int COV_PAIRS[3][2] = {{0, 1}, {0, 2}, {1, 2}};
+
+//Calibrates samples j0 to j1-1 of one line of an off-diagonal (complex)
+//covariance matrix term, using the geometric mean of the correction ratios of its two diagonal
+//terms.  Pixels which are void in either diagonal term are set to void_val.
+void calibrate_offdiag(std::complex<float> *cpx, const float *ratio1, const float *ratio2, float void_val, long j0, long j1)
+{
+    for (long j = j0; j < j1; ++j){
+        if (ratio1[j] > 0 && ratio2[j] > 0)
+            cpx[j] *= sqrt(ratio1[j]*ratio2[j]);
+        else
+            cpx[j] = std::complex<float>(void_val, 0);
+    }
+}
+
+//Number of lines in each block of the correction loop.
+const long CORRECTION_BLOCK_LINES = 64;
+
+//Facet model geometry of one RDC pixel: the sums of the area, local
+//incidence angle, look angle, range slope, and antenna pattern of the facets
+//which fall on it, weighted by 1/dist, and the sum of the weights.  Once
+//all of the facets are added, the weighted means.
+struct rdc_geom {
+    float area, theta, look, slope, antcor, wgt;
+};
+
+//Planes of the facet model geometry file (see -g), in the order they are
+//saved.
+const int GEOM_PLANES = 5;
+float rdc_geom::*const GEOM_FIELDS[GEOM_PLANES] = {&rdc_geom::area, &rdc_geom::theta, &rdc_geom::look, &rdc_geom::slope, &rdc_geom::antcor};
+
+//Copies one plane of n pixels of geometry to a buffer, or from a buffer.
+void get_plane(const rdc_geom *geom, long n, int p, float *buf)
+{
+    for (long j = 0; j < n; ++j)
+        buf[j] = geom[j].*GEOM_FIELDS[p];
+}
+
+void set_plane(rdc_geom *geom, long n, int p, const float *buf)
+{
+    for (long j = 0; j < n; ++j)
+        geom[j].*GEOM_FIELDS[p] = buf[j];
+}
+
+//Calls func(begin, end) from nthreads threads, each with a contiguous part
+//of [0, n), and waits for them to finish.  With one thread, func(0, n) is
+//called directly.
+template <class Func>
+void run_threads(int nthreads, long n, Func func)
+{
+    if (nthreads <= 1 || n <= 1){
+        func(0L, n);
+        return;
+    }
+    if (nthreads > n)
+        nthreads = n;
+    std::vector<std::thread> workers;
+    for (int t = 0; t < nthreads; ++t)
+        workers.push_back(std::thread(func, n*t/nthreads, n*(t+1)/nthreads));
+    for (int t = 0; t < nthreads; ++t)
+        workers[t].join();
+}
+
+//Size of the vegetation correction LUTs (-c): VEG_TABLE_SIZE slope bins
+//(rows) by VEG_TABLE_SIZE look angle bins, of 0.2 and 0.1 degrees.
+const int VEG_TABLE_SIZE = 900;
+
+//Limits and constants of the radiometric correction.
+struct correction_params {
+    double area_ref; //reference RDC area per pixel
+    double inc_tol, inc_ltol; //pixels with a larger (shadow) or smaller (stretched) local incidence angle are void
+    float min_ratio, max_ratio; //limits of the correction ratio
+    float void_val; //correction ratio and corrected value of void pixels
+};
+
+correction_params make_correction_params(const par_struct &par)
+{
+    correction_params cp;
+    cp.area_ref = par.delta_az*par.delta_R;
+    cp.inc_tol = 70.0*RAD; //tolerance for local incidence angle in shadows
+    cp.inc_ltol = 15*RAD;  // low incidence angle. data gets strectched
+    cp.min_ratio = 0.001;
+    cp.max_ratio = 1000.0;
+    cp.void_val = -1.0;
+    return cp;
+}
+
+//Terms of the correction of samples j0 to j1-1 of one line which only
+//depend on the geometry, and so are shared by the diagonal terms: the
+//antenna correction, and the cosine of the local incidence angle.
+inline void geometry_terms(const rdc_geom *geom_line, double *antcors, double *cos_incs, long j0, long j1)
+{
+    for (long j = j0; j < j1; ++j){
+        antcors[j] = geom_line[j].antcor / antenna_pattern(geom_line[j].look); // antenna correction due to original image not using DEM
+        cos_incs[j] = cos((double)geom_line[j].theta);
+    }
+}
+
+//Corrects samples j0 to j1-1 of one line of a diagonal covariance matrix
+//term (amp_in), giving the corrected line (amp_cor), the correction ratio,
+//and the validity mask (1 for void pixels).  area_fe_vec is the area
+//correction applied by the UAVSAR processor (see compute_area_fe), which is
+//removed.  With a vegetation correction LUT (veg_table, of
+//VEG_TABLE_SIZE x VEG_TABLE_SIZE), pol is 1, 2, or 3 for HHHH, HVHV, or
+//VVVV; without one (NULL), only the area correction is done.  amp_cor_prev
+//is the corrected previous line (zero for the first line), whose values
+//the vegetation correction keeps where the ratio is not a number.
+void correct_term(const rdc_geom *geom_line, const double *antcors, const double *cos_incs,
+                  const float *area_fe_vec, const float *veg_table, int pol, const correction_params &cp,
+                  const float *amp_in, const float *amp_cor_prev, float *amp_cor, float *mask_array, float *rtc_ratio,
+                  long j0, long j1)
+{
+    float cs;
+    int e_look, e_slope;
+    double inc_cor, r_look, slope_actual_r, antcor;
+
+    for (long j = j0; j < j1; ++j)
+        amp_cor[j] = amp_cor_prev[j];
+
+    if (veg_table != NULL){
+        for (long j = j0; j < j1; ++j) {
+            // Remove JPL correction factor
+            rtc_ratio[j] = area_fe_vec[j];
+
+            if (geom_line[j].area < 1.0e-6) { // Negligible area calculated for coordinate
+              mask_array[j] = 1; // Added by Michael Denbina to keep track of void pixels. 1 = void pixel
+            }
+            else {
+                inc_cor = geom_line[j].theta;
+                r_look = geom_line[j].look;
+                slope_actual_r=geom_line[j].slope;
+
+                antcor = antcors[j];
+                // AREA CORRECTION, and ANTENNA SUPPLEMENTAL CORRECTION FOR TOPO
+                rtc_ratio[j] = rtc_ratio[j]*(cp.area_ref/geom_line[j].area)/(cos_incs[j])*antcor;
+
+                if ( (inc_cor > cp.inc_tol) || (inc_cor < cp.inc_ltol) || (r_look < 0.35 && fabs(slope_actual_r) > 0.1) ) {
+                  mask_array[j] = 1; // Added by Michael Denbina to keep track of void pixels. 1 = void pixel
+                }
+                else {
+                  mask_array[j] = 0; // Added by Michael Denbina to keep track of void pixels.  0 = valid pixel
+
+                  e_look = (int) (r_look*180/PI)*10;
+                  e_slope= (int) (slope_actual_r*180/PI+90.)*10/2;
+
+                  if(e_look < 0 || e_look > VEG_TABLE_SIZE-1 || e_slope <0 || e_slope > VEG_TABLE_SIZE-1 ) cs = 1.0;
+                  else cs = veg_table[e_slope*VEG_TABLE_SIZE+e_look]; // VEGETATION Table lookup
+
+                  if (cs > 0.001)
+                  switch (pol) {
+                  case 1:
+                  case 2:
+                  case 3:
+                    rtc_ratio[j] = rtc_ratio[j]/cs*veg_table[450*VEG_TABLE_SIZE+350];
+                    break;
+                  }
+                  else {
+                      mask_array[j] = 1;
+                  }
+                }
+            }
+            if (!(amp_cor[j] <= DBL_MAX && amp_cor[j] >= -DBL_MAX)) {
+                mask_array[j] = 1;
+            }
+
+            // Apply upper and lower limits to correction factor.
+            if (rtc_ratio[j] < cp.min_ratio) {
+                rtc_ratio[j] = cp.min_ratio;
+            }
+            else if (rtc_ratio[j] > cp.max_ratio) {
+                rtc_ratio[j] = cp.max_ratio;
+            }
+
+            // If mask is set to void, set correction factor to void.
+            if (mask_array[j] == 1) {
+                rtc_ratio[j] = cp.void_val;
+                amp_cor[j] = cp.void_val;
+            }
+
+            // Update amp_cor, in case rtc_ratio changed.
+            if (rtc_ratio[j] > 0) {
+                amp_cor[j] = rtc_ratio[j] * amp_in[j];
+            }
+        }
+    }
+    else {
+        for (long j = j0; j < j1; ++j) {
+            // Remove JPL correction factor, and apply the antenna correction
+            antcor = antcors[j];
+            rtc_ratio[j] = area_fe_vec[j]*antcor;
+
+            if (geom_line[j].area < 1.0e-6) { //No area calculated for coordinate
+                mask_array[j] = 1; // void pixel
+            }
+            else {
+                inc_cor = geom_line[j].theta;
+                if (inc_cor > cp.inc_tol || (inc_cor < cp.inc_ltol)) { //Pixel is in shadow
+                  mask_array[j] = 1; // void pixel
+                }
+                else {
+                  rtc_ratio[j] = rtc_ratio[j]*(cp.area_ref/geom_line[j].area)/cos_incs[j];
+                  mask_array[j] = 0; // valid pixel
+                }
+            }
+            amp_cor[j] = rtc_ratio[j] * amp_in[j];
+
+            // Apply upper and lower limits to correction factor.
+            if (rtc_ratio[j] < cp.min_ratio) {
+                rtc_ratio[j] = cp.min_ratio;
+            }
+            else if (rtc_ratio[j] > cp.max_ratio) {
+                rtc_ratio[j] = cp.max_ratio;
+            }
+
+            // If mask is set to void, set correction factor to void.
+            if (mask_array[j] == 1) {
+                rtc_ratio[j] = cp.void_val;
+                amp_cor[j] = cp.void_val;
+            }
+
+            // Update amp_cor, in case rtc_ratio changed.
+            if (rtc_ratio[j] > 0) {
+                amp_cor[j] = rtc_ratio[j] * amp_in[j];
+            }
+        }
+    }
+}
+
+//Geocodes n GRD pixels, given their RDC coordinates from the
+//transformation look up table (gc), by bilinear interpolation of nplanes
+//RDC images of width x height held in memory (rdc), as in uavsar_geocode.
+//Consecutive samples of the RDC and GRD images are stride floats apart
+//(e.g., 2 for the real or imaginary part of a complex image).  Pixels which
+//fall outside the RDC image are set to 0.
+void geocode_pixels(const std::complex<float> *gc, long n, long width, long height,
+                    int nplanes, const float *const *rdc, float *const *grd, int stride)
+{
+    float ranpix, azpix, xbound = (float)width-1.0f, ybound = (float)height-1.0f;
+    for (long j = 0; j < n; ++j){
+        ranpix = gc[j].real();
+        azpix = gc[j].imag();
+        if (ranpix <= 0 || ranpix >= xbound || azpix <= 0 || azpix >= ybound || azpix != azpix){
+            for (int k = 0; k < nplanes; ++k)
+                grd[k][j*stride] = 0.0f;
+            continue;
+        }
+        long line1 = (long)floor(azpix)*width*stride, line2 = (long)ceil(azpix)*width*stride;
+        for (int k = 0; k < nplanes; ++k)
+            grd[k][j*stride] = bilinear_interp(ranpix, azpix, rdc[k]+line1, rdc[k]+line2, stride);
+    }
+}
+
+#endif
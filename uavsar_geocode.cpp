@@ -8,18 +8,28 @@
 #include <math.h>
 #include <cstring>
 #include <cstdlib>
+#include "bilinear.h"
 using namespace std;
 
 int main(int argc, char* argv[]){
 
 	int ix1, ix2, iy1, iy2, i_bound_first_flag;
 	long width, height, size, i_bound_first, i_bound_last, j_bound_first, j_bound_last, width_LUT, height_LUT, i_stop, j_stop, j_out;
+	long max_lines, block_lines, block_rows, az_first, az_last, buf_first, buf_count, chunk_first, chunk_last, keep;
 	float x1, x2, y1, y2, denom, ranpix, azpix, xbound, ybound;
 	double corner_lat, corner_lon, temp, deg_unit;
 	string name_int, name_LUT, name_out, lutrsc_name, rsc_name;
 
 	//Get command line arguments
+	max_lines = 0;
 	switch (argc){
+		case 8:
+			max_lines = atol(argv[7]);
+			if (max_lines < 2){
+				cout << "Error: max lines in memory must be at least 2\n";
+				exit(1);
+			}
+			//fall through
 		case 7:
 			name_int = argv[1];
 			width = atol(argv[2]);
@@ -30,7 +40,7 @@ int main(int argc, char* argv[]){
 			break;
 		default:
 			cout << "Error: invalid number of arguments\n";
-			cout << "Usage: " << argv[0] << " <name_int>  <width in>  <LUT>  <name_out>  <width out>  <height out> \n";
+			cout << "Usage: " << argv[0] << " <name_int>  <width in>  <LUT>  <name_out>  <width out>  <height out>  [max lines in memory] \n";
 			exit(1);
 	}
 
@@ -63,55 +73,123 @@ int main(int argc, char* argv[]){
 	xbound = (float)width-1.0f;
 	ybound = (float)height-1.0f;
 
-	//Create vector-vectors for data
-	vector<vector<float> > int_in(height, vector<float>(width,0));
-	vector<complex<float> > LUT_in(width_LUT,0);
-	vector<float> int_out(width_LUT,0);
+	//If no limit on the number of input lines held in memory was given,
+	//load the whole image.  Otherwise, the output is processed in blocks of
+	//rows.  For each block, the range of input lines needed is found from
+	//the transformation LUT, and this range is streamed through a buffer of
+	//at most max_lines lines, in chunks overlapping by one line so that
+	//every pixel's bilinear neighbours are in the same chunk.
+	if (max_lines <= 0 || max_lines > height)
+		max_lines = height;
+	block_rows = 256;
+	
+	cout << "Input lines held in memory: " << max_lines << " of " << height << "\n";
+
+	//Create vectors for data
+	vector<float> int_in(max_lines*width,0);
+	vector<complex<float> > LUT_in(block_rows*width_LUT,0);
+	vector<float> int_out(block_rows*width_LUT,0);
+	vector<char> done(block_rows*width_LUT,0);
+	vector<long> pix_line(block_rows*width_LUT,0), order(block_rows*width_LUT,0), line_start, line_next;
+	buf_first = 0;
+	buf_count = 0;
 	
 	//Load input intensity data
-	for (long i = 0; i < height; ++i)
-		int_flin.read((char *) &int_in[i][0], sizeof(float)*width);
+	if (max_lines == height){
+		int_flin.read((char *) &int_in[0], sizeof(float)*width*height);
+		buf_count = height;
+	}
 
 	cout << "\n";
 	//Enter loop to geocode data using bilinear interpolation
-	for (long i = 0; i < height_LUT; ++i){
+	for (long i0 = 0; i0 < height_LUT; i0 += block_rows){
 
-		if (i % 1000 == 0)
-			cout << "Processed line " << i << " of " << height_LUT << "\r" << flush;
+		block_lines = block_rows;
+		if (i0 + block_lines > height_LUT)
+			block_lines = height_LUT - i0;
+
+		if (i0 % 1000 < block_rows)
+			cout << "Processed line " << i0 << " of " << height_LUT << "\r" << flush;
 		
 		//Read in CPX format LUT
-		LUT_flin.read((char *) &LUT_in[0], sizeof(float)*2*width_LUT);
+		LUT_flin.read((char *) &LUT_in[0], sizeof(float)*2*width_LUT*block_lines);
 		
-		for (long j = 0; j < width_LUT; ++j){
+		//Find the range of input lines needed by this block
+		az_first = height;
+		az_last = -1;
+		for (long k = 0; k < block_lines*width_LUT; ++k){
+			ranpix = LUT_in[k].real();
+			azpix = LUT_in[k].imag();
+			done[k] = 1;
+			int_out[k] = 0.0f;
+			if (ranpix <= 0 || ranpix >= xbound || azpix <= 0 || azpix >= ybound || azpix != azpix)
+				continue;
+			done[k] = 0;
+			iy1 = (int)floor(azpix);
+			iy2 = (int)ceil(azpix);
+			pix_line[k] = iy1;
+			if (iy1 < az_first) az_first = iy1;
+			if (iy2 > az_last) az_last = iy2;
+		}
 
-			ranpix = LUT_in[j].real();
-			azpix = LUT_in[j].imag();
+		//Sort the pixels to geocode by their first input line (counting
+		//sort), so that each chunk only visits the pixels it can contain:
+		//order[line_start[l-az_first]] to order[line_start[l-az_first+1]-1]
+		//are the pixels whose first input line is l.
+		if (az_last >= az_first){
+			line_start.assign(az_last-az_first+2, 0);
+			for (long k = 0; k < block_lines*width_LUT; ++k)
+				if (!done[k])
+					++line_start[pix_line[k]-az_first+1];
+			for (long l = 0; l < az_last-az_first+1; ++l)
+				line_start[l+1] += line_start[l];
+			line_next = line_start;
+			for (long k = 0; k < block_lines*width_LUT; ++k)
+				if (!done[k])
+					order[line_next[pix_line[k]-az_first]++] = k;
+		}
 
-			if (ranpix <= 0 || ranpix >= xbound || azpix <= 0 || azpix >= ybound){
-				int_out[j] = 0.0f;
-				continue;
+		//Walk through the needed lines in chunks
+		chunk_last = az_first - 1;
+		for (chunk_first = az_first; chunk_last < az_last; chunk_first += max_lines-1){
+
+			chunk_last = chunk_first + max_lines - 1;
+			if (chunk_last > az_last)
+				chunk_last = az_last;
+
+			//Load the chunk, keeping lines already in the buffer
+			if (chunk_first < buf_first || chunk_last >= buf_first + buf_count){
+				keep = 0;
+				if (chunk_first >= buf_first && chunk_first < buf_first + buf_count){
+					keep = buf_first + buf_count - chunk_first;
+					memmove(&int_in[0], &int_in[(chunk_first-buf_first)*width], sizeof(float)*width*keep);
+				}
+				int_flin.seekg(sizeof(float)*width*(chunk_first+keep), ios::beg);
+				int_flin.read((char *) &int_in[keep*width], sizeof(float)*width*(chunk_last-chunk_first+1-keep));
+				buf_first = chunk_first;
+				buf_count = chunk_last - chunk_first + 1;
 			}
 
-			x1 = floor(ranpix); ix1 = (int)x1;
-			x2 = ceil(ranpix); ix2 = (int)x2;
-			y1 = floor(azpix); iy1 = (int)y1;
-			y2 = ceil(azpix); iy2 = (int)y2;
-			if (fabs(ranpix-x1) < 1.0e-5 && fabs(azpix-y1) < 1.0e-5)
-				int_out[j] = int_in[iy1][ix1];
-			else if (fabs(ranpix-x1) < 1.0e-5)
-				int_out[j] = (y2-azpix)*int_in[iy1][ix1] + (azpix-y1)*int_in[iy2][ix1];
-			else if (fabs(azpix-y1) < 1.0e-5)
-				int_out[j] = (x2-ranpix)*int_in[iy1][ix1] + (ranpix-x1)*int_in[iy1][ix2];
-			else {						
-				int_out[j] = (x2-ranpix)*(y2-azpix)*int_in[iy1][ix1]
-				       + (ranpix-x1)*(y2-azpix)*int_in[iy1][ix2]
-   				       + (x2-ranpix)*(azpix-y1)*int_in[iy2][ix1]
-				       + (ranpix-x1)*(azpix-y1)*int_in[iy2][ix2];
+			for (long m = line_start[chunk_first-az_first]; m < line_start[chunk_last-az_first+1]; ++m){
+
+				long k = order[m];
+				if (done[k])
+					continue;
+
+				ranpix = LUT_in[k].real();
+				azpix = LUT_in[k].imag();
+
+				iy1 = (int)floor(azpix);
+				iy2 = (int)ceil(azpix);
+				if (iy1 < buf_first || iy2 >= buf_first + buf_count)
+					continue;
+				
+				int_out[k] = bilinear_interp(ranpix, azpix, &int_in[(iy1-buf_first)*width], &int_in[(iy2-buf_first)*width]);
+				done[k] = 1;
 			}
-						
 		}
 		
-		int_flout.write((char *) &int_out[0], sizeof(float)*width_LUT);
+		int_flout.write((char *) &int_out[0], sizeof(float)*width_LUT*block_lines);
 	}
 
 	cout << "\n\nDone" << endl;
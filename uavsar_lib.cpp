@@ -0,0 +1,155 @@
+//Shared library (libuavsar.so) with the radiometric correction of
+//uavsar_calib and the geocoding of uavsar_geocode, so that they can be
+//called in-process (see python/uavsar_lib.py) on images held in memory or
+//memory mapped, instead of running the programs on files.  The images are
+//passed as pointers to row-major arrays, which are read and written in
+//place.  The DEM facet model is not included: its geometry is computed by
+//uavsar_calib (-g), and then passed to uavsar_correct.
+
+#include <string>
+#include <fstream>
+#include <complex>
+#include <vector>
+#include <algorithm>
+#include "load_ann.h"
+#include "uavsar_core.h"
+
+using namespace std;
+
+extern "C" {
+
+//Calibrates the covariance matrix terms of an MLC image of height x width
+//pixels, as uavsar_calib does with -G: ndiag diagonal (float) terms, either
+//one of HHHH, HVHV, or VVVV, or all three in that order followed by the
+//noffdiag = 3 off-diagonal (complex) terms HHHV, HHVV, and HVVV.
+//
+//  annfile: annotation file of the scene.
+//  geom: facet model geometry, GEOM_PLANES planes of height x width (the
+//      contents of a file saved with uavsar_calib -g).
+//  pols: polarization of each diagonal term (1, 2, or 3 for HHHH, HVHV,
+//      or VVVV).
+//  amp_in, amp_out: input and calibrated diagonal terms (amp_out must not
+//      be the same array as amp_in).
+//  veg_tables: vegetation correction LUT of each diagonal term
+//      (VEG_TABLE_SIZE x VEG_TABLE_SIZE, as read with -c), or NULL for the
+//      area correction only.
+//  ratio_out: correction ratio of each diagonal term (-r), or NULL.  An
+//      element can also be NULL.
+//  mask_out: validity mask (-m), or NULL.
+//  cpx_in, cpx_out: input and calibrated off-diagonal terms, as pairs of
+//      floats (the same array can be given for both).
+//  nthreads: number of worker threads (-n).
+//
+//Returns 0, 1 if the annotation file cannot be opened, 2 if the image
+//dimensions do not match the annotation file, or 3 if the terms are not
+//one of the combinations above.
+int uavsar_correct(const char *annfile, long height, long width, const float *geom,
+                   int ndiag, const int *pols, const float *const *amp_in, const float *const *veg_tables,
+                   float *const *amp_out, float *const *ratio_out, float *mask_out,
+                   int noffdiag, const float *const *cpx_in, float *const *cpx_out, int nthreads)
+{
+    par_struct par;
+    peg_struct peg;
+
+    if ((ndiag != 1 || noffdiag != 0) && (ndiag != 3 || noffdiag != 3))
+        return 3;
+
+    //load_ann exits if the file cannot be opened, so check first
+    par.ann = annfile;
+    if (!ifstream(annfile).is_open())
+        return 1;
+    load_ann(par, peg);
+    if (par.height != height || par.width != width)
+        return 2;
+
+    init_peg(peg);
+    vector<float> area_fe_vec(width,0);
+    compute_area_fe(peg, par, area_fe_vec);
+    const correction_params cp = make_correction_params(par);
+
+    //The first line starts from zeros, like the corrected lines of the
+    //previous block in uavsar_calib
+    vector<float> zero_line(width,0);
+    vector<rdc_geom> geom_block(CORRECTION_BLOCK_LINES*width);
+    vector<vector<float> > mask_arrays(ndiag, vector<float>(CORRECTION_BLOCK_LINES*width,0)),
+        rtc_ratios(ndiag, vector<float>(CORRECTION_BLOCK_LINES*width,0));
+
+    for (long i0 = 0; i0 < height; i0 += CORRECTION_BLOCK_LINES){
+        long nlines = min(CORRECTION_BLOCK_LINES, height-i0), n = nlines*width;
+        for (int p = 0; p < GEOM_PLANES; ++p)
+            set_plane(&geom_block[0], n, p, geom + (p*height + i0)*width);
+
+        run_threads(nthreads, width, [&](long j0, long j1){
+            vector<double> antcors(width), cos_incs(width);
+            for (long r = 0; r < nlines; ++r){
+                long i = i0 + r;
+                const rdc_geom *geom_line = &geom_block[r*width];
+                geometry_terms(geom_line, &antcors[0], &cos_incs[0], j0, j1);
+                for (int k = 0; k < ndiag; ++k)
+                    correct_term(geom_line, &antcors[0], &cos_incs[0], &area_fe_vec[0], veg_tables ? veg_tables[k] : NULL, pols[k], cp,
+                                 amp_in[k] + i*width, i > 0 ? amp_out[k] + (i-1)*width : &zero_line[0], amp_out[k] + i*width,
+                                 &mask_arrays[k][r*width], &rtc_ratios[k][r*width], j0, j1);
+
+                for (int t = 0; t < noffdiag; ++t){
+                    const complex<float> *in = (const complex<float> *) cpx_in[t] + i*width;
+                    complex<float> *out = (complex<float> *) cpx_out[t] + i*width;
+                    if (out != in)
+                        copy(in+j0, in+j1, out+j0);
+                    calibrate_offdiag(out, &rtc_ratios[COV_PAIRS[t][0]][r*width], &rtc_ratios[COV_PAIRS[t][1]][r*width], cp.void_val, j0, j1);
+                }
+            }
+        });
+
+        for (int k = 0; k < ndiag; ++k)
+            if (ratio_out && ratio_out[k])
+                copy(rtc_ratios[k].begin(), rtc_ratios[k].begin()+n, ratio_out[k] + i0*width);
+
+        //The mask is void where any of the diagonal terms is void
+        if (mask_out){
+            float *mask = mask_out + i0*width;
+            copy(mask_arrays[0].begin(), mask_arrays[0].begin()+n, mask);
+            for (int k = 1; k < ndiag; ++k)
+                for (long j = 0; j < n; ++j)
+                    mask[j] = max(mask[j], mask_arrays[k][j]);
+        }
+    }
+    return 0;
+}
+
+//Geocodes RDC images of height x width pixels to GRD images of grd_height
+//x grd_width pixels by bilinear interpolation, as uavsar_geocode does:
+//nfloat float images (rdc to grd), and ncpx complex images given as pairs
+//of floats (rdc_cpx to grd_cpx).  trans is the transformation look up
+//table (uavsar_calib -u), with the range and azimuth pixel coordinates of
+//each GRD pixel.  Returns 0.
+int uavsar_geocode(const float *trans, long grd_height, long grd_width, long height, long width,
+                   int nfloat, const float *const *rdc, float *const *grd,
+                   int ncpx, const float *const *rdc_cpx, float *const *grd_cpx, int nthreads)
+{
+    const complex<float> *gc = (const complex<float> *) trans;
+
+    //The real and imaginary parts of the complex images are geocoded as
+    //planes of their own, with a stride of 2 floats
+    vector<const float *> rdc_parts(2*ncpx);
+    for (int k = 0; k < ncpx; ++k){
+        rdc_parts[2*k] = rdc_cpx[k];
+        rdc_parts[2*k+1] = rdc_cpx[k] + 1;
+    }
+
+    run_threads(nthreads, grd_height*grd_width, [&](long j0, long j1){
+        vector<float *> grd_planes(nfloat), grd_parts(2*ncpx);
+        for (int k = 0; k < nfloat; ++k)
+            grd_planes[k] = grd[k] + j0;
+        for (int k = 0; k < ncpx; ++k){
+            grd_parts[2*k] = grd_cpx[k] + 2*j0;
+            grd_parts[2*k+1] = grd_cpx[k] + 2*j0 + 1;
+        }
+        if (nfloat > 0)
+            geocode_pixels(gc + j0, j1-j0, width, height, nfloat, &rdc[0], &grd_planes[0], 1);
+        if (ncpx > 0)
+            geocode_pixels(gc + j0, j1-j0, width, height, 2*ncpx, &rdc_parts[0], &grd_parts[0], 2);
+    });
+    return 0;
+}
+
+}